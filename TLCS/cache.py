@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import sys
+
+CACHE_VERSION = 1  # format of the entries, part of the code version
+CACHE_MAX_MB = 200
+WEIGHT_FILES = ('trained_model', 'trained_actor', 'trained_model.h5')  # files or folders of the weights in a model folder
+CODE_FILES = ('testing_simulation.py', 'generator.py', 'topology.py', 'metrics.py', 'model.py', 'fake_traci.py', 'utils.py')  # code that decides the result of a test episode
+SCENARIO_KEYS = ('backend', 'max_steps', 'n_cars_generated', 'streaming_demand', 'turning_routes', 'fidelity', 'green_duration', 'yellow_duration', 'delta', 'num_states', 'num_actions', 'sumocfg_file_name', 'net_file_name')
+
+
+def digest_paths(paths):
+    """
+    sha256 of the names and contents of the given files, and of the files in the given folders
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        files = [path]
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        for file_path in files:
+            digest.update(os.path.relpath(file_path, os.path.dirname(path)).replace(os.sep, '/').encode() + b'\0')
+            with open(file_path, 'rb') as file:
+                for block in iter(lambda: file.read(1 << 20), b''):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def weights_digest(model_path):
+    """
+    Hash of the weights of a model folder, whatever its number, or None if it has no weights
+    """
+    paths = [os.path.join(model_path, name) for name in WEIGHT_FILES if os.path.exists(os.path.join(model_path, name))]
+    return digest_paths(paths) if paths else None
+
+
+def code_version():
+    """
+    Hash of the code of the test episodes
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    return '%i-%s' % (CACHE_VERSION, digest_paths([os.path.join(here, name) for name in CODE_FILES if os.path.exists(os.path.join(here, name))])[:16])
+
+
+def scenario_parameters(config, seed):
+    """
+    Parameters of a test episode from the testing configuration, with the contents of the SUMO configuration and of
+    the network it runs on
+    """
+    scenario = {key: config[key] for key in SCENARIO_KEYS}
+    scenario['seed'] = seed
+    scenario['sumocfg'] = digest_paths([os.path.join('intersection', config['sumocfg_file_name'])])[:16]
+    scenario['net'] = digest_paths([os.path.join('intersection', config['net_file_name'])])[:16]
+    return scenario
+
+
+def episode_result(Simulation, simulation_time):
+    """
+    Result of the test episode just run, as stored in the cache: the totals and the points of the plots
+    """
+    rewards = Simulation.reward_series
+    queue = Simulation.queue_length_series
+    return {
+        'simulation_time': simulation_time,
+        'reward': float(rewards.sum),
+        'queue_mean': float(queue.mean),
+        'queue_max': float(queue.max),
+        'reward_points': [float(point) for point in rewards.points],
+        'reward_bucket': rewards.bucket,
+        'queue_points': [float(point) for point in queue.points],
+        'queue_bucket': queue.bucket,
+    }
+
+
+class EvaluationCache:
+    """
+    Results of test episodes in a folder, one json file per episode named after the hash of the weights of the model,
+    the parameters of the scenario and the version of the code. Changed weights, settings or code give a new key, so a
+    stale result is never returned; the least recently used entries are evicted once the folder exceeds max_mb
+    """
+    def __init__(self, folder, max_mb=CACHE_MAX_MB):
+        self._folder = folder
+        self._max_bytes = int(max_mb * 1024 * 1024)
+        self._code = code_version()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(folder, exist_ok=True)
+
+
+    def key(self, weights, scenario):
+        parts = {'weights': weights, 'scenario': scenario, 'code': self._code}
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:32], parts
+
+
+    def get(self, key):
+        """
+        Cached result of the key, or None
+        """
+        file_path = os.path.join(self._folder, key + '.json')
+        try:
+            with open(file_path) as file:
+                entry = json.load(file)
+            os.utime(file_path)  # recently used, evicted last
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry['result']
+
+
+    def put(self, key, parts, result):
+        file_path = os.path.join(self._folder, key + '.json')
+        temporary_path = file_path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump({'parts': parts, 'result': result}, file)
+        os.replace(temporary_path, file_path)  # a concurrent reader never sees a partial entry
+        self.evict()
+
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self._folder):
+            if name.endswith('.json'):
+                stat = os.stat(os.path.join(self._folder, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        return entries
+
+
+    def evict(self, max_bytes=None):
+        """
+        Remove the least recently used entries until the folder fits in max_bytes. Returns the number removed
+        """
+        max_bytes = self._max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, name in entries:
+            if total <= max_bytes:
+                break
+            os.remove(os.path.join(self._folder, name))
+            total -= size
+            removed += 1
+        return removed
+
+
+    def invalidate(self, **parts):
+        """
+        Remove the entries whose key was built with the given parts (weights, code, or any scenario parameter).
+        Without parts, remove every entry. Returns the number removed
+        """
+        removed = 0
+        for _, _, name in self._entries():
+            file_path = os.path.join(self._folder, name)
+            if parts:
+                with open(file_path) as file:
+                    entry_parts = json.load(file)['parts']
+                values = dict(entry_parts['scenario'], weights=entry_parts['weights'], code=entry_parts['code'])
+                if any(values.get(part) != value for part, value in parts.items()):
+                    continue
+            os.remove(file_path)
+            removed += 1
+        return removed
+
+
+    def prune(self):
+        """
+        Remove the entries of other versions of the code, which can no longer be hit
+        """
+        removed = 0
+        for _, _, name in self._entries():
+            file_path = os.path.join(self._folder, name)
+            with open(file_path) as file:
+                code = json.load(file)['parts']['code']
+            if code != self._code:
+                os.remove(file_path)
+                removed += 1
+        return removed
+
+
+    @property
+    def size(self):
+        """
+        Number of entries and their bytes
+        """
+        entries = self._entries()
+        return len(entries), sum(size for _, size, _ in entries)
+
+
+if __name__ == "__main__":
+    # python cache.py <cache folder> [--clear | --prune | --model <model folder> | --max-mb <MB>]
+    Cache = EvaluationCache(sys.argv[1])
+    option = sys.argv[2] if len(sys.argv) > 2 else None
+    if option == '--clear':
+        print('Removed', Cache.invalidate(), 'entries')
+    elif option == '--prune':
+        print('Removed', Cache.prune(), 'entries of other code versions')
+    elif option == '--model':
+        print('Removed', Cache.invalidate(weights=weights_digest(sys.argv[3])), 'entries of', sys.argv[3])
+    elif option == '--max-mb':
+        print('Evicted', Cache.evict(int(float(sys.argv[3]) * 1024 * 1024)), 'entries')
+    entries, size = Cache.size
+    print('----- Evaluation cache:', entries, 'entries,', round(size / 1024 / 1024, 2), 'MB - code version', code_version())
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import os
+import socket
+import sys
+import timeit
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from topology import load_topology
+from training_simulation import param_to_green_duration
+from utils import import_train_configuration
+
+MAX_BATCH = 64  # states evaluated in one forward pass at most
+MAX_WAIT = 0.002  # seconds a batch waits for more requests after the first one
+RELOAD_INTERVAL = 2.0  # seconds between checks for new weights in the model folder
+LATENCY_HISTORY = 10000  # latencies kept for the percentiles
+
+
+class Policy:
+    """
+    Trained networks of a model folder, evaluated on a batch of states
+    """
+    def __init__(self, model_path):
+        import tensorflow as tf
+        self._q_network = tf.keras.models.load_model(os.path.join(model_path, 'trained_model'), compile=False)
+        self._actor_network = tf.keras.models.load_model(os.path.join(model_path, 'trained_actor'), compile=False)
+
+    def __call__(self, states):
+        q_values, _ = self._q_network(states)
+        params = self._actor_network(states)
+        return np.argmax(np.asarray(q_values), axis=1), np.asarray(params)
+
+
+def weights_version(model_path):
+    """
+    Modification time of the saved networks, which changes when a training session saves new weights
+    """
+    times = []
+    for name in ('trained_model', 'trained_actor'):
+        saved_model = os.path.join(model_path, name, 'saved_model.pb')
+        times.append(os.path.getmtime(saved_model) if os.path.exists(saved_model) else 0)
+    return max(times)
+
+
+class ControllerServer:
+    """
+    Serves the decisions of a trained policy over a socket, one JSON message per line. Requests of concurrent
+    connections are gathered into one forward pass, and new weights saved in the model folder are loaded in the
+    background and swapped in between two batches, so no request is dropped or waits for the reload
+    """
+    def __init__(self, model_path, num_states, green_durations, Topology, load_policy=Policy, max_batch=MAX_BATCH, max_wait=MAX_WAIT, reload_interval=RELOAD_INTERVAL):
+        self._model_path = model_path
+        self._num_states = num_states
+        self._green_durations = green_durations
+        self._Topology = Topology
+        self._load_policy = load_policy
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+        self._reload_interval = reload_interval
+        self._executor = ThreadPoolExecutor(max_workers=1)  # forward passes, one at a time
+        self._latencies = deque(maxlen=LATENCY_HISTORY)
+        self._n_requests = 0
+        self._n_batches = 0
+        self._n_states = 0
+        self._reloads = 0
+        self._version = weights_version(model_path)
+        self._policy = load_policy(model_path)
+
+
+    async def serve(self, host, port):
+        self._requests = asyncio.Queue()
+        server = await asyncio.start_server(self._handle, host, port)
+        print("----- Controller serving", self._model_path, "on", ', '.join(str(sock.getsockname()) for sock in server.sockets))
+        async with server:
+            await asyncio.gather(server.serve_forever(), self._batcher(), self._watch())
+
+
+    async def _handle(self, reader, writer):
+        """
+        One connection: {"state": [...]} or {"states": [[...], ...]} -> {"decisions": [{"action", "phase", "green_duration"}, ...]},
+        {"op": "metrics"} -> latency percentiles and counters, {"op": "reload"} -> load the weights of the model folder now
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                start = timeit.default_timer()
+                message = None
+                try:
+                    message = json.loads(line)
+                    op = message.get('op', 'decide')
+                    if op == 'decide':
+                        response = await self._decide(message, start)
+                    elif op == 'metrics':
+                        response = self.metrics()
+                    elif op == 'reload':
+                        await self._reload()
+                        response = {'version': self._version, 'reloads': self._reloads}
+                    else:
+                        response = {'error': "unknown op '%s'" % op}
+                except (ValueError, KeyError, TypeError, AttributeError) as error:
+                    response = {'error': str(error)}
+                if isinstance(message, dict) and 'id' in message:
+                    response['id'] = message['id']
+                writer.write((json.dumps(response) + '\n').encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+    async def _decide(self, message, start):
+        states = np.asarray(message['states'] if 'states' in message else [message['state']], dtype=float)
+        if states.ndim != 2 or states.shape[1] != self._num_states:
+            raise ValueError("expected states of %i values" % self._num_states)
+        future = asyncio.get_running_loop().create_future()
+        await self._requests.put((states, future))
+        actions, durations = await future
+        self._latencies.append(timeit.default_timer() - start)
+        self._n_requests += 1
+        return {'decisions': [
+            {'action': int(action), 'phase': self._Topology.green_phase(int(action)), 'green_duration': int(duration)}
+            for action, duration in zip(actions, durations)
+        ]}
+
+
+    async def _batcher(self):
+        """
+        Gather the queued requests into batches of up to max_batch states and evaluate them in one forward pass
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._requests.get()]
+            n_states = len(batch[0][0])
+            deadline = loop.time() + self._max_wait
+            while n_states < self._max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self._requests.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(request)
+                n_states += len(request[0])
+
+            states = np.concatenate([states for states, _ in batch])
+            policy = self._policy  # a reload replaces the policy between batches only
+            try:
+                actions, params = await loop.run_in_executor(self._executor, policy, states)
+                durations = param_to_green_duration(params[:, 0], self._green_durations)  # same mapping as Simulation.run
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(ValueError("policy error: %s" % error))
+                continue
+            self._n_batches += 1
+            self._n_states += len(states)
+            first = 0
+            for request_states, future in batch:
+                last = first + len(request_states)
+                future.set_result((actions[first:last], durations[first:last]))
+                first = last
+
+
+    async def _watch(self):
+        """
+        Reload the policy when a training session saves new weights in the model folder
+        """
+        while True:
+            await asyncio.sleep(self._reload_interval)
+            if weights_version(self._model_path) != self._version:
+                try:
+                    await self._reload()
+                except Exception as error:  # a save in progress, retried at the next check
+                    print("Reload failed:", error)
+
+
+    async def _reload(self):
+        version = weights_version(self._model_path)
+        # the new networks are loaded aside, the batches keep using the current ones meanwhile
+        policy = await asyncio.get_running_loop().run_in_executor(None, self._load_policy, self._model_path)
+        self._policy = policy
+        self._version = version
+        self._reloads += 1
+        print("Weights reloaded, version", version)
+
+
+    def metrics(self):
+        latencies = np.array(self._latencies) * 1000
+        return {
+            'requests': self._n_requests,
+            'batches': self._n_batches,
+            'mean_batch_size': round(self._n_states / self._n_batches, 2) if self._n_batches > 0 else 0,
+            'latency_p50_ms': round(float(np.percentile(latencies, 50)), 3) if len(latencies) > 0 else None,
+            'latency_p99_ms': round(float(np.percentile(latencies, 99)), 3) if len(latencies) > 0 else None,
+            'version': self._version,
+            'reloads': self._reloads,
+        }
+
+
+class ControllerClient:
+    """
+    Blocking client of the controller, one request at a time
+    """
+    def __init__(self, host='127.0.0.1', port=8765):
+        self._socket = socket.create_connection((host, port))
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._socket.makefile('rwb')
+
+    def _call(self, message):
+        self._file.write((json.dumps(message) + '\n').encode())
+        self._file.flush()
+        response = json.loads(self._file.readline())
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response
+
+    def decide(self, states):
+        """
+        (action, phase, green duration) of every state
+        """
+        response = self._call({'states': np.asarray(states).tolist()})
+        return [(decision['action'], decision['phase'], decision['green_duration']) for decision in response['decisions']]
+
+    def metrics(self):
+        return self._call({'op': 'metrics'})
+
+    def reload(self):
+        return self._call({'op': 'reload'})
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+
+if __name__ == "__main__":
+    # python controller.py <model folder> [port]
+    model_path = sys.argv[1]
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+    config = import_train_configuration(os.path.join(model_path, 'training_settings.ini'))  # the settings the model was trained with
+    Topology = load_topology(os.path.join('intersection', config['net_file_name']))
+    server = ControllerServer(model_path, config['num_states'], config['green_durations'], Topology)
+    asyncio.run(server.serve('127.0.0.1', port))
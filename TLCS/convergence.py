@@ -0,0 +1,164 @@
+import json
+import os
+
+import numpy as np
+
+from metrics import read_metrics
+
+# measures of the progress: (name, True if higher is better)
+PROGRESS_MEASURES = (('reward', True), ('queue', False), ('evaluation_reward', True))
+MAX_SNAPSHOTS = 20  # weights waiting for their evaluation, the oldest are dropped beyond
+
+
+class ConvergenceMonitor:
+    """
+    Follows the rolling means over window episodes of the reward, of the queue length and of the greedy evaluation
+    reward. When none of them improved by more than threshold (relative to its best) for window episodes, the
+    exploration is shortened: epsilon goes from its current value to 0 over the next window episodes. A plateau
+    after that stops the training. The weights of the best episode are kept and saved in the model folder
+    """
+    def __init__(self, path, window=10, threshold=0.01, min_episodes=20, evaluation_file=None):
+        self._path = path
+        self._evaluation_file = evaluation_file  # written by the background evaluation, if any
+        self._window = window
+        self._threshold = threshold
+        self._min_episodes = min_episodes
+        self._values = {name: [] for name, _ in PROGRESS_MEASURES}
+        self._best = {}
+        self._since_improvement = 0
+        self._decay = None  # (first episode, epsilon then, episode where epsilon reaches 0) of the shortened exploration
+        self._stopped_at = None
+        self._best_score = None
+        self._best_episode = None
+        self._best_weights = None
+        self._snapshots = {}  # weights submitted to the evaluation and not evaluated yet, by episode
+        self._evaluated = 0  # evaluation rows already read
+
+
+    def epsilon(self, episode, total_episodes):
+        """
+        Linear decay over the session, or over the shortened exploration once a plateau was found
+        """
+        epsilon = 1.0 - (episode / total_episodes)
+        if self._decay is not None:
+            start, start_epsilon, end = self._decay
+            epsilon = min(epsilon, max(0.0, start_epsilon * (end - episode) / (end - start)))
+        return epsilon
+
+
+    def keep_snapshot(self, episode, weights):
+        """
+        Keep the weights submitted to the greedy evaluation after the episode, until its result is known
+        """
+        self._snapshots[episode] = weights
+        while len(self._snapshots) > MAX_SNAPSHOTS:
+            del self._snapshots[min(self._snapshots)]  # its evaluation is too late, or failed
+
+
+    def update(self, episode, epsilon, reward, queue, get_weights):
+        """
+        Add the stats of the episode, and the greedy evaluations done since the last one. Returns True if the training
+        should stop
+        """
+        self._values['reward'].append(reward)
+        self._values['queue'].append(queue)
+
+        # the weights are scored by their greedy evaluation if there is one, else by the rolling mean of the reward
+        if self._evaluation_file is not None:
+            self._read_evaluations()
+        else:
+            score = float(np.mean(self._values['reward'][-self._window:]))
+            if self._best_score is None or score > self._best_score:
+                self._keep_best(episode, score, get_weights())
+
+        if episode + 1 < self._min_episodes or len(self._values['reward']) < self._window:
+            return False
+        improved = self._improved()
+        if improved or (self._decay is not None and episode < self._decay[2]):
+            self._since_improvement = 0  # the plateau after the shortened exploration is counted from its end
+            return False
+        self._since_improvement += 1
+        if self._since_improvement < self._window:
+            return False
+
+        # plateau
+        self._since_improvement = 0
+        if self._decay is None and epsilon > 0:
+            self._decay = (episode + 1, epsilon, episode + 1 + self._window)
+            print("----- No progress for %i episodes: epsilon goes from %.2f to 0 by episode %i" % (self._window, epsilon, episode + 2 + self._window))
+            return False
+        self._stopped_at = episode
+        print("----- No progress for %i episodes after the exploration: stopping after episode %i" % (self._window, episode + 1))
+        return True
+
+
+    def _improved(self):
+        improved = False
+        for name, higher_is_better in PROGRESS_MEASURES:
+            values = self._values[name]
+            if len(values) < self._window:
+                continue
+            mean = float(np.mean(values[-self._window:]))
+            best = self._best.get(name)
+            margin = self._threshold * abs(best) if best is not None else 0
+            if best is None or (mean > best + margin if higher_is_better else mean < best - margin):
+                improved = improved or best is not None
+                self._best[name] = mean
+        return improved
+
+
+    def _read_evaluations(self):
+        if not os.path.exists(self._evaluation_file):
+            return
+        rows = read_metrics(self._evaluation_file)
+        for evaluated_episode, reward in list(zip(rows['episode'], rows['reward']))[self._evaluated:]:
+            self._values['evaluation_reward'].append(reward)
+            weights = self._snapshots.pop(evaluated_episode, None)
+            if weights is not None and (self._best_score is None or reward > self._best_score):
+                self._keep_best(evaluated_episode, reward, weights)
+            self._evaluated += 1
+            # the evaluations complete in order, the older snapshots will not be evaluated
+            for episode in [episode for episode in self._snapshots if episode < evaluated_episode]:
+                del self._snapshots[episode]
+
+
+    def _keep_best(self, episode, score, weights):
+        """
+        Keep the weights of the best episode so far, and write them to best_weights.npz in case the session crashes
+        """
+        self._best_score = score
+        self._best_episode = episode
+        self._best_weights = weights
+        q_weights, actor_weights = weights
+        arrays = {'q_%i' % i: weight for i, weight in enumerate(q_weights)}
+        arrays.update(('actor_%i' % i, weight) for i, weight in enumerate(actor_weights))
+        np.savez(os.path.join(self._path, 'best_weights.npz'), **arrays)
+
+
+    def save_best_model(self, Agent):
+        """
+        Save the networks with the best weights in the best_model folder, like the final ones, and the summary of
+        the convergence in convergence.json
+        """
+        if self._evaluation_file is not None:
+            self._read_evaluations()  # the evaluations that completed since the last episode
+        if self._best_weights is not None:
+            final_weights = Agent.get_weights()
+            Agent.set_weights(*self._best_weights)
+            best_path = os.path.join(self._path, 'best_model')
+            os.makedirs(best_path, exist_ok=True)
+            Agent.save_model(best_path)
+            Agent.set_weights(*final_weights)
+        with open(os.path.join(self._path, 'convergence.json'), 'w') as file:
+            json.dump({
+                'best_episode': self._best_episode,
+                'best_score': self._best_score,
+                'score': 'evaluation_reward' if self._evaluation_file is not None else 'rolling_reward',
+                'stopped_at': self._stopped_at,
+                'exploration_shortened_at': self._decay[0] if self._decay is not None else None,
+            }, file, indent=2)
+
+
+    @property
+    def best_episode(self):
+        return self._best_episode
@@ -0,0 +1,108 @@
+import numpy as np
+
+from training_simulation import CELL_LIMITS, STATE_LANE_LENGTH
+
+HALTING_SPEED = 0.1  # speed threshold of the detectors, the same used by SUMO for the halting number of edges and lanes
+DETECTOR_PERIOD = 86400  # aggregation period of the detector output, which is discarded
+
+
+def cell_spans(lane_length, cell_limits=CELL_LIMITS):
+    """
+    (cell, start, end) positions on the lane of every cell, numbered from the stop line backwards. As in
+    Simulation._get_state, a car at lane position pos is at the distance STATE_LANE_LENGTH - pos from the traffic light,
+    so the cells that fall outside the lane are left out
+    """
+    limits = [-np.inf] + list(cell_limits) + [np.inf]
+    spans = []
+    for cell in range(len(limits) - 1):
+        start = min(max(STATE_LANE_LENGTH - limits[cell + 1], 0.0), lane_length)
+        end = min(max(STATE_LANE_LENGTH - limits[cell], 0.0), lane_length)
+        if end - start > 0.1:
+            spans.append((cell, round(start, 2), round(end, 2)))
+    return spans
+
+
+def cell_detector_id(lane_id, cell):
+    return 'e2_%s_%i' % (lane_id, cell)
+
+
+def lane_detector_id(lane_id):
+    return 'e2_%s' % lane_id
+
+
+def write_detector_file(Topology, file_path, cell_limits=CELL_LIMITS):
+    """
+    Write the additional file with a lane-area detector on every cell of the incoming lanes, plus one covering each lane
+    """
+    with open(file_path, "w") as additional:
+        print("<additional>", file=additional)
+        for lane_id in Topology.incoming_lanes:
+            length = Topology.lane_length(lane_id)
+            for cell, start, end in cell_spans(length, cell_limits):
+                print('    <laneAreaDetector id="%s" lane="%s" pos="%.2f" endPos="%.2f" freq="%i" file="NUL" speedThreshold="%s"/>'
+                      % (cell_detector_id(lane_id, cell), lane_id, start, end, DETECTOR_PERIOD, HALTING_SPEED), file=additional)
+            print('    <laneAreaDetector id="%s" lane="%s" pos="0.00" endPos="%.2f" freq="%i" file="NUL" speedThreshold="%s"/>'
+                  % (lane_detector_id(lane_id), lane_id, length, DETECTOR_PERIOD, HALTING_SPEED), file=additional)
+        print("</additional>", file=additional)
+    return file_path
+
+
+class DetectorObserver:
+    """
+    State and queue length of the incoming lanes read from the detectors of write_detector_file. The detectors are
+    subscribed once per episode and all their values come with one call, so the cost of an observation depends on
+    the number of cells and not on the number of vehicles
+    """
+    def __init__(self, Topology, traci_module, num_states, cell_limits=CELL_LIMITS):
+        self._traci = traci_module
+        self._num_states = num_states
+        n_cells = len(cell_limits) + 1
+        self._cell_detectors = []
+        rows = []
+        for lane_id in Topology.incoming_lanes:
+            for cell, _, _ in cell_spans(Topology.lane_length(lane_id), cell_limits):
+                self._cell_detectors.append(cell_detector_id(lane_id, cell))
+                rows.append(Topology.lane_row(lane_id) * n_cells + cell)
+        self._rows = np.array(rows, dtype=int)
+        self._lane_detectors = [lane_detector_id(lane_id) for lane_id in Topology.incoming_lanes]
+
+
+    def subscribe(self):
+        """
+        Subscribe to the detector values, once after every start of the simulation
+        """
+        constants = self._traci.constants
+        self._occupancy = constants.LAST_STEP_OCCUPANCY
+        self._mean_speed = constants.LAST_STEP_MEAN_SPEED
+        self._halting = constants.LAST_STEP_VEHICLE_HALTING_NUMBER
+        for detector_id in self._cell_detectors:
+            self._traci.lanearea.subscribe(detector_id, (self._occupancy, self._mean_speed))
+        for detector_id in self._lane_detectors:
+            self._traci.lanearea.subscribe(detector_id, (self._halting,))
+
+
+    def get_state(self):
+        """
+        Cell occupancy plus the mean speed of the occupied cells, normalized between the slowest and the fastest one
+        """
+        results = self._traci.lanearea.getAllSubscriptionResults()
+        values = [results[detector_id] for detector_id in self._cell_detectors]
+        occupancy = np.array([value[self._occupancy] for value in values])
+        mean_speed = np.array([value[self._mean_speed] for value in values])
+
+        state = np.zeros(self._num_states)
+        occupied = occupancy > 0
+        rows = self._rows[occupied]
+        state[rows] = 1
+        speed = mean_speed[occupied]
+        if len(speed) > 0 and speed.max() != speed.min():
+            state[rows] += (speed - speed.min()) / (speed.max() - speed.min())
+        return state
+
+
+    def get_queue_length(self):
+        """
+        Number of halting vehicles in the incoming lanes
+        """
+        results = self._traci.lanearea.getAllSubscriptionResults()
+        return sum(int(results[detector_id][self._halting]) for detector_id in self._lane_detectors)
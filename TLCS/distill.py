@@ -0,0 +1,240 @@
+import json
+import os
+import sys
+import timeit
+
+import numpy as np
+
+from evaluator import build_simulation
+from training_simulation import param_to_green_duration
+from utils import import_train_configuration
+
+ROLLOUT_EPISODES = 5  # episodes of the teacher whose states make the training set of the student
+ROLLOUT_EPSILON = 0.1  # random decisions in the rollouts, so that the states also cover the recovery from a mistake
+ROLLOUT_SEED = 20000  # seed of the demand of the first rollout, apart from the evaluation seeds
+HIDDEN_WIDTHS = (64, 32)
+DISTILLATION_EPOCHS = 40
+STUDENT_FILE = 'student.npz'
+
+
+def quantize(kernel):
+    """
+    Symmetric int8 quantization of a kernel, with one scale per output unit
+    """
+    scale = np.abs(kernel).max(axis=0) / 127
+    scale[scale == 0] = 1.0
+    return np.rint(kernel / scale).astype(np.int8), scale.astype(np.float32)
+
+
+def save_student(file_path, dense_layers, num_actions):
+    """
+    Save the (kernel, bias) of the layers of the student with int8 kernels
+    """
+    arrays = {'num_actions': np.array(num_actions)}
+    for i, (kernel, bias) in enumerate(dense_layers):
+        arrays['kernel_%i' % i], arrays['scale_%i' % i] = quantize(kernel)
+        arrays['bias_%i' % i] = np.asarray(bias, dtype=np.float32)
+    np.savez(file_path, **arrays)
+    return file_path
+
+
+class StudentPolicy:
+    """
+    Distilled policy evaluated with numpy alone, so a decision needs neither tensorflow nor a batch.
+    The int8 kernels are dequantized once when loaded. Called on a batch of states like controller.Policy
+    """
+    def __init__(self, file_path):
+        with np.load(file_path) as arrays:
+            self._num_actions = int(arrays['num_actions'])
+            n_layers = len([name for name in arrays.files if name.startswith('kernel_')])
+            self._layers = [(arrays['kernel_%i' % i].astype(np.float32) * arrays['scale_%i' % i], arrays['bias_%i' % i]) for i in range(n_layers)]
+        self._size = os.path.getsize(file_path)
+
+
+    def __call__(self, states):
+        x = np.asarray(states, dtype=np.float32)
+        for kernel, bias in self._layers[:-1]:
+            x = np.maximum(x @ kernel + bias, 0)
+        kernel, bias = self._layers[-1]
+        output = x @ kernel + bias
+        return np.argmax(output[:, :self._num_actions], axis=1), np.tanh(output[:, self._num_actions:])
+
+
+    def decide(self, state):
+        """
+        Action and parameter of one state
+        """
+        actions, params = self(np.asarray(state)[np.newaxis])
+        return int(actions[0]), params[0]
+
+
+    @property
+    def hidden_widths(self):
+        return [len(bias) for _, bias in self._layers[:-1]]
+
+
+    @property
+    def size(self):
+        """
+        Bytes of the saved student
+        """
+        return self._size
+
+
+class _DistillationAgent:
+    """
+    Agent of the rollouts and of the validation episodes: plays the policy (random decisions with probability epsilon),
+    keeps the states it sees if recording, and the decisions of the reference policy on them if one is given
+    """
+    def __init__(self, num_actions, param_dim):
+        self._num_actions = num_actions
+        self._param_dim = param_dim
+        self.policy = None
+        self.reference = None
+        self.recording = False
+        self.states = []
+        self.pairs = []  # (action, param, reference action, reference param) of every decision
+
+    def select_action(self, state, epsilon):
+        batch = np.asarray(state, dtype=np.float32)[np.newaxis]
+        if self.recording:
+            self.states.append(batch[0])
+        actions, params = self.policy(batch)
+        action, param = int(actions[0]), np.asarray(params[0])
+        if self.reference is not None:
+            reference_actions, reference_params = self.reference(batch)
+            self.pairs.append((action, float(param[0]), int(reference_actions[0]), float(reference_params[0][0])))
+        if np.random.random() < epsilon:
+            action = np.random.randint(0, self._num_actions)
+            param = np.random.uniform(-1, 1, self._param_dim)
+        return action, param
+
+    def add_experience(self, state, action, reward, next_state, done, param):
+        pass
+
+    def train(self):
+        pass
+
+
+def fit_student(states, actions, params, num_actions, hidden_widths=HIDDEN_WIDTHS, epochs=DISTILLATION_EPOCHS):
+    """
+    Train the student on the decisions of the teacher: cross-entropy on the actions, squared error on the parameters.
+    Returns the (kernel, bias) of its layers
+    """
+    import tensorflow as tf
+    from model import StudentNetwork
+
+    Student = StudentNetwork(num_actions, params.shape[1], hidden_widths)
+    Student.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=1e-3),
+        loss=[tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True), 'mse']
+    )
+    Student.fit(states, [actions, params], epochs=epochs, batch_size=128, validation_split=0.1, shuffle=True, verbose=2)
+    return Student.dense_layers()
+
+
+def decision_latency(decide, states):
+    """
+    p50 and p99 of the time of one decision in microseconds
+    """
+    times = []
+    for state in states:
+        start = timeit.default_timer()
+        decide(state)
+        times.append(timeit.default_timer() - start)
+    return round(float(np.percentile(times, 50)) * 1e6, 1), round(float(np.percentile(times, 99)) * 1e6, 1)
+
+
+def fidelity(pairs, green_durations):
+    """
+    Agreement of the decisions of the student with the ones of the teacher on the same states
+    """
+    actions, params, teacher_actions, teacher_params = (np.array(column) for column in zip(*pairs))
+    same_action = actions == teacher_actions
+    same_duration = param_to_green_duration(params, green_durations) == param_to_green_duration(teacher_params, green_durations)
+    return {
+        'decisions': len(pairs),
+        'action_agreement': round(float(same_action.mean()), 4),
+        'duration_agreement': round(float(same_duration.mean()), 4),
+        'decision_agreement': round(float((same_action & same_duration).mean()), 4),
+        'param_mae': round(float(np.abs(params - teacher_params).mean()), 4),
+    }
+
+
+def episode_stats(Greedy, n_episodes):
+    return {
+        'reward': sum(Greedy.reward_store[-n_episodes:]) / n_episodes,
+        'delay': sum(Greedy.cumulative_wait_store[-n_episodes:]) / n_episodes,
+        'queue': sum(Greedy.avg_queue_length_store[-n_episodes:]) / n_episodes,
+        'travel_time': sum(Greedy.avg_travel_time_store[-n_episodes:]) / n_episodes,
+    }
+
+
+def distill(model_path, config, Teacher, rollout_episodes=ROLLOUT_EPISODES, fit=fit_student):
+    """
+    Roll out the teacher, fit the student on the states of the rollouts, then play the student and the teacher greedily
+    on the evaluation seeds. Returns the report of the fidelity and the latency of the student
+    """
+    detector_file = os.path.join(model_path, 'detectors.add.xml') if config['observation'] == 'detectors' else None
+    Agent = _DistillationAgent(config['num_actions'], config['final_action'])
+    Greedy, traci_module = build_simulation(model_path, config, Agent, 'distillation_routes.rou.xml', detector_file)
+
+    print('----- Rollouts of the teacher')
+    Agent.policy = Teacher
+    Agent.recording = True
+    for episode in range(rollout_episodes):
+        simulation_time, _ = Greedy.run(ROLLOUT_SEED + episode, ROLLOUT_EPSILON)
+        print('Rollout', episode + 1, 'of', rollout_episodes, '- simulation time:', simulation_time, 's - states:', len(Agent.states))
+    Agent.recording = False
+    states = np.array(Agent.states)
+    actions, params = Teacher(states)
+
+    print('----- Fitting the student on', len(states), 'states')
+    student_file = save_student(os.path.join(model_path, STUDENT_FILE), fit(states, actions, params, config['num_actions']), config['num_actions'])
+    Student = StudentPolicy(student_file)
+
+    # the teacher on the evaluation seeds, then the student on the same seeds, checked against the teacher on the states it visits
+    seeds = config['evaluation_seeds']
+    print('----- Validation on seeds', ', '.join(str(seed) for seed in seeds))
+    for seed in seeds:
+        Greedy.run(seed, 0.0)
+    teacher_stats = episode_stats(Greedy, len(seeds))
+    Agent.policy = Student
+    Agent.reference = Teacher
+    Agent.recording = True
+    for seed in seeds:
+        Greedy.run(seed, 0.0)
+    student_stats = episode_stats(Greedy, len(seeds))
+    if config['persistent_session']:
+        traci_module.shutdown()
+
+    visited = Agent.states[-min(len(Agent.states), 2000):]
+    student_p50, student_p99 = decision_latency(Student.decide, visited)
+    teacher_p50, teacher_p99 = decision_latency(lambda state: Teacher(state[np.newaxis]), visited)
+    report = {
+        'rollout_states': len(states),
+        'student_file': STUDENT_FILE,
+        'student_bytes': Student.size,
+        'hidden_widths': Student.hidden_widths,
+        'fidelity': fidelity(Agent.pairs, config['green_durations']),
+        'latency_us': {'student_p50': student_p50, 'student_p99': student_p99, 'teacher_p50': teacher_p50, 'teacher_p99': teacher_p99},
+        'teacher': teacher_stats,
+        'student': student_stats,
+    }
+    with open(os.path.join(model_path, 'distillation.json'), 'w') as file:
+        json.dump(report, file, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    # python distill.py <model folder> [rollout episodes]
+    from controller import Policy
+
+    model_path = sys.argv[1]
+    rollout_episodes = int(sys.argv[2]) if len(sys.argv) > 2 else ROLLOUT_EPISODES
+    config = import_train_configuration(os.path.join(model_path, 'training_settings.ini'))  # the settings the model was trained with
+    report = distill(model_path, config, Policy(model_path), rollout_episodes)
+    print('----- Fidelity:', ', '.join('%s %s' % item for item in report['fidelity'].items()))
+    print('----- Latency of a decision (us): student p50 %(student_p50)s p99 %(student_p99)s - teacher p50 %(teacher_p50)s p99 %(teacher_p99)s' % report['latency_us'])
+    print('----- Greedy episodes (teacher / student):', ', '.join('%s %.1f / %.1f' % (name, report['teacher'][name], report['student'][name]) for name in report['teacher']))
+    print('----- Student saved at:', os.path.join(model_path, STUDENT_FILE), '(%i bytes)' % report['student_bytes'])
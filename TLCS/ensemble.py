@@ -0,0 +1,307 @@
+import os
+import sys
+import timeit
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import optimizers
+
+from memory import ReplayBuffer, CompactReplayBuffer
+from model import QNetwork, ActorNetwork, EnsembleQNetwork, EnsembleActorNetwork
+
+BENCHMARK_STEPS = 200
+
+
+class EnsembleAgent:
+    """
+    K P-DQN agents trained together: the weights of their networks are stacked, and one compiled training step trains
+    every member with batched matmuls. Each member has its own replay buffer, exploration and target networks.
+    The members play through the views returned by member(k), which have the interface of PDQNAgent
+    """
+    def __init__(self, members, state_dim, action_dim, param_dim, gamma=0.75, tau=0.005, buffer_size=20000, batch_size=100, num_layers=2, width_layers=64, learning_rate=1e-3, memory_size_min=0, seed=0, memory_storage='full'):
+        self.members = members
+        self.state_dim = state_dim
+        self.action_dim = action_dim
+        self.param_dim = param_dim
+        self.gamma = gamma
+        self.tau = tau
+        self.batch_size = batch_size
+        self.memory_size_min = memory_size_min
+        self.num_layers = num_layers
+        self.width_layers = width_layers
+
+        # every member of every layer of the four networks gets its own initializer seed, derived from seed
+        stride = (num_layers + 2) * members
+        self.q_network = EnsembleQNetwork(members, state_dim, action_dim, param_dim, num_layers, width_layers, seed=seed)
+        self.target_q_network = EnsembleQNetwork(members, state_dim, action_dim, param_dim, num_layers, width_layers, seed=seed + stride)
+        self.actor_network = EnsembleActorNetwork(members, state_dim, param_dim, num_layers, width_layers, seed=seed + 2 * stride)
+        self.target_actor_network = EnsembleActorNetwork(members, state_dim, param_dim, num_layers, width_layers, seed=seed + 3 * stride)
+        self._counter_steps = 0
+        self._update_freq = 100
+
+        # Adam works element by element, so one optimizer on the stacked weights is one optimizer per member
+        self.q_optimizer = optimizers.Adam(learning_rate=learning_rate)
+        self.actor_optimizer = optimizers.Adam(learning_rate=learning_rate)
+
+        if memory_storage == 'full':
+            self.replay_buffers = [ReplayBuffer(buffer_size) for _ in range(members)]
+        else:
+            self.replay_buffers = [CompactReplayBuffer(buffer_size, state_dim, param_dim, memory_storage) for _ in range(members)]
+        self._members = [_EnsembleMember(self, k, np.random.default_rng(seed + k)) for k in range(members)]
+
+        self._build()
+        self.update_target_network(self.target_q_network, self.q_network, tau=1.0)
+        self.update_target_network(self.target_actor_network, self.actor_network, tau=1.0)
+        self._train_step = tf.function(self._train_step)
+
+
+    def update_target_network(self, target, source, tau):
+        for target_param, source_param in zip(target.trainable_variables, source.trainable_variables):
+            target_param.assign(tau * source_param + (1.0 - tau) * target_param)
+
+
+    def member(self, k):
+        return self._members[k]
+
+
+    def train(self):
+        """
+        One training step of every member, on a batch sampled from the replay buffer of each of them
+        """
+        if min(buffer.size() for buffer in self.replay_buffers) < max(self.batch_size, self.memory_size_min):
+            return
+        batches = [buffer.sample_arrays(self.batch_size) for buffer in self.replay_buffers]
+        states, actions, rewards, next_states, dones, params = (np.stack(column) for column in zip(*batches))
+        self._train_step(
+            tf.constant(states, dtype=tf.float32),
+            tf.constant(actions, dtype=tf.int32),
+            tf.constant(rewards, dtype=tf.float32),
+            tf.constant(next_states, dtype=tf.float32),
+            tf.constant(dones, dtype=tf.float32)
+        )
+        self._counter_steps += 1
+        if self._counter_steps % self._update_freq == 0:
+            self.update_target_network(self.target_q_network, self.q_network, self.tau)
+            self.update_target_network(self.target_actor_network, self.actor_network, self.tau)
+
+
+    def _train_step(self, states, actions, rewards, next_states, dones):
+        # the losses of PDQNAgent.train, member by member: the losses of the members are summed, and the weights of a
+        # member only get the gradients of its own loss
+
+        # Train Q-network
+        with tf.GradientTape() as tape:
+            q_values, param_values = self.q_network(states, training=True)
+            q_values = tf.reduce_sum(tf.one_hot(actions, self.action_dim) * q_values, axis=-1)
+            next_q_values, _ = self.target_q_network(next_states)
+            next_q_values = tf.reduce_max(next_q_values, axis=-1)
+            target_q_values = rewards + self.gamma * next_q_values * (1 - dones)
+            q_loss = tf.reduce_sum(tf.reduce_mean(tf.square(q_values - target_q_values), axis=-1))
+
+        q_grads = tape.gradient(q_loss, self.q_network.trainable_variables, unconnected_gradients=tf.UnconnectedGradients.ZERO)
+        self.q_optimizer.apply_gradients(zip(q_grads, self.q_network.trainable_variables))
+
+        # Train Actor-network
+        with tf.GradientTape() as tape:
+            action_probs = self.actor_network(states, training=True)
+            sampled_actions = tf.random.categorical(tf.math.log(tf.reshape(action_probs, (-1, self.param_dim))), 1)
+            sampled_actions = tf.reshape(sampled_actions, tf.shape(action_probs)[:2])
+            action_log_probs = tf.reduce_sum(tf.math.log(action_probs) * tf.one_hot(sampled_actions, depth=self.action_dim), axis=-1)
+
+            # Calculate advantages
+            q_values, _ = self.q_network(states, training=True)
+            baseline_values = tf.reduce_sum(tf.one_hot(sampled_actions, self.action_dim) * q_values, axis=-1)
+            advantages = baseline_values - tf.reduce_mean(baseline_values, axis=-1, keepdims=True)
+
+            actor_loss = tf.reduce_sum(-tf.reduce_mean(action_log_probs * advantages, axis=-1))
+
+        actor_grads = tape.gradient(actor_loss, self.actor_network.trainable_variables)
+        self.actor_optimizer.apply_gradients(zip(actor_grads, self.actor_network.trainable_variables))
+
+
+    def get_weights(self, k):
+        """
+        Weights of the online networks of member k, in the format of PDQNAgent.get_weights
+        """
+        return [weight[k] for weight in self.q_network.get_weights()], [weight[k] for weight in self.actor_network.get_weights()]
+
+
+    def set_weights(self, k, q_weights, actor_weights):
+        for variable, weight in zip(self.q_network.weights, q_weights):
+            variable[k].assign(weight)
+        for variable, weight in zip(self.actor_network.weights, actor_weights):
+            variable[k].assign(weight)
+
+
+    def _build(self):
+        states = np.zeros((self.members, 1, self.state_dim), dtype=np.float32)
+        for network in (self.q_network, self.target_q_network, self.actor_network, self.target_actor_network):
+            network(states)
+
+
+    def close(self):
+        pass
+
+
+    def save_model(self, path):
+        """
+        Save every member like PDQNAgent.save_model, in the folders member_1 ... member_K of the model folder
+        """
+        for k in range(self.members):
+            member_path = os.path.join(path, 'member_%i' % (k + 1))
+            os.makedirs(member_path, exist_ok=True)
+            self.save_member(k, member_path)
+
+
+    def save_member(self, k, path):
+        """
+        Save member k as a QNetwork and an ActorNetwork, like PDQNAgent.save_model
+        """
+        q_weights, actor_weights = self.get_weights(k)
+        q_network = QNetwork(self.state_dim, self.action_dim, self.param_dim, self.num_layers, self.width_layers)
+        actor_network = ActorNetwork(self.state_dim, self.param_dim, self.num_layers, self.width_layers)
+        state = np.zeros((1, self.state_dim))
+        q_network(state)
+        actor_network(state)
+        q_network.set_weights(q_weights)
+        actor_network.set_weights(actor_weights)
+        q_network.save(os.path.join(path, 'trained_model'), save_format='tf')
+        actor_network.save(os.path.join(path, 'trained_actor'), save_format='tf')
+
+
+class _EnsembleMember:
+    """
+    One member of an ensemble, with the interface of PDQNAgent for the simulations. Training is done by the ensemble
+    """
+    def __init__(self, Ensemble, k, rng):
+        self._Ensemble = Ensemble
+        self._k = k
+        self._rng = rng
+
+    def select_action(self, state, epsilon):
+        Ensemble = self._Ensemble
+        if self._rng.random() < epsilon:
+            action = self._rng.integers(0, Ensemble.action_dim)
+            param = self._rng.uniform(-1, 1, Ensemble.param_dim)
+        else:
+            state = np.array([state], dtype=np.float32)
+            q_values, _ = Ensemble.q_network(state, member=self._k)
+            action = np.argmax(q_values)
+            param = Ensemble.actor_network(state, member=self._k)[0].numpy()
+        return action, param
+
+    def add_experience(self, state, action, reward, next_state, done, param):
+        self._Ensemble.replay_buffers[self._k].add((state, action, reward, next_state, done, param))
+
+    def add_experiences(self, states, actions, rewards, next_states, dones, params):
+        self._Ensemble.replay_buffers[self._k].add_batch(states, actions, rewards, next_states, dones, params)
+
+    def train(self):
+        pass
+
+    def get_weights(self):
+        return self._Ensemble.get_weights(self._k)
+
+    def set_weights(self, q_weights, actor_weights):
+        self._Ensemble.set_weights(self._k, q_weights, actor_weights)
+
+    def save_model(self, path):
+        self._Ensemble.save_member(self._k, path)
+
+
+class EnsembleSimulation:
+    """
+    Runs the episode of every member on the same demand, each with its own Simulation (built without training
+    epochs), then trains the ensemble. The stats of an episode are the means over the members
+    """
+    def __init__(self, Simulations, Ensemble, training_epochs):
+        self._Simulations = Simulations
+        self._Ensemble = Ensemble
+        self._training_epochs = training_epochs
+        self._reward_store = []
+        self._cumulative_wait_store = []
+        self._avg_queue_length_store = []
+        self._avg_travel_time_store = []
+
+
+    def run(self, episode, epsilon, next_episode=None):
+        """
+        The members play one after the other, so the scenario of the next episode is not prepared in the background
+        """
+        simulation_time = 0
+        for Simulation in self._Simulations:
+            member_time, _ = Simulation.run(episode, epsilon)
+            simulation_time += member_time
+        print("Rewards of the members:", ", ".join(str(Simulation.reward_store[-1]) for Simulation in self._Simulations))
+        for store, name in ((self._reward_store, 'reward_store'), (self._cumulative_wait_store, 'cumulative_wait_store'),
+                            (self._avg_queue_length_store, 'avg_queue_length_store'), (self._avg_travel_time_store, 'avg_travel_time_store')):
+            store.append(sum(getattr(Simulation, name)[-1] for Simulation in self._Simulations) / len(self._Simulations))
+
+        print("Training...")
+        start_time = timeit.default_timer()
+        for _ in range(self._training_epochs):
+            self._Ensemble.train()
+        training_time = round(timeit.default_timer() - start_time, 1)
+        return round(simulation_time, 1), training_time
+
+
+    @property
+    def reward_store(self):
+        return self._reward_store
+
+
+    @property
+    def cumulative_wait_store(self):
+        return self._cumulative_wait_store
+
+
+    @property
+    def avg_queue_length_store(self):
+        return self._avg_queue_length_store
+
+
+    @property
+    def avg_travel_time_store(self):
+        return self._avg_travel_time_store
+
+
+def benchmark(members, steps=BENCHMARK_STEPS, state_dim=320, action_dim=4, param_dim=1, batch_size=100, num_layers=2, width_layers=64):
+    """
+    Seconds per training step of members separate PDQNAgents, one after the other, and of one ensemble of as many
+    members, on replay buffers filled with random transitions
+    """
+    from pdqnagent import PDQNAgent
+
+    rng = np.random.default_rng(0)
+
+    def fill(add_experiences):
+        n = 2 * batch_size
+        add_experiences(rng.random((n, state_dim)), rng.integers(0, action_dim, n), rng.random(n), rng.random((n, state_dim)),
+                        np.zeros(n), rng.uniform(-1, 1, (n, param_dim)))
+
+    Agents = [PDQNAgent(state_dim, action_dim, param_dim, batch_size=batch_size, num_layers=num_layers, width_layers=width_layers) for _ in range(members)]
+    for Agent in Agents:
+        fill(Agent.add_experiences)
+    Ensemble = EnsembleAgent(members, state_dim, action_dim, param_dim, batch_size=batch_size, num_layers=num_layers, width_layers=width_layers)
+    for k in range(members):
+        fill(Ensemble.member(k).add_experiences)
+
+    def time_steps(train_step):
+        train_step()  # tracing and allocations
+        start = timeit.default_timer()
+        for _ in range(steps):
+            train_step()
+        return (timeit.default_timer() - start) / steps
+
+    separate = time_steps(lambda: [Agent.train() for Agent in Agents])
+    ensemble = time_steps(Ensemble.train)
+    return separate, ensemble
+
+
+if __name__ == "__main__":
+    # python ensemble.py [members] [steps]
+    members = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else BENCHMARK_STEPS
+    separate, ensemble = benchmark(members, steps)
+    print('----- Training step of %i members: separate agents %.2f ms, ensemble %.2f ms (%.1fx), one agent alone about %.2f ms'
+          % (members, separate * 1e3, ensemble * 1e3, separate / ensemble, separate / members * 1e3))
@@ -0,0 +1,130 @@
+import multiprocessing
+import os
+import sys
+
+from metrics import MetricsStore
+
+# metrics of the evaluation episodes: (column of the metrics store, plot file name, x label, y label)
+EVALUATION_PLOTS = [
+    ('reward', 'evaluation reward', 'Episode', 'Cumulative negative reward (greedy)'),
+    ('delay', 'evaluation delay', 'Episode', 'Cumulative delay (s) (greedy)'),
+    ('queue', 'evaluation queue', 'Episode', 'Average queue length (vehicles) (greedy)'),
+    ('travel_time', 'evaluation travel time', 'Episode', 'Average travel time of a vehicle (greedy)'),
+]
+
+
+class BackgroundEvaluator:
+    """
+    Runs greedy episodes on fixed seeds with snapshots of the agent weights in a separate process,
+    so that the learning curve of the policy is measured while the training goes on
+    """
+    def __init__(self, path, config, seeds, detector_file=None):
+        self._file_path = os.path.join(path, 'evaluation.csv')
+        # spawn: forking a process that already runs tensorflow threads is not safe
+        context = multiprocessing.get_context('spawn')
+        self._snapshots = context.Queue()
+        self._process = context.Process(target=_evaluation_worker, args=(path, config, seeds, detector_file, self._snapshots), daemon=True)
+        self._process.start()
+
+
+    def submit(self, episode, Agent):
+        """
+        Queue a snapshot of the current weights of the agent, evaluated as the policy after the given episode
+        """
+        q_weights, actor_weights = Agent.get_weights()
+        self._snapshots.put((episode, q_weights, actor_weights))
+
+
+    def close(self):
+        """
+        Wait for the evaluation of the snapshots still queued
+        """
+        self._snapshots.put(None)
+        self._process.join()
+
+
+    @property
+    def file_path(self):
+        return self._file_path
+
+
+def build_simulation(path, config, Agent, route_name, detector_file=None, fidelity='micro'):
+    """
+    Simulation running the agent without training, with its own route file in the model folder and its own sumo
+    instance (microscopic unless told otherwise, whatever the fidelity of the training). Returns it with its traci module
+    """
+    from detectors import DetectorObserver
+    from generator import TrafficGenerator
+    from session import PersistentSession
+    from topology import load_topology
+    from training_simulation import Simulation
+    from utils import set_sumo, set_traci
+
+    route_file = os.path.join(path, route_name)
+    sumo_cmd = set_sumo(False, config['sumocfg_file_name'], config['max_steps'], config['backend'], route_file, config['sumo_cores'], detector_file, fidelity)
+    traci_module = set_traci(config['backend'])
+    if config['persistent_session']:
+        traci_module = PersistentSession(traci_module)
+    Topology = load_topology(os.path.join('intersection', config['net_file_name']))
+    Observer = DetectorObserver(Topology, traci_module, config['num_states']) if detector_file is not None else None
+    TrafficGen = TrafficGenerator(config['max_steps'], config['n_cars_generated'], route_file, Topology, streaming=config['streaming_demand'], turning_routes=config['turning_routes'])
+    Greedy = Simulation(
+        Agent,
+        TrafficGen,
+        sumo_cmd,
+        config['max_steps'],
+        config['green_duration'],
+        config['yellow_duration'],
+        config['num_states'],
+        0,  # no training epochs
+        traci_module,
+        config['green_durations'],
+        Topology,
+        Observer
+    )
+    return Greedy, traci_module
+
+
+def _evaluation_worker(path, config, seeds, detector_file, snapshots):
+    # the evaluation has its own demand, sumo instance and log, next to the ones of the training
+    sys.stdout = open(os.path.join(path, 'evaluation.log'), 'w', buffering=1)
+    sys.stderr = sys.stdout
+
+    from pdqnagent import PDQNAgent
+    from visualization import Visualization
+
+    Agent = PDQNAgent(
+        config['num_states'],
+        config['num_actions'],
+        config['final_action'],
+        buffer_size=1,  # the experiences of the evaluation are not used
+        num_layers=config['num_layers'],
+        width_layers=config['width_layers']
+    )
+    Evaluation, traci_module = build_simulation(path, config, Agent, 'evaluation_routes.rou.xml', detector_file)
+
+    Metrics = MetricsStore(os.path.join(path, 'evaluation.csv'), columns=['episode', 'reward', 'delay', 'queue', 'travel_time'])
+    Plots = Visualization(path, dpi=96)
+
+    while True:
+        snapshot = snapshots.get()
+        if snapshot is None:
+            break
+        episode, q_weights, actor_weights = snapshot
+        Agent.set_weights(q_weights, actor_weights)
+        print('\n----- Evaluation of the policy after episode', episode + 1)
+        for seed in seeds:
+            simulation_time, _ = Evaluation.run(seed, 0.0)  # the seed of the demand is the episode number of Simulation.run
+            print('Seed', seed, '- simulation time:', simulation_time, 's')
+        # average over the seeds
+        n_seeds = len(seeds)
+        Metrics.append(
+            episode=episode,
+            reward=sum(Evaluation.reward_store[-n_seeds:]) / n_seeds,
+            delay=sum(Evaluation.cumulative_wait_store[-n_seeds:]) / n_seeds,
+            queue=sum(Evaluation.avg_queue_length_store[-n_seeds:]) / n_seeds,
+            travel_time=sum(Evaluation.avg_travel_time_store[-n_seeds:]) / n_seeds
+        )
+        Plots.plot_metrics(Metrics.file_path, EVALUATION_PLOTS)
+    if config['persistent_session']:
+        traci_module.shutdown()
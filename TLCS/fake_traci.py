@@ -0,0 +1,575 @@
+"""
+Pure-Python stand-in for the subset of the traci API used by the simulations.
+It reads the same sumocfg, net and route files as SUMO and moves the vehicles with a
+simple queueing model, so whole episodes can run without a SUMO installation (tests, CI)
+"""
+import heapq
+import os
+import random
+from collections import deque
+import xml.etree.ElementTree as ET
+from types import SimpleNamespace
+
+INVALID_DOUBLE_VALUE = -1073741824.0  # value returned by traci when something is not set
+HALTING_SPEED = 0.1  # a vehicle slower than this is halting and accumulates waiting time (as in SUMO)
+DEFAULT_SEED = 23423  # default seed of SUMO
+OPEN_LINK_STATES = ('G', 'g', 'o', 'O')
+DETECTOR_HALTING_SPEED = 5 / 3.6  # default speedThreshold of the lane-area detectors
+
+# variable ids of the subscriptions, as in traci.constants
+constants = SimpleNamespace(
+    LAST_STEP_VEHICLE_NUMBER=0x10,
+    LAST_STEP_MEAN_SPEED=0x11,
+    LAST_STEP_OCCUPANCY=0x13,
+    LAST_STEP_VEHICLE_HALTING_NUMBER=0x14,
+)
+
+
+class FatalTraCIError(Exception):
+    pass
+
+
+class _Vehicle:
+    __slots__ = ('id', 'edges', 'edge_index', 'lane', 'pos', 'speed', 'accel', 'max_speed', 'sigma',
+                 'length', 'min_gap', 'waiting_time', 'accumulated_waiting_time', 'adapted_travel_times', 'moved_at')
+
+    def __init__(self, veh_id, edges, vtype):
+        self.id = veh_id
+        self.edges = edges
+        self.edge_index = 0
+        self.lane = None
+        self.pos = 0.0
+        self.speed = 0.0
+        self.accel = vtype['accel']
+        self.max_speed = vtype['maxSpeed']
+        self.sigma = vtype['sigma']
+        self.length = vtype['length']
+        self.min_gap = vtype['minGap']
+        self.waiting_time = 0
+        self.accumulated_waiting_time = 0
+        self.adapted_travel_times = {}
+        self.moved_at = -1
+
+
+class FakeSumo:
+    """
+    In-process simulation engine: every lane is a queue of vehicles ordered from the stop line backwards
+    """
+    def __init__(self, sumocfg_file, seed=DEFAULT_SEED, route_files=None, additional_files=None):
+        self._rng = random.Random(seed)
+        self._time = 0
+        self._lanes = {}  # lane id -> dict with length, speed, edge and the vehicles on it (front first)
+        self._edges = {}  # edge id -> list of its lane ids
+        self._links = {}  # (lane id, next edge id) -> (tl id, link index)
+        self._tls = {}  # tl id -> dict with the phases of its program, the current phase and its remaining time
+        self._routes = {}
+        self._vtypes = {}
+        self._pending = deque()  # vehicles due but not inserted yet, ordered by departure time
+        self._vehicles = {}  # vehicles currently in the network
+        self._detectors = {}  # lane-area detector id -> dict with its lane, start, end and speed threshold
+        self._subscriptions = {}  # lane-area detector id -> subscribed variable ids
+        self._subscription_results = None  # results of the current step, like traci they change only with a step
+
+        config_dir = os.path.dirname(sumocfg_file)
+        config = ET.parse(sumocfg_file).getroot()
+        net_file = config.find('input/net-file').get('value')
+        self._load_net(os.path.join(config_dir, net_file))
+        if route_files is None:  # like SUMO, route files given on the command line replace the ones of the sumocfg
+            route_files = [os.path.join(config_dir, route_file.strip()) for route_file in config.find('input/route-files').get('value').split(',')]
+        # like SUMO, the route files are read as the simulation goes, so they must be sorted by departure time
+        self._departures = heapq.merge(*(self._read_routes(route_file) for route_file in route_files), key=lambda item: item[0])
+        self._next_departure = next(self._departures, None)
+        additional = config.find('input/additional-files')
+        if additional_files is None and additional is not None:
+            additional_files = [os.path.join(config_dir, additional_file.strip()) for additional_file in additional.get('value').split(',')]
+        for additional_file in additional_files or []:
+            self._load_detectors(additional_file)
+
+
+    def _load_net(self, net_file):
+        """
+        Read edges, lanes, signalized connections and traffic light programs, skipping junction internals
+        """
+        net = ET.parse(net_file).getroot()
+        for edge in net.iter('edge'):
+            if edge.get('function') == 'internal':
+                continue
+            lane_ids = []
+            for lane in edge.iter('lane'):
+                self._lanes[lane.get('id')] = {
+                    'edge': edge.get('id'),
+                    'length': float(lane.get('length')),
+                    'speed': float(lane.get('speed')),
+                    'vehicles': [],
+                }
+                lane_ids.append(lane.get('id'))
+            self._edges[edge.get('id')] = lane_ids
+
+        for connection in net.iter('connection'):
+            from_edge = connection.get('from')
+            if from_edge not in self._edges:
+                continue
+            lane_id = from_edge + '_' + connection.get('fromLane')
+            if connection.get('tl') is not None:
+                self._links[(lane_id, connection.get('to'))] = (connection.get('tl'), int(connection.get('linkIndex')))
+            else:
+                self._links[(lane_id, connection.get('to'))] = (None, None)
+
+        for tl_logic in net.iter('tlLogic'):
+            phases = [(int(float(phase.get('duration'))), phase.get('state')) for phase in tl_logic.iter('phase')]
+            self._tls[tl_logic.get('id')] = {'phases': phases, 'phase': 0, 'remaining': phases[0][0]}
+
+
+    def _read_routes(self, route_file):
+        """
+        Read vehicle types and routes of the route file, yielding its vehicles one at a time with their departure time
+        """
+        elements = ET.iterparse(route_file, events=('start', 'end'))
+        _, root = next(elements)
+        for event, element in elements:
+            if event != 'end':
+                continue
+            if element.tag == 'vType':
+                self._vtypes[element.get('id')] = {
+                    'accel': float(element.get('accel', 2.6)),
+                    'maxSpeed': float(element.get('maxSpeed', 55.55)),
+                    'sigma': float(element.get('sigma', 0.5)),
+                    'length': float(element.get('length', 5.0)),
+                    'minGap': float(element.get('minGap', 2.5)),
+                }
+            elif element.tag == 'route':
+                self._routes[element.get('id')] = element.get('edges').split()
+            elif element.tag == 'vehicle':
+                vtype = self._vtypes[element.get('type')]
+                edges = self._routes[element.get('route')]
+                yield float(element.get('depart')), _Vehicle(element.get('id'), edges, vtype)
+                root.clear()  # the parsed elements are not kept
+
+
+    def _load_detectors(self, additional_file):
+        """
+        Read the lane-area detectors of an additional file, the other elements are ignored
+        """
+        additional = ET.parse(additional_file).getroot()
+        for detector in additional.iter('laneAreaDetector'):
+            length = self._lanes[detector.get('lane')]['length']
+            start = float(detector.get('pos', 0))
+            if start < 0:
+                start += length
+            if detector.get('endPos') is not None:
+                end = float(detector.get('endPos'))
+                end = end + length if end < 0 else end
+            else:
+                end = start + float(detector.get('length'))
+            self._detectors[detector.get('id')] = {
+                'lane': detector.get('lane'),
+                'start': start,
+                'end': min(end, length),
+                'speed_threshold': float(detector.get('speedThreshold', DETECTOR_HALTING_SPEED)),
+            }
+
+
+    def _best_lane(self, vehicle):
+        """
+        Lane of the current edge from which the vehicle can reach the next edge of its route
+        """
+        lane_ids = self._edges[vehicle.edges[vehicle.edge_index]]
+        if vehicle.edge_index + 1 < len(vehicle.edges):
+            next_edge = vehicle.edges[vehicle.edge_index + 1]
+            for lane_id in lane_ids:
+                if (lane_id, next_edge) in self._links:
+                    return lane_id
+        return lane_ids[0]
+
+
+    def _free_space(self, lane_id):
+        """
+        Position up to which a vehicle entering the lane can advance without overlapping the last one
+        """
+        lane = self._lanes[lane_id]
+        if not lane['vehicles']:
+            return lane['length']
+        last = lane['vehicles'][-1]
+        return last.pos - last.length - last.min_gap
+
+
+    def _link_open(self, lane_id, next_edge):
+        tl_id, link_index = self._links[(lane_id, next_edge)]
+        if tl_id is None:
+            return True
+        tl = self._tls[tl_id]
+        return tl['phases'][tl['phase']][1][link_index] in OPEN_LINK_STATES
+
+
+    def step(self):
+        """
+        Advance the simulation by one second: insertions, movements, then traffic light programs
+        """
+        self._time += 1
+        self._subscription_results = None
+        self._insert_vehicles()
+        for lane_id, lane in self._lanes.items():
+            leader_limit = None
+            for vehicle in list(lane['vehicles']):
+                if vehicle.moved_at == self._time:  # entered this lane during the current step
+                    leader_limit = vehicle.pos - vehicle.length - vehicle.min_gap
+                    continue
+                leader_limit = self._move_vehicle(vehicle, lane_id, lane, leader_limit)
+        self._advance_programs()
+
+
+    def _insert_vehicles(self):
+        while self._next_departure is not None and self._next_departure[0] <= self._time:
+            self._pending.append(self._next_departure)
+            self._next_departure = next(self._departures, None)
+        blocked = deque()
+        while self._pending:
+            item = self._pending.popleft()
+            vehicle = item[1]
+            lane_id = self._best_lane(vehicle)
+            if self._free_space(lane_id) < 0:
+                blocked.append(item)  # the entry lane is full, retry in the next steps
+                continue
+            vehicle.lane = lane_id
+            vehicle.pos = 0.0
+            vehicle.moved_at = self._time
+            self._lanes[lane_id]['vehicles'].append(vehicle)
+            self._vehicles[vehicle.id] = vehicle
+        self._pending = blocked
+
+
+    def _move_vehicle(self, vehicle, lane_id, lane, leader_limit):
+        """
+        Move a vehicle along its lane and across the junction, returning the limit for the follower
+        """
+        vehicle.moved_at = self._time
+        speed = min(vehicle.speed + vehicle.accel, vehicle.max_speed, lane['speed'])
+        if vehicle.sigma > 0:
+            speed = max(0.0, speed - vehicle.sigma * vehicle.accel * self._rng.random())
+
+        # the stop line is a barrier unless the vehicle can leave the lane now
+        barrier = lane['length']
+        is_last_edge = vehicle.edge_index + 1 == len(vehicle.edges)
+        can_leave = is_last_edge
+        if not is_last_edge:
+            next_edge = vehicle.edges[vehicle.edge_index + 1]
+            can_leave = self._link_open(lane_id, next_edge)
+        if leader_limit is not None:
+            barrier = min(barrier, leader_limit)
+        elif can_leave:
+            barrier = None
+
+        new_pos = vehicle.pos + speed
+        if barrier is not None and new_pos > barrier:
+            new_pos = max(vehicle.pos, barrier)
+
+        if new_pos > lane['length']:
+            overflow = new_pos - lane['length']
+            if is_last_edge:
+                lane['vehicles'].remove(vehicle)
+                del self._vehicles[vehicle.id]
+                return None
+            vehicle.edge_index += 1
+            next_lane_id = self._best_lane(vehicle)
+            space = self._free_space(next_lane_id)
+            if space >= 0:
+                lane['vehicles'].remove(vehicle)
+                vehicle.lane = next_lane_id
+                vehicle.pos = min(overflow, space)
+                self._lanes[next_lane_id]['vehicles'].append(vehicle)
+                self._update_speed(vehicle, speed)
+                return None
+            vehicle.edge_index -= 1  # spillback: wait at the stop line
+            new_pos = lane['length']
+
+        self._update_speed(vehicle, new_pos - vehicle.pos)
+        vehicle.pos = new_pos
+        return vehicle.pos - vehicle.length - vehicle.min_gap
+
+
+    def _update_speed(self, vehicle, speed):
+        vehicle.speed = speed
+        if speed < HALTING_SPEED:
+            vehicle.waiting_time += 1
+            vehicle.accumulated_waiting_time += 1
+        else:
+            vehicle.waiting_time = 0
+
+
+    def _advance_programs(self):
+        for tl in self._tls.values():
+            tl['remaining'] -= 1
+            if tl['remaining'] <= 0:
+                tl['phase'] = (tl['phase'] + 1) % len(tl['phases'])
+                tl['remaining'] = tl['phases'][tl['phase']][0]
+
+
+    def set_phase(self, tl_id, index):
+        tl = self._tls[tl_id]
+        tl['phase'] = index
+        tl['remaining'] = tl['phases'][index][0]
+
+
+    def get_phase(self, tl_id):
+        return self._tls[tl_id]['phase']
+
+
+    def get_state(self, tl_id):
+        tl = self._tls[tl_id]
+        return tl['phases'][tl['phase']][1]
+
+
+    def halting_number(self, lane_id):
+        return sum(1 for vehicle in self._lanes[lane_id]['vehicles'] if vehicle.speed < HALTING_SPEED)
+
+
+    def detector_values(self, detector_id):
+        """
+        Vehicle number, mean speed, occupancy and halting number of a lane-area detector, by variable id
+        """
+        detector = self._detectors[detector_id]
+        start = detector['start']
+        end = detector['end']
+        number = 0
+        halting = 0
+        total_speed = 0.0
+        covered = 0.0
+        for vehicle in self._lanes[detector['lane']]['vehicles']:
+            if vehicle.pos - vehicle.length >= end:
+                continue
+            if vehicle.pos < start:
+                break  # the vehicles are ordered from the stop line backwards
+            overlap = max(min(vehicle.pos, end) - max(vehicle.pos - vehicle.length, start), 0.0)
+            number += 1
+            total_speed += vehicle.speed
+            covered += overlap
+            if vehicle.speed < detector['speed_threshold']:
+                halting += 1
+        return {
+            constants.LAST_STEP_VEHICLE_NUMBER: number,
+            constants.LAST_STEP_MEAN_SPEED: total_speed / number if number > 0 else -1.0,
+            constants.LAST_STEP_OCCUPANCY: 100.0 * covered / (end - start),
+            constants.LAST_STEP_VEHICLE_HALTING_NUMBER: halting,
+        }
+
+
+    def subscribe_detector(self, detector_id, var_ids):
+        if detector_id not in self._detectors:
+            raise FatalTraCIError("Induction loop '%s' is not known" % detector_id)
+        self._subscriptions[detector_id] = tuple(var_ids)
+        self._subscription_results = None
+
+
+    def detector_subscription_results(self):
+        if self._subscription_results is None:
+            results = {}
+            lanes = self._lanes
+            detectors = self._detectors
+            for detector_id, var_ids in self._subscriptions.items():
+                if not lanes[detectors[detector_id]['lane']]['vehicles']:
+                    values = {constants.LAST_STEP_VEHICLE_NUMBER: 0, constants.LAST_STEP_MEAN_SPEED: -1.0,
+                              constants.LAST_STEP_OCCUPANCY: 0.0, constants.LAST_STEP_VEHICLE_HALTING_NUMBER: 0}
+                else:
+                    values = self.detector_values(detector_id)
+                results[detector_id] = {var_id: values[var_id] for var_id in var_ids}
+            self._subscription_results = results
+        return self._subscription_results
+
+
+    @property
+    def detector_ids(self):
+        return tuple(self._detectors)
+
+
+    def edge_lanes(self, edge_id):
+        return self._edges[edge_id]
+
+
+    def vehicle(self, veh_id):
+        return self._vehicles[veh_id]
+
+
+    @property
+    def vehicle_ids(self):
+        return tuple(self._vehicles)
+
+
+    @property
+    def tl_ids(self):
+        return tuple(self._tls)
+
+
+    @property
+    def time(self):
+        return float(self._time)
+
+
+    @property
+    def expected_number(self):
+        return len(self._vehicles) + len(self._pending) + (self._next_departure is not None)  # the rest of the route files is not read yet
+
+
+_engine = None
+
+
+def _get_engine():
+    if _engine is None:
+        raise FatalTraCIError("Not connected.")
+    return _engine
+
+
+def _option(cmd, names, default=None):
+    for i, arg in enumerate(cmd[:-1]):
+        if arg in names:
+            return cmd[i + 1]
+    return default
+
+
+def start(cmd, port=None, numRetries=None, label="default", verbose=False, traceFile=None, traceGetters=True, stdout=None, doSwitch=True):
+    """
+    Start the stand-in simulation from the same command line given to SUMO (only -c, -r, -a and --seed are used)
+    """
+    global _engine
+    sumocfg_file = _option(cmd, ('-c', '--configuration-file'))
+    if sumocfg_file is None:
+        raise FatalTraCIError("The command line must contain a sumocfg file (-c).")
+    seed = int(_option(cmd, ('--seed',), DEFAULT_SEED))
+    route_files = _option(cmd, ('-r', '--route-files'))
+    if route_files is not None:
+        route_files = [route_file.strip() for route_file in route_files.split(',')]
+    additional_files = _option(cmd, ('-a', '--additional-files'))
+    if additional_files is not None:
+        additional_files = [additional_file.strip() for additional_file in additional_files.split(',')]
+    _engine = FakeSumo(sumocfg_file, seed=seed, route_files=route_files, additional_files=additional_files)
+    return 21, "fake_traci"  # api version and version string, like traci.start
+
+
+def load(args):
+    """
+    Reset the stand-in simulation with new options, keeping the connection (like traci.load)
+    """
+    _get_engine()
+    start(['fake_sumo'] + list(args))
+
+
+def close(wait=True):
+    global _engine
+    _get_engine()
+    _engine = None
+
+
+def simulationStep(step=0.):
+    engine = _get_engine()
+    engine.step()
+    while engine.time < step:
+        engine.step()
+
+
+def isLoaded():
+    return _engine is not None
+
+
+class _VehicleDomain:
+    def getIDList(self):
+        return _get_engine().vehicle_ids
+
+    def getIDCount(self):
+        return len(_get_engine().vehicle_ids)
+
+    def getRoadID(self, vehID):
+        vehicle = _get_engine().vehicle(vehID)
+        return vehicle.edges[vehicle.edge_index]
+
+    def getLaneID(self, vehID):
+        return _get_engine().vehicle(vehID).lane
+
+    def getLanePosition(self, vehID):
+        return _get_engine().vehicle(vehID).pos
+
+    def getSpeed(self, vehID):
+        return _get_engine().vehicle(vehID).speed
+
+    def getWaitingTime(self, vehID):
+        return float(_get_engine().vehicle(vehID).waiting_time)
+
+    def getAccumulatedWaitingTime(self, vehID):
+        return float(_get_engine().vehicle(vehID).accumulated_waiting_time)
+
+    def setAdaptedTraveltime(self, vehID, edgeID, time=INVALID_DOUBLE_VALUE, begTime=INVALID_DOUBLE_VALUE, endTime=INVALID_DOUBLE_VALUE):
+        _get_engine().vehicle(vehID).adapted_travel_times[edgeID] = time
+
+    def getAdaptedTraveltime(self, vehID, time, edgeID):
+        return _get_engine().vehicle(vehID).adapted_travel_times.get(edgeID, INVALID_DOUBLE_VALUE)
+
+
+class _EdgeDomain:
+    def getIDList(self):
+        return tuple(_get_engine()._edges)
+
+    def getLaneNumber(self, edgeID):
+        return len(_get_engine().edge_lanes(edgeID))
+
+    def getLastStepHaltingNumber(self, edgeID):
+        engine = _get_engine()
+        return sum(engine.halting_number(lane_id) for lane_id in engine.edge_lanes(edgeID))
+
+
+class _LaneDomain:
+    def getIDList(self):
+        return tuple(_get_engine()._lanes)
+
+    def getLastStepHaltingNumber(self, laneID):
+        return _get_engine().halting_number(laneID)
+
+
+class _LaneAreaDomain:
+    def getIDList(self):
+        return _get_engine().detector_ids
+
+    def getLastStepVehicleNumber(self, detID):
+        return _get_engine().detector_values(detID)[constants.LAST_STEP_VEHICLE_NUMBER]
+
+    def getLastStepMeanSpeed(self, detID):
+        return _get_engine().detector_values(detID)[constants.LAST_STEP_MEAN_SPEED]
+
+    def getLastStepOccupancy(self, detID):
+        return _get_engine().detector_values(detID)[constants.LAST_STEP_OCCUPANCY]
+
+    def getLastStepHaltingNumber(self, detID):
+        return _get_engine().detector_values(detID)[constants.LAST_STEP_VEHICLE_HALTING_NUMBER]
+
+    def subscribe(self, objectID, varIDs=(constants.LAST_STEP_VEHICLE_NUMBER,), begin=INVALID_DOUBLE_VALUE, end=INVALID_DOUBLE_VALUE):
+        _get_engine().subscribe_detector(objectID, varIDs)
+
+    def getAllSubscriptionResults(self):
+        return _get_engine().detector_subscription_results()
+
+
+class _TrafficLightDomain:
+    def getIDList(self):
+        return _get_engine().tl_ids
+
+    def setPhase(self, tlsID, index):
+        _get_engine().set_phase(tlsID, index)
+
+    def getPhase(self, tlsID):
+        return _get_engine().get_phase(tlsID)
+
+    def getRedYellowGreenState(self, tlsID):
+        return _get_engine().get_state(tlsID)
+
+
+class _SimulationDomain:
+    def getTime(self):
+        return _get_engine().time
+
+    def getMinExpectedNumber(self):
+        return _get_engine().expected_number
+
+
+vehicle = _VehicleDomain()
+edge = _EdgeDomain()
+lane = _LaneDomain()
+lanearea = _LaneAreaDomain()
+trafficlight = _TrafficLightDomain()
+simulation = _SimulationDomain()
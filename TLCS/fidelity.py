@@ -0,0 +1,66 @@
+import sys
+import tempfile
+
+import numpy as np
+
+from evaluator import build_simulation
+from utils import import_train_configuration
+
+BENCHMARK_EPISODES = 3
+BENCHMARK_SEED = 30000  # seed of the demand of the first episode, apart from the training and evaluation seeds
+
+
+class _RandomAgent:
+    """
+    Random phases and green durations, the same sequence in every fidelity for the same seed
+    """
+    def __init__(self, num_actions, param_dim):
+        self._num_actions = num_actions
+        self._param_dim = param_dim
+        self.rng = np.random.default_rng()
+
+    def select_action(self, state, epsilon):
+        return self.rng.integers(0, self._num_actions), self.rng.uniform(-1, 1, self._param_dim)
+
+    def add_experience(self, state, action, reward, next_state, done, param):
+        pass
+
+    def train(self):
+        pass
+
+
+def benchmark(config, episodes=BENCHMARK_EPISODES):
+    """
+    Episode time and episode stats of the same random episodes in the microscopic and in the mesoscopic model
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as path:
+        for fidelity in ('micro', 'meso'):
+            Agent = _RandomAgent(config['num_actions'], config['final_action'])
+            Episodes, traci_module = build_simulation(path, config, Agent, 'benchmark_routes.rou.xml', fidelity=fidelity)
+            times = []
+            for episode in range(episodes):
+                Agent.rng = np.random.default_rng(episode)
+                simulation_time, _ = Episodes.run(BENCHMARK_SEED + episode, 1.0)
+                times.append(simulation_time)
+            if config['persistent_session']:
+                traci_module.shutdown()
+            results[fidelity] = {
+                'episode_time': sum(times) / episodes,
+                'reward': sum(Episodes.reward_store) / episodes,
+                'delay': sum(Episodes.cumulative_wait_store) / episodes,
+                'queue': sum(Episodes.avg_queue_length_store) / episodes,
+            }
+    return results
+
+
+if __name__ == "__main__":
+    # python fidelity.py [episodes] [settings file]
+    episodes = int(sys.argv[1]) if len(sys.argv) > 1 else BENCHMARK_EPISODES
+    config = import_train_configuration(sys.argv[2] if len(sys.argv) > 2 else 'training_settings.ini')
+    results = benchmark(config, episodes)
+    print("----- Mean of", episodes, "random episodes of", config['max_steps'], "steps")
+    for fidelity, stats in results.items():
+        print("%s: episode time %.1f s - reward %.0f - delay %.0f s - queue %.1f vehicles" % (fidelity, stats['episode_time'], stats['reward'], stats['delay'], stats['queue']))
+    if results['meso']['episode_time'] > 0:
+        print("Speedup of the mesoscopic model: %.1fx" % (results['micro']['episode_time'] / results['meso']['episode_time']))
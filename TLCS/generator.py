@@ -1,17 +1,51 @@
 import numpy as np
 import math
+import os
 import random
+from statistics import NormalDist
+
+from topology import load_topology
+
+DAY_STEPS = 86400  # period of the streaming demand, n_cars_generated cars depart in every period
+STREAM_CHUNK_STEPS = 3600  # steps of departures generated and written at a time by the streaming demand
+# the 16 routes r1-r16 of the original demand, as (entering road, turn at the first traffic light)
+BASE_ROUTES = (
+    ('-h11', 's'), ('-v11', 's'), ('-h21', 's'), ('-v21', 's'),
+    ('-h11', 'l'), ('-h21', 'l'), ('-h11', 'r'), ('-h21', 'r'),
+    ('h13', 's'), ('v13', 's'), ('h23', 's'), ('v23', 's'),
+    ('-v11', 'l'), ('v13', 'r'), ('v13', 'l'), ('v23', 'r'),
+)
 
 class TrafficGenerator:
-    def __init__(self, max_steps, n_cars_generated):
-        self._n_cars_generated = n_cars_generated  # how many cars per episode
+    def __init__(self, max_steps, n_cars_generated, route_file="intersection/episode_routes.rou.xml", Topology=None, streaming=False, period_steps=DAY_STEPS, turning_routes=False):
+        self._n_cars_generated = n_cars_generated  # how many cars per episode (per period with streaming)
         self._max_steps = max_steps
+        self._route_file = route_file
+        if Topology is None:
+            Topology = load_topology(os.path.join('intersection', 'environment.net.xml'))
+        self._routes = self._select_routes(Topology, turning_routes)
+        self._streaming = streaming  # every generation writes the streaming demand, for horizons of days
+        self._period_steps = period_steps
+
+    @staticmethod
+    def _select_routes(Topology, turning_routes):
+        """
+        The routes r1-r16 of the original demand, in their order, or with turning_routes the straight and turning
+        routes from every road entering the network (also used on networks without the original roads)
+        """
+        routes = [Topology.route(road, turn) for road, turn in BASE_ROUTES]
+        if turning_routes or None in routes:
+            return Topology.routes
+        return routes
 
     def generate_routefile(self, seed):
         """
         Generation of the route of every car for one episode
         """
+        if self._streaming:
+            return self.generate_routefile_streaming(seed)
         np.random.seed(seed)  # make tests reproducible
+        random.seed(seed)
 
         # the generation of cars is distributed according to a weibull distribution
         timings = np.random.weibull(2, self._n_cars_generated)
@@ -28,130 +62,74 @@ class TrafficGenerator:
 
         car_gen_steps = np.rint(car_gen_steps)  # round every value to int -> effective steps when a car will be generated
 
-        # produce the file for cars generation, one car per line
-        with open("intersection/episode_routes.rou.xml", "w") as routes:
-            print("""<routes>
-              <vType accel="1.0" deccel="4.5" id="Car" length="5.0" minGap="2.5" maxSpeed="25" sigma="0.5"/>
-              <vType accel="1.0" deccel="5.0" id="Bus" length="12.0" maxSpeed="10" sigma="0.0"/>
-              <route id="r1" edges="-h11 -h12 -h13"/>
-              <route id="r2" edges="-v11 -v12 -v13"/>
-              <route id="r3" edges="-h21 -h22 -h23"/>
-              <route id="r4" edges="-v21 -v22 -v23"/>
-              <route id="r5" edges="-h11 v11"/>
-              <route id="r6" edges="-h21 v12 v11"/>
-              <route id="r7" edges="-h11 -v12 -v13"/>
-              <route id="r8" edges="-h21 -v13"/>
-              <route id="r9" edges="h13 h12 h11"/>
-              <route id="r10" edges="v13 v12 v11"/>
-              <route id="r11" edges="h23 h22 h21"/>
-              <route id="r12" edges="v23 v22 v21"/>
-              <route id="r13" edges="-v11 -h12 -h13"/>
-              <route id="r14" edges="v13 -h22 -h23"/>
-              <route id="r15" edges="v13 h21"/>
-              <route id="r16" edges="v23 -h23"/>""", file=routes)
-
-            for vehNr, i in enumerate(car_gen_steps):
-                num=random.randint(1,16)
-                if num==1:
-                    print(' <vehicle id="v_%i" type="Car" route="r1" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==2:
-                    print(' <vehicle id="v_%i" type="Car" route="r2" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==3:
-                    print(' <vehicle id="v_%i" type="Car" route="r3" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==4:
-                    print(' <vehicle id="v_%i" type="Car" route="r4" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==5:
-                    print(' <vehicle id="v_%i" type="Car" route="r5" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==6:
-                    print(' <vehicle id="v_%i" type="Car" route="r6" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==7:
-                    print(' <vehicle id="v_%i" type="Car" route="r7" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==8:
-                    print(' <vehicle id="v_%i" type="Car" route="r8" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==9:
-                    print(' <vehicle id="v_%i" type="Car" route="r9" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==10:
-                    print(' <vehicle id="v_%i" type="Car" route="r10" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==11:
-                    print(' <vehicle id="v_%i" type="Car" route="r11" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==12:
-                    print(' <vehicle id="v_%i" type="Car" route="r12" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==13:
-                    print(' <vehicle id="v_%i" type="Car" route="r13" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==14:
-                    print(' <vehicle id="v_%i" type="Car" route="r14" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==15:
-                    print(' <vehicle id="v_%i" type="Car" route="r15" depart="%i" />' % (vehNr, i), file=routes)
-                else:
-                    print(' <vehicle id="v_%i" type="Car" route="r16" depart="%i" />' % (vehNr, i), file=routes)
-
-            print("</routes>", file=routes)
+        self._write_routefile(car_gen_steps)
 
     def generate_routefile_normal(self, seed):
         """
         Generation of the route of every car for one episode using a normal distribution.
         """
+        if self._streaming:
+            return self.generate_routefile_streaming(seed)
         np.random.seed(seed)  # make tests reproducible
+        random.seed(seed)
         # the generation of cars is distributed according to a normal distribution
         timings = np.random.normal(loc=self._max_steps / 2, scale=self._max_steps / 10, size=self._n_cars_generated)
         timings = np.clip(timings, 0, self._max_steps)  # clip to ensure values are within the desired range
         timings = np.sort(timings)
         car_gen_steps = np.rint(timings)  # round every value to int -> effective steps when a car will be generated
-        # produce the file for cars generation, one car per line
-        with open("intersection/episode_routes.rou.xml", "w") as routes:
-            print("""<routes>
-              <vType accel="1.0" deccel="4.5" id="Car" length="5.0" minGap="2.5" maxSpeed="25" sigma="0.5"/>
-              <vType accel="1.0" deccel="5.0" id="Bus" length="12.0" maxSpeed="10" sigma="0.0"/>
-              <route id="r1" edges="-h11 -h12 -h13"/>
-              <route id="r2" edges="-v11 -v12 -v13"/>
-              <route id="r3" edges="-h21 -h22 -h23"/>
-              <route id="r4" edges="-v21 -v22 -v23"/>
-              <route id="r5" edges="-h11 v11"/>
-              <route id="r6" edges="-h21 v12 v11"/>
-              <route id="r7" edges="-h11 -v12 -v13"/>
-              <route id="r8" edges="-h21 -v13"/>
-              <route id="r9" edges="h13 h12 h11"/>
-              <route id="r10" edges="v13 v12 v11"/>
-              <route id="r11" edges="h23 h22 h21"/>
-              <route id="r12" edges="v23 v22 v21"/>
-              <route id="r13" edges="-v11 -h12 -h13"/>
-              <route id="r14" edges="v13 -h22 -h23"/>
-              <route id="r15" edges="v13 h21"/>
-              <route id="r16" edges="v23 -h23"/>""", file=routes)
+        self._write_routefile(car_gen_steps)
 
-            for vehNr, i in enumerate(car_gen_steps):
-                num=random.randint(1,16)
-                if num==1:
-                    print(' <vehicle id="v_%i" type="Car" route="r1" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==2:
-                    print(' <vehicle id="v_%i" type="Car" route="r2" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==3:
-                    print(' <vehicle id="v_%i" type="Car" route="r3" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==4:
-                    print(' <vehicle id="v_%i" type="Car" route="r4" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==5:
-                    print(' <vehicle id="v_%i" type="Car" route="r5" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==6:
-                    print(' <vehicle id="v_%i" type="Car" route="r6" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==7:
-                    print(' <vehicle id="v_%i" type="Car" route="r7" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==8:
-                    print(' <vehicle id="v_%i" type="Car" route="r8" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==9:
-                    print(' <vehicle id="v_%i" type="Car" route="r9" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==10:
-                    print(' <vehicle id="v_%i" type="Car" route="r10" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==11:
-                    print(' <vehicle id="v_%i" type="Car" route="r11" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==12:
-                    print(' <vehicle id="v_%i" type="Car" route="r12" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==13:
-                    print(' <vehicle id="v_%i" type="Car" route="r13" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==14:
-                    print(' <vehicle id="v_%i" type="Car" route="r14" depart="%i" />' % (vehNr, i), file=routes)
-                elif num==15:
-                    print(' <vehicle id="v_%i" type="Car" route="r15" depart="%i" />' % (vehNr, i), file=routes)
-                else:
-                    print(' <vehicle id="v_%i" type="Car" route="r16" depart="%i" />' % (vehNr, i), file=routes)
+    def generate_routefile_streaming(self, seed, chunk_steps=STREAM_CHUNK_STEPS):
+        """
+        Generation of the route of every car over a long horizon, one chunk of steps at a time. In every period
+        (a day by default, or the whole episode if shorter) n_cars_generated cars depart, normally distributed around
+        its middle as in generate_routefile_normal. The cars are written in departure order, so SUMO reads the file
+        as the simulation goes, and only the cars of one chunk are in memory
+        """
+        np.random.seed(seed)  # make tests reproducible
+        random.seed(seed)
+        period = min(self._period_steps, self._max_steps)
+        departures = NormalDist(mu=period / 2, sigma=period / 10)
+        with open(self._route_file, "w") as routes:
+            self._write_header(routes)
+            vehNr = 0
+            for period_start in range(0, self._max_steps, period):
+                cars_left = self._n_cars_generated
+                for chunk_start in range(0, period, chunk_steps):
+                    chunk_end = min(chunk_start + chunk_steps, period)
+                    if cars_left == 0 or period_start + chunk_start >= self._max_steps:
+                        break
+                    # the cars of the chunk among the cars left, in proportion to the probability of the chunk among the steps left
+                    low, high = departures.cdf(chunk_start), departures.cdf(chunk_end)
+                    mass_left = departures.cdf(period) - low
+                    n_cars = cars_left if chunk_end == period else np.random.binomial(cars_left, min((high - low) / mass_left, 1.0))
+                    cars_left -= n_cars
+                    # departure steps drawn from the distribution restricted to the chunk, by inverting its cdf
+                    quantiles = np.random.uniform(low, high, n_cars).clip(1e-12, 1 - 1e-12)
+                    timings = np.sort([departures.inv_cdf(quantile) for quantile in quantiles]).clip(chunk_start, chunk_end)
+                    car_gen_steps = np.rint(timings) + period_start
+                    car_gen_steps = car_gen_steps[car_gen_steps < self._max_steps]
+                    self._write_vehicles(routes, car_gen_steps, vehNr)
+                    vehNr += len(car_gen_steps)
+            print("</routes>", file=routes)
 
+    def _write_routefile(self, car_gen_steps):
+        """
+        Produce the file for cars generation, one car per line on a random route
+        """
+        with open(self._route_file, "w") as routes:
+            self._write_header(routes)
+            self._write_vehicles(routes, car_gen_steps)
             print("</routes>", file=routes)
+
+    def _write_header(self, routes):
+        print("""<routes>
+              <vType accel="1.0" deccel="4.5" id="Car" length="5.0" minGap="2.5" maxSpeed="25" sigma="0.5"/>
+              <vType accel="1.0" deccel="5.0" id="Bus" length="12.0" maxSpeed="10" sigma="0.0"/>""", file=routes)
+        for route_number, edges in enumerate(self._routes, start=1):
+            print('              <route id="r%i" edges="%s"/>' % (route_number, ' '.join(edges)), file=routes)
+
+    def _write_vehicles(self, routes, car_gen_steps, first_vehNr=0):
+        for vehNr, i in enumerate(car_gen_steps, start=first_vehNr):
+            num=random.randint(1,len(self._routes))
+            print(' <vehicle id="v_%i" type="Car" route="r%i" depart="%i" />' % (vehNr, num, i), file=routes)
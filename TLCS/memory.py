@@ -1,14 +1,180 @@
 from collections import deque
+import numpy as np
+import queue
 import random
+import threading
 class ReplayBuffer:
     def __init__(self, max_size):
         self.buffer = deque(maxlen=max_size)
+        self.added = 0  # experiences added so far, tells the prefetched batches sampled before the last additions
 
     def add(self, experience):
         self.buffer.append(experience)
+        self.added += 1
+
+    def add_batch(self, states, actions, rewards, next_states, dones, params):
+        # one bulk copy of each array, every experience then holds row views of the copies
+        self.buffer.extend(zip(np.array(states), np.array(actions), np.array(rewards), np.array(next_states), np.array(dones), np.array(params)))
+        self.added += len(states)
 
     def sample(self, batch_size):
         return random.sample(self.buffer, batch_size)
 
+    def sample_arrays(self, batch_size):
+        """
+        Sample a batch as arrays: states, actions, rewards, next_states, dones, params
+        """
+        states, actions, rewards, next_states, dones, params = zip(*self.sample(batch_size))
+        return np.array(states), np.array(actions), np.array(rewards), np.array(next_states), np.array(dones), np.array(params)
+
     def size(self):
-        return len(self.buffer)
\ No newline at end of file
+        return len(self.buffer)
+
+
+class BatchPrefetcher:
+    """
+    Samples and assembles batches of the replay buffer in a background thread, keeping up to depth of them ready,
+    so that the host-side batch assembly overlaps with the training steps
+    """
+    def __init__(self, replay_buffer, batch_size, depth):
+        self._replay_buffer = replay_buffer
+        self._batch_size = batch_size
+        self._batches = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            try:
+                added = self._replay_buffer.added
+                batch = self._replay_buffer.sample_arrays(self._batch_size)
+            except Exception as error:
+                added, batch = None, error  # raised again by get in the training thread
+            while not self._stop.is_set():
+                try:
+                    self._batches.put((added, batch), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if added is None:
+                return
+
+    def get(self, timeout=1.0):
+        """
+        Next batch, skipping the ones sampled before experiences were added to the buffer. An exception of the
+        sampling thread is raised here
+        """
+        while True:
+            try:
+                added, batch = self._batches.get(timeout=timeout)
+            except queue.Empty:
+                if not self._thread.is_alive():
+                    raise RuntimeError("the batch prefetching thread stopped")
+                continue
+            if added is None:
+                raise batch
+            if added == self._replay_buffer.added:
+                return batch
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+# storage of the frames of CompactReplayBuffer: (dtype, scale of the encoding)
+FRAME_CODECS = {
+    'float16': (np.float16, 1.0),
+    'uint8': (np.uint8, 127.0),  # 0, 1 and 2 decode exactly, the speeds between them within 1/254
+}
+
+
+class CompactReplayBuffer:
+    """
+    Replay buffer storing every observation once, as a quantized frame. A transition holds the indexes of the frames
+    of its state and next state, and the state of a transition that follows the previous one is the next state of the
+    previous one, so consecutive transitions share a frame. Same interface as ReplayBuffer
+    """
+    def __init__(self, max_size, state_dim, param_dim, storage='uint8'):
+        dtype, self._scale = FRAME_CODECS[storage]
+        self._max_size = max_size
+        self._n_frames = 2 * max_size  # at most two new frames per transition, so a frame outlives the transitions using it
+        self._frames = np.zeros((self._n_frames, state_dim), dtype=dtype)
+        self._frames_written = 0
+        self._state_frames = np.zeros(max_size, dtype=np.int64)
+        self._next_frames = np.zeros(max_size, dtype=np.int64)
+        self._actions = np.zeros(max_size, dtype=np.int64)
+        self._rewards = np.zeros(max_size)
+        self._dones = np.zeros(max_size)
+        self._params = np.zeros((max_size, param_dim))
+        self._last_next_state = None  # next state of the last transition, the state of the next one if it follows it
+        self._last_next_frame = 0
+        self._size = 0
+        self.added = 0
+
+    def _encode(self, states):
+        states = np.asarray(states) * self._scale
+        if self._scale != 1.0:
+            states = np.rint(np.clip(states, 0, 255))
+        return states.astype(self._frames.dtype)
+
+    def _write_frames(self, states):
+        indexes = (self._frames_written + np.arange(len(states))) % self._n_frames
+        self._frames[indexes] = self._encode(states)
+        self._frames_written += len(states)
+        return indexes
+
+    def add(self, experience):
+        state, action, reward, next_state, done, param = experience
+        self.add_batch([state], [action], [reward], [next_state], [done], [param])
+
+    def add_batch(self, states, actions, rewards, next_states, dones, params):
+        states, next_states = np.asarray(states), np.asarray(next_states)
+        n = len(states)
+        if n == 0:
+            return
+        # a state is a new frame unless it is the next state of the transition before it
+        follows = np.zeros(n, dtype=bool)
+        if self._last_next_state is not None:
+            follows = np.all(states == np.concatenate([[self._last_next_state], next_states[:-1]]), axis=1)
+        # frames written in order: the state of a transition if new, then its next state
+        rows = np.stack([states, next_states], axis=1).reshape(2 * n, -1)
+        written = np.stack([~follows, np.ones(n, dtype=bool)], axis=1).reshape(-1)
+        frames = np.zeros(2 * n, dtype=np.int64)
+        frames[written] = self._write_frames(rows[written])
+        state_frames, next_frames = frames[0::2], frames[1::2]
+        state_frames[follows] = np.concatenate([[self._last_next_frame], next_frames[:-1]])[follows]
+
+        slots = (self.added + np.arange(n)) % self._max_size
+        self._state_frames[slots] = state_frames
+        self._next_frames[slots] = next_frames
+        self._actions[slots] = actions
+        self._rewards[slots] = rewards
+        self._dones[slots] = dones
+        self._params[slots] = params
+        self._last_next_state = next_states[-1].copy()
+        self._last_next_frame = next_frames[-1]
+        self._size = min(self._size + n, self._max_size)
+        self.added += n
+
+    def sample(self, batch_size):
+        return list(zip(*self.sample_arrays(batch_size)))
+
+    def sample_arrays(self, batch_size):
+        """
+        Sample a batch as arrays: states, actions, rewards, next_states, dones, params, with the frames decoded to float32
+        """
+        slots = np.array(random.sample(range(self._size), batch_size))  # without replacement, in O(batch_size) like ReplayBuffer
+        states = self._frames[self._state_frames[slots]].astype(np.float32) / self._scale
+        next_states = self._frames[self._next_frames[slots]].astype(np.float32) / self._scale
+        return states, self._actions[slots], self._rewards[slots], next_states, self._dones[slots], self._params[slots]
+
+    def size(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        """
+        Bytes of the arrays of the buffer
+        """
+        return sum(array.nbytes for array in (self._frames, self._state_frames, self._next_frames, self._actions, self._rewards, self._dones, self._params))
@@ -0,0 +1,139 @@
+import json
+import os
+import sys
+import tracemalloc
+
+import numpy as np
+
+GROWTH_EPISODES = 5  # a measure that grew in every one of the last episodes is flagged
+TOP_ALLOCATIONS = 10
+
+
+def rss_bytes():
+    """
+    Resident set size of the process (its peak where /proc is not available)
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def _item_bytes(item):
+    if isinstance(item, np.ndarray):
+        return sys.getsizeof(item) + (item.nbytes if item.base is not None else 0)  # a view does not count the data it shows
+    if isinstance(item, tuple):
+        return sys.getsizeof(item) + sum(_item_bytes(value) for value in item)
+    return sys.getsizeof(item)
+
+
+def structure_size(structure):
+    """
+    Number of items and approximate bytes of a replay buffer, a dict, a list or a deque
+    """
+    if hasattr(structure, 'nbytes') and hasattr(structure, 'size'):
+        return structure.size(), structure.nbytes  # compact replay buffer
+    if hasattr(structure, 'buffer'):
+        # replay buffer of tuples: the experiences all have the same shapes, the last one stands for every one
+        items = len(structure.buffer)
+        return items, sys.getsizeof(structure.buffer) + (items * _item_bytes(structure.buffer[-1]) if items else 0)
+    if isinstance(structure, dict):
+        return len(structure), sys.getsizeof(structure) + sum(sys.getsizeof(key) + _item_bytes(value) for key, value in structure.items())
+    return len(structure), sys.getsizeof(structure) + sum(_item_bytes(value) for value in structure)
+
+
+class MemoryProfiler:
+    """
+    Opt-in memory instrumentation of the training session: after every episode, the RSS of the process, the python
+    allocations traced by tracemalloc with their top sources, and the sizes of the tracked data structures are
+    appended to memory.jsonl. The measures that grew in every one of the last episodes are flagged.
+    tracemalloc sees the python objects only, the memory of tensorflow shows in the RSS
+    """
+    def __init__(self, path, enabled=False, top=TOP_ALLOCATIONS, window=GROWTH_EPISODES):
+        self._path = path
+        self._enabled = enabled
+        self._top = top
+        self._window = window
+        self._structures = {}
+        self._history = {}
+        self._snapshot = None
+        if enabled:
+            tracemalloc.start()
+
+
+    def track(self, name, get_structure):
+        """
+        Measure the structure returned by get_structure after every episode (a function, since the simulations
+        replace some of their structures at every episode)
+        """
+        if self._enabled:
+            self._structures[name] = get_structure
+
+
+    def save_episode(self, episode):
+        """
+        Append the record of the episode to memory.jsonl, returns the record
+        """
+        if not self._enabled:
+            return None
+        record = {'episode': episode, 'rss_mb': round(rss_bytes() / 2**20, 2)}
+        traced, peak = tracemalloc.get_traced_memory()
+        record['traced_mb'] = round(traced / 2**20, 2)
+        record['traced_peak_mb'] = round(peak / 2**20, 2)
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()  # peak of the next episode
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ))
+        record['top_allocations'] = [
+            {'where': '%s:%i' % (stat.traceback[0].filename, stat.traceback[0].lineno), 'kb': round(stat.size / 1024, 1), 'count': stat.count}
+            for stat in snapshot.statistics('lineno')[:self._top]
+        ]
+        if self._snapshot is not None:
+            record['top_growth'] = [
+                {'where': '%s:%i' % (stat.traceback[0].filename, stat.traceback[0].lineno), 'kb': round(stat.size_diff / 1024, 1), 'count': stat.count_diff}
+                for stat in snapshot.compare_to(self._snapshot, 'lineno')[:self._top] if stat.size_diff > 0
+            ]
+        self._snapshot = snapshot
+
+        measures = {'rss': record['rss_mb'], 'traced': traced}
+        record['structures'] = {}
+        for name, get_structure in self._structures.items():
+            items, size = structure_size(get_structure())
+            record['structures'][name] = {'items': items, 'kb': round(size / 1024, 1)}
+            measures[name] = size
+
+        for name, value in measures.items():
+            self._history.setdefault(name, []).append(value)
+        record['growing'] = self.growing()
+
+        with open(os.path.join(self._path, 'memory.jsonl'), 'a') as file:
+            file.write(json.dumps(record) + '\n')
+        return record
+
+
+    def growing(self):
+        """
+        Names of the measures that grew in every one of the last window episodes
+        """
+        growing = []
+        for name, values in self._history.items():
+            last = values[-(self._window + 1):]
+            if len(last) > self._window and all(after > before for before, after in zip(last, last[1:])):
+                growing.append(name)
+        return growing
+
+
+    def close(self):
+        if self._enabled:
+            tracemalloc.stop()
+
+
+    @property
+    def enabled(self):
+        return self._enabled
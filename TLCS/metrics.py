@@ -0,0 +1,148 @@
+import csv
+import math
+import os
+
+SERIES_POINTS = 10000  # points kept by a streaming series for its plot
+
+
+class MetricsStore:
+    """
+    Append-only csv file with one column per metric and one row per episode,
+    written as soon as an episode completes so that a crashed run keeps its metrics
+    """
+    def __init__(self, file_path, columns):
+        self._file_path = file_path
+        self._columns = list(columns)
+        if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+            with open(file_path, 'w', newline='') as file:
+                csv.writer(file).writerow(self._columns)
+
+
+    def append(self, **values):
+        """
+        Write the metrics of one episode and force them to disk
+        """
+        with open(self._file_path, 'a', newline='') as file:
+            csv.writer(file).writerow([values[column] for column in self._columns])
+            file.flush()
+            os.fsync(file.fileno())
+
+
+    def read(self):
+        """
+        Return the content of the store as a dict of columns
+        """
+        return read_metrics(self._file_path)
+
+
+    @property
+    def file_path(self):
+        return self._file_path
+
+
+def read_metrics(file_path):
+    """
+    Read a metrics file into a dict of columns, ignoring a row truncated by a crash
+    """
+    with open(file_path, newline='') as file:
+        reader = csv.reader(file)
+        columns = next(reader)
+        data = {column: [] for column in columns}
+        for row in reader:
+            if len(row) != len(columns):
+                continue
+            for column, value in zip(columns, row):
+                data[column].append(int(value) if value.lstrip('-').isdigit() else float(value))
+    return data
+
+
+class StreamingSeries:
+    """
+    Per-step series of an episode of any length in constant memory: count, sum, mean, standard deviation, min and max
+    of all the values, plus at most capacity points for the plot, each the mean of a bucket of consecutive values.
+    When the points fill up, pairs of them are merged and the buckets double
+    """
+    def __init__(self, capacity=SERIES_POINTS):
+        self._capacity = capacity + capacity % 2
+        self.reset()
+
+
+    def reset(self):
+        self._count = 0
+        self._sum = 0
+        self._mean = 0.0
+        self._m2 = 0.0  # sum of the squared deviations from the mean (Welford)
+        self._min = math.inf
+        self._max = -math.inf
+        self._points = []
+        self._bucket = 1
+        self._bucket_sum = 0
+        self._bucket_count = 0
+
+
+    def append(self, value):
+        self._count += 1
+        self._sum += value
+        delta = value - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (value - self._mean)
+        self._min = min(self._min, value)
+        self._max = max(self._max, value)
+
+        self._bucket_sum += value
+        self._bucket_count += 1
+        if self._bucket_count == self._bucket:
+            self._points.append(self._bucket_sum / self._bucket)
+            self._bucket_sum = 0
+            self._bucket_count = 0
+            if len(self._points) == self._capacity:
+                self._points = [(first + second) / 2 for first, second in zip(self._points[0::2], self._points[1::2])]
+                self._bucket *= 2
+
+
+    @property
+    def points(self):
+        """
+        Means of the buckets, the last one possibly partial
+        """
+        if self._bucket_count > 0:
+            return self._points + [self._bucket_sum / self._bucket_count]
+        return list(self._points)
+
+
+    @property
+    def bucket(self):
+        """
+        Number of values averaged in every point
+        """
+        return self._bucket
+
+
+    @property
+    def count(self):
+        return self._count
+
+
+    @property
+    def sum(self):
+        return self._sum
+
+
+    @property
+    def mean(self):
+        return self._mean if self._count > 0 else math.nan
+
+
+    @property
+    def std(self):
+        return math.sqrt(self._m2 / self._count) if self._count > 0 else math.nan
+
+
+    @property
+    def min(self):
+        return self._min
+
+
+    @property
+    def max(self):
+        return self._max
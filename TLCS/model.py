@@ -1,30 +1,126 @@
+import numpy as np
 import tensorflow as tf
 from tensorflow.keras import layers
 
 class QNetwork(tf.keras.Model):
-    def __init__(self, state_dim, action_dim, param_dim):
+    def __init__(self, state_dim, action_dim, param_dim, num_layers=2, width_layers=64):
         super(QNetwork, self).__init__()
-        self.fc1 = layers.Dense(64, activation='relu')
-        self.fc2 = layers.Dense(64, activation='relu')
+        self.hidden = [layers.Dense(width_layers, activation='relu') for _ in range(num_layers)]
         self.q_value = layers.Dense(action_dim, activation='linear')
         self.param_value = layers.Dense(param_dim)
 
     def call(self, state):
-        x = self.fc1(state)
-        x = self.fc2(x)
+        x = state
+        for layer in self.hidden:
+            x = layer(x)
         q_value = self.q_value(x)
         param_value = self.param_value(x)
         return q_value, param_value
 
 class ActorNetwork(tf.keras.Model):
-    def __init__(self, state_dim, param_dim):
+    def __init__(self, state_dim, param_dim, num_layers=2, width_layers=64):
         super(ActorNetwork, self).__init__()
-        self.fc1 = layers.Dense(64, activation='relu')
-        self.fc2 = layers.Dense(64, activation='relu')
+        self.hidden = [layers.Dense(width_layers, activation='relu') for _ in range(num_layers)]
         self.param = layers.Dense(param_dim, activation='tanh')
 
     def call(self, state):
-        x = self.fc1(state)
-        x = self.fc2(x)
+        x = state
+        for layer in self.hidden:
+            x = layer(x)
         param = self.param(x)
-        return param
\ No newline at end of file
+        return param
+
+class StudentNetwork(tf.keras.Model):
+    """
+    Small network distilled from the trained ones: logits of the actions and the parameter, from shared hidden layers
+    """
+    def __init__(self, action_dim, param_dim, hidden_widths=(64, 32)):
+        super(StudentNetwork, self).__init__()
+        self.hidden = [layers.Dense(width, activation='relu') for width in hidden_widths]
+        self.logits = layers.Dense(action_dim, activation='linear')
+        self.param = layers.Dense(param_dim, activation='tanh')
+
+    def call(self, state):
+        x = state
+        for layer in self.hidden:
+            x = layer(x)
+        return self.logits(x), self.param(x)
+
+    def dense_layers(self):
+        """
+        (kernel, bias) of the hidden layers, then of the output layer made of the logits and the parameter
+        """
+        weights = [(layer.kernel.numpy(), layer.bias.numpy()) for layer in self.hidden]
+        weights.append((
+            np.concatenate([self.logits.kernel.numpy(), self.param.kernel.numpy()], axis=1),
+            np.concatenate([self.logits.bias.numpy(), self.param.bias.numpy()])
+        ))
+        return weights
+
+def _layer_seeds(seed, members, n_layers):
+    return [None if seed is None else seed + i * members for i in range(n_layers)]
+
+class EnsembleDense(layers.Layer):
+    """
+    K dense layers applied together with one batched matmul: kernel (K, in, out), input (K, batch, in).
+    Each member is initialized like a Dense layer on its own, member k with the seed seed + k
+    """
+    def __init__(self, members, units, activation=None, seed=None):
+        super(EnsembleDense, self).__init__()
+        self.members = members
+        self.units = units
+        self.activation = tf.keras.activations.get(activation)
+        self.seed = seed
+
+    def build(self, input_shape):
+        # one initializer per member: an unseeded initializer returns the same values at every call
+        initializers = [tf.keras.initializers.GlorotUniform(seed=None if self.seed is None else self.seed + k) for k in range(self.members)]
+        self.kernel = self.add_weight(
+            name='kernel',
+            shape=(self.members, int(input_shape[-1]), self.units),
+            initializer=lambda shape, dtype=None: tf.stack([initializer(shape[1:], dtype=dtype) for initializer in initializers])
+        )
+        self.bias = self.add_weight(name='bias', shape=(self.members, self.units), initializer='zeros')
+
+    def call(self, x, member=None):
+        if member is None:
+            return self.activation(tf.matmul(x, self.kernel) + self.bias[:, tf.newaxis, :])
+        return self.activation(tf.matmul(x, self.kernel[member]) + self.bias[member])
+
+class EnsembleQNetwork(tf.keras.Model):
+    """
+    K QNetworks with stacked weights, called on states (K, batch, state_dim), or on the states of one member.
+    The i-th weight of member k is the k-th slice of the i-th weight, in the order of QNetwork.get_weights.
+    With a seed, the i-th layer initializes member k with the seed seed + i * members + k
+    """
+    def __init__(self, members, state_dim, action_dim, param_dim, num_layers=2, width_layers=64, seed=None):
+        super(EnsembleQNetwork, self).__init__()
+        seeds = _layer_seeds(seed, members, num_layers + 2)
+        self.hidden = [EnsembleDense(members, width_layers, activation='relu', seed=seeds[i]) for i in range(num_layers)]
+        self.q_value = EnsembleDense(members, action_dim, activation='linear', seed=seeds[num_layers])
+        self.param_value = EnsembleDense(members, param_dim, seed=seeds[num_layers + 1])
+
+    def call(self, state, member=None):
+        x = state
+        for layer in self.hidden:
+            x = layer(x, member=member)
+        q_value = self.q_value(x, member=member)
+        param_value = self.param_value(x, member=member)
+        return q_value, param_value
+
+class EnsembleActorNetwork(tf.keras.Model):
+    """
+    K ActorNetworks with stacked weights, like EnsembleQNetwork
+    """
+    def __init__(self, members, state_dim, param_dim, num_layers=2, width_layers=64, seed=None):
+        super(EnsembleActorNetwork, self).__init__()
+        seeds = _layer_seeds(seed, members, num_layers + 1)
+        self.hidden = [EnsembleDense(members, width_layers, activation='relu', seed=seeds[i]) for i in range(num_layers)]
+        self.param = EnsembleDense(members, param_dim, activation='tanh', seed=seeds[num_layers])
+
+    def call(self, state, member=None):
+        x = state
+        for layer in self.hidden:
+            x = layer(x, member=member)
+        param = self.param(x, member=member)
+        return param
@@ -1,31 +1,37 @@
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras import optimizers
-from memory import ReplayBuffer
+from memory import ReplayBuffer, CompactReplayBuffer, BatchPrefetcher
 import os
 from tensorflow.keras.utils import plot_model
 from model import QNetwork, ActorNetwork
 
 class PDQNAgent:
-    def __init__(self, state_dim, action_dim, param_dim, gamma=0.75, tau=0.005, buffer_size=20000, batch_size=100):
+    def __init__(self, state_dim, action_dim, param_dim, gamma=0.75, tau=0.005, buffer_size=20000, batch_size=100, num_layers=2, width_layers=64, learning_rate=1e-3, memory_size_min=0, prefetch_batches=0, memory_storage='full'):
         self.state_dim = state_dim
         self.action_dim = action_dim
         self.param_dim = param_dim
         self.gamma = gamma
         self.tau = tau
         self.batch_size = batch_size
+        self.memory_size_min = memory_size_min
 
-        self.q_network = QNetwork(state_dim, action_dim, param_dim)
-        self.target_q_network = QNetwork(state_dim, action_dim, param_dim)
-        self.actor_network = ActorNetwork(state_dim, param_dim)
-        self.target_actor_network = ActorNetwork(state_dim, param_dim)
+        self.q_network = QNetwork(state_dim, action_dim, param_dim, num_layers, width_layers)
+        self.target_q_network = QNetwork(state_dim, action_dim, param_dim, num_layers, width_layers)
+        self.actor_network = ActorNetwork(state_dim, param_dim, num_layers, width_layers)
+        self.target_actor_network = ActorNetwork(state_dim, param_dim, num_layers, width_layers)
         self._counter_steps=0
         self._update_freq=100
 
-        self.q_optimizer = optimizers.Adam(learning_rate=1e-3)
-        self.actor_optimizer = optimizers.Adam(learning_rate=1e-3)
+        self.q_optimizer = optimizers.Adam(learning_rate=learning_rate)
+        self.actor_optimizer = optimizers.Adam(learning_rate=learning_rate)
 
-        self.replay_buffer = ReplayBuffer(buffer_size)
+        if memory_storage == 'full':
+            self.replay_buffer = ReplayBuffer(buffer_size)
+        else:
+            self.replay_buffer = CompactReplayBuffer(buffer_size, state_dim, param_dim, memory_storage)
+        self.prefetch_batches = prefetch_batches
+        self._prefetcher = None  # started by the first training step, once the buffer holds enough experiences
 
         self.update_target_network(self.target_q_network, self.q_network, tau=1.0)
         self.update_target_network(self.target_actor_network, self.actor_network, tau=1.0)
@@ -44,19 +50,26 @@ class PDQNAgent:
             param = self.actor_network(np.array([state]))[0].numpy()
         return action, param
 
+    def select_actions(self, states, epsilon):
+        n_states = len(states)
+        q_values, _ = self.q_network(states)
+        actions = np.argmax(q_values.numpy(), axis=1)
+        params = self.actor_network(states).numpy()
+        explore = np.random.random(n_states) < epsilon
+        actions[explore] = np.random.randint(0, self.action_dim, explore.sum())
+        params[explore] = np.random.uniform(-1, 1, (explore.sum(), self.param_dim))
+        return actions, params
+
     def train(self):
-        if self.replay_buffer.size() < self.batch_size:
+        if self.replay_buffer.size() < max(self.batch_size, self.memory_size_min):
             return
 
-        batch = self.replay_buffer.sample(self.batch_size)
-        states, actions, rewards, next_states, dones, params = zip(*batch)
-
-        states = np.array(states)
-        next_states = np.array(next_states)
-        actions = np.array(actions)
-        rewards = np.array(rewards)
-        dones = np.array(dones)
-        params = np.array(params)
+        if self.prefetch_batches > 0:
+            if self._prefetcher is None:
+                self._prefetcher = BatchPrefetcher(self.replay_buffer, self.batch_size, self.prefetch_batches)
+            states, actions, rewards, next_states, dones, params = self._prefetcher.get()
+        else:
+            states, actions, rewards, next_states, dones, params = self.replay_buffer.sample_arrays(self.batch_size)
 
         # Train Q-network
         with tf.GradientTape() as tape:
@@ -94,6 +107,32 @@ class PDQNAgent:
     def add_experience(self, state, action, reward, next_state, done, param):
         self.replay_buffer.add((state, action, reward, next_state, done, param))
 
+    def add_experiences(self, states, actions, rewards, next_states, dones, params):
+        self.replay_buffer.add_batch(states, actions, rewards, next_states, dones, params)
+
+    def get_weights(self):
+        """
+        Weights of the online networks as lists of arrays, to rebuild the policy in another process
+        """
+        self._build()
+        return self.q_network.get_weights(), self.actor_network.get_weights()
+
+    def set_weights(self, q_weights, actor_weights):
+        self._build()
+        self.q_network.set_weights(q_weights)
+        self.actor_network.set_weights(actor_weights)
+
+    def _build(self):
+        # the networks create their variables on the first call, which may not have happened yet
+        state = np.zeros((1, self.state_dim))
+        self.q_network(state)
+        self.actor_network(state)
+
+    def close(self):
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
+            self._prefetcher = None
+
     def save_model(self, path):
         self.q_network.save(os.path.join(path, 'trained_model'), save_format='tf')
         plot_model(self.q_network, to_file=os.path.join(path, 'qnet_structure.png'), show_shapes=True, show_layer_names=True)
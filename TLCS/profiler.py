@@ -0,0 +1,128 @@
+import json
+import os
+import timeit
+from collections import Counter, defaultdict
+
+
+class Profiler:
+    """
+    Opt-in instrumentation of the training loop: per-stage timers, traci call counters and an optional
+    Chrome trace. When disabled nothing is wrapped, so the instrumented code runs unchanged
+    """
+    def __init__(self, path, enabled=False, trace=False):
+        self._path = path
+        self._enabled = enabled
+        self._origin = timeit.default_timer()
+        self._stage_calls = Counter()
+        self._stage_time = defaultdict(float)
+        self._traci_calls = Counter()
+        self._trace_file = None
+        if enabled and trace:
+            # JSON array format of the trace event files: the closing bracket is optional, so a crashed run is still readable
+            self._trace_file = open(os.path.join(path, 'trace.json'), 'w')
+            self._trace_file.write('[')
+        self._trace_separator = '\n'
+
+
+    def instrument(self, obj, method_names):
+        """
+        Replace the given methods of obj with timed versions
+        """
+        if not self._enabled:
+            return obj
+        for name in method_names:
+            setattr(obj, name, self._timed(name, getattr(obj, name)))
+        return obj
+
+
+    def instrument_traci(self, traci_module):
+        """
+        Return a view of the traci module that counts the calls of every function
+        """
+        if not self._enabled:
+            return traci_module
+        return _CountingProxy(traci_module, '', self._traci_calls)
+
+
+    def _timed(self, name, method):
+        stage_calls = self._stage_calls
+        stage_time = self._stage_time
+        clock = timeit.default_timer
+
+        def timed_method(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                end = clock()
+                stage_calls[name] += 1
+                stage_time[name] += end - start
+                if self._trace_file is not None:
+                    self._trace_file.write(self._trace_separator + json.dumps({
+                        'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+                        'ts': round((start - self._origin) * 1e6, 1), 'dur': round((end - start) * 1e6, 1),
+                    }))
+                    self._trace_separator = ',\n'
+        return timed_method
+
+
+    def save_episode(self, episode):
+        """
+        Append the record of the episode to profile.jsonl and reset the counters, returns the record
+        """
+        if not self._enabled:
+            return None
+        record = {
+            'episode': episode,
+            'stages': {name: {'calls': self._stage_calls[name], 'total_time': round(self._stage_time[name], 4)} for name in self._stage_calls},
+            'traci_calls': dict(self._traci_calls),
+        }
+        with open(os.path.join(self._path, 'profile.jsonl'), 'a') as file:
+            file.write(json.dumps(record) + '\n')
+        if self._trace_file is not None:
+            self._trace_file.flush()
+        self._stage_calls.clear()
+        self._stage_time.clear()
+        self._traci_calls.clear()
+        return record
+
+
+    def close(self):
+        if self._trace_file is not None:
+            self._trace_file.write('\n]\n')
+            self._trace_file.close()
+            self._trace_file = None
+
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+
+class _CountingProxy:
+    """
+    Wraps the traci module and its domains (vehicle, edge, ...), counting the calls by name
+    """
+    def __init__(self, target, prefix, counts):
+        self._target = target
+        self._prefix = prefix
+        self._counts = counts
+
+    def __getattr__(self, attr):
+        value = getattr(self._target, attr)
+        name = self._prefix + attr
+        if isinstance(value, type):
+            return value  # exception classes and other types are left as they are
+        if callable(value):
+            counts = self._counts
+
+            def counted(*args, **kwargs):
+                counts[name] += 1
+                return value(*args, **kwargs)
+            wrapped = counted
+        elif hasattr(value, '__dict__') or hasattr(value, '__slots__'):
+            wrapped = _CountingProxy(value, name + '.', self._counts)
+        else:
+            return value
+        setattr(self, attr, wrapped)  # cache, so the lookup happens once per attribute
+        return wrapped
@@ -0,0 +1,567 @@
+import glob
+import hashlib
+import json
+import os
+import struct
+import sys
+import timeit
+import zlib
+
+import numpy as np
+
+from fake_traci import constants
+
+MAGIC = b'TRACILOG1\n'
+CHUNK_SIZE = 1 << 16  # bytes of records compressed at a time
+UNCHECKED_ARGUMENTS = ('start', 'load', 'close')  # the command line holds the paths of the recording session, close its wait flag
+
+
+class FatalTraCIError(Exception):
+    pass
+
+
+class TraCIException(Exception):
+    pass
+
+
+class ReplayMismatch(Exception):
+    """
+    The replayed code did not do what the recorded one did
+    """
+    pass
+
+
+def state_digest(state):
+    return hashlib.blake2b(np.ascontiguousarray(state, dtype=np.float64).tobytes(), digest_size=8).digest()
+
+
+class _Encoder:
+    """
+    Tagged binary encoding of the traci values, with every string written once and referenced by index afterwards
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self._strings = {}
+
+    def varint(self, n):
+        buffer = self.buffer
+        while n >= 0x80:
+            buffer.append((n & 0x7f) | 0x80)
+            n >>= 7
+        buffer.append(n)
+
+    def value(self, value):
+        buffer = self.buffer
+        if value is None:
+            buffer += b'N'
+        elif isinstance(value, (bool, np.bool_)):
+            buffer += b'T' if value else b'F'
+        elif isinstance(value, (int, np.integer)):
+            n = int(value)
+            buffer += b'i'
+            self.varint(n << 1 if n >= 0 else (-n << 1) - 1)
+        elif isinstance(value, (float, np.floating)):
+            buffer += b'd'
+            buffer += struct.pack('<d', value)
+        elif isinstance(value, str):
+            index = self._strings.get(value)
+            if index is None:
+                self._strings[value] = len(self._strings)
+                data = value.encode()
+                buffer += b'S'
+                self.varint(len(data))
+                buffer += data
+            else:
+                buffer += b's'
+                self.varint(index)
+        elif isinstance(value, bytes):
+            buffer += b'b'
+            self.varint(len(value))
+            buffer += value
+        elif isinstance(value, dict):
+            buffer += b'm'
+            self.varint(len(value))
+            for key, item in value.items():
+                self.value(key)
+                self.value(item)
+        elif isinstance(value, (tuple, list, np.ndarray)):
+            buffer += b't' if isinstance(value, tuple) else b'l'
+            self.varint(len(value))
+            for item in value:
+                self.value(item)
+        else:
+            raise TypeError("cannot record a value of type %s" % type(value).__name__)
+
+
+class _Decoder:
+    def __init__(self, data):
+        self._data = data
+        self._position = 0
+        self._strings = []
+
+    def more(self):
+        return self._position < len(self._data)
+
+    def kind(self):
+        self._position += 1
+        return chr(self._data[self._position - 1])
+
+    def varint(self):
+        data = self._data
+        n = shift = 0
+        while True:
+            byte = data[self._position]
+            self._position += 1
+            n |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return n
+            shift += 7
+
+    def value(self):
+        tag = self.kind()
+        if tag == 'N':
+            return None
+        if tag == 'T':
+            return True
+        if tag == 'F':
+            return False
+        if tag == 'i':
+            n = self.varint()
+            return (n >> 1) ^ -(n & 1)
+        if tag == 'd':
+            self._position += 8
+            return struct.unpack_from('<d', self._data, self._position - 8)[0]
+        if tag == 'S':
+            size = self.varint()
+            self._position += size
+            string = self._data[self._position - size:self._position].decode()
+            self._strings.append(string)
+            return string
+        if tag == 's':
+            return self._strings[self.varint()]
+        if tag == 'b':
+            size = self.varint()
+            self._position += size
+            return bytes(self._data[self._position - size:self._position])
+        if tag == 'm':
+            return {self.value(): self.value() for _ in range(self.varint())}
+        if tag == 't':
+            return tuple(self.value() for _ in range(self.varint()))
+        if tag == 'l':
+            return [self.value() for _ in range(self.varint())]
+        raise ValueError("corrupted log: unknown tag %r" % tag)
+
+
+class _EpisodeLog:
+    """
+    Log of one episode: the header with the settings in JSON, then the records compressed as a zlib stream.
+    Records: C call (name, arguments, result), X call that raised (name, arguments, exception, message),
+    D decision of the agent (action, parameters, state digest), E experience (reward, done)
+    """
+    def __init__(self, file_path, settings):
+        self.file_path = file_path
+        self._file = open(file_path, 'wb')
+        header = json.dumps(settings).encode()
+        self._file.write(MAGIC + struct.pack('<I', len(header)) + header)
+        self._compressor = zlib.compressobj(6)
+        self._encoder = _Encoder()
+
+    def call(self, name, args, result):
+        encoder = self._encoder
+        encoder.buffer += b'C'
+        encoder.value(name)
+        encoder.value(args)
+        encoder.value(result)
+        self._flush_chunk()
+
+    def error(self, name, args, error):
+        encoder = self._encoder
+        encoder.buffer += b'X'
+        encoder.value(name)
+        encoder.value(args)
+        encoder.value(type(error).__name__)
+        encoder.value(str(error))
+        self._flush_chunk()
+
+    def decision(self, state, action, param):
+        encoder = self._encoder
+        encoder.buffer += b'D'
+        encoder.value(int(action))
+        encoder.value([float(value) for value in np.ravel(param)])
+        encoder.value(state_digest(state))
+        self._flush_chunk()
+
+    def experience(self, reward, done):
+        encoder = self._encoder
+        encoder.buffer += b'E'
+        encoder.value(reward)
+        encoder.value(done)
+        self._flush_chunk()
+
+    def _flush_chunk(self, force=False):
+        buffer = self._encoder.buffer
+        if force or len(buffer) >= CHUNK_SIZE:
+            self._file.write(self._compressor.compress(bytes(buffer)))
+            buffer.clear()
+
+    def close(self):
+        self._flush_chunk(force=True)
+        self._file.write(self._compressor.flush())
+        self._file.close()
+
+
+def read_log(file_path):
+    """
+    Settings and records of an episode log. A log cut by a crash is read up to its last complete record
+    """
+    with open(file_path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a traci log" % file_path)
+        size = struct.unpack('<I', file.read(4))[0]
+        settings = json.loads(file.read(size))
+        data = zlib.decompressobj().decompress(file.read())
+    decoder = _Decoder(data)
+    records = []
+    try:
+        while decoder.more():
+            kind = decoder.kind()
+            if kind in ('C', 'X'):
+                name, args = decoder.value(), decoder.value()
+                outcome = decoder.value() if kind == 'C' else (decoder.value(), decoder.value())
+                records.append((kind, name, args, outcome))
+            elif kind == 'D':
+                records.append((kind, decoder.value(), decoder.value(), decoder.value()))
+            elif kind == 'E':
+                records.append((kind, decoder.value(), decoder.value()))
+            else:
+                raise ValueError("corrupted log: unknown record %r" % kind)
+    except (IndexError, struct.error):
+        pass  # truncated
+    return settings, records
+
+
+class TraciRecorder:
+    """
+    Wraps the traci module and writes every request and response of an episode, from start (or load) to close,
+    in a compact binary log: episode_N.traci in the folder. Wrapped with wrap_agent, the agent writes its decisions
+    in the same log, so that TraciReplay can run the episode again without SUMO and without the networks
+    """
+    def __init__(self, traci_module, folder, settings=None):
+        self._traci = traci_module
+        self._folder = folder
+        self._settings = settings if settings is not None else {}
+        self._log = None
+        self._last_file = None  # log of the last episode closed
+        self._n_logs = 0
+        os.makedirs(folder, exist_ok=True)
+
+
+    def __getattr__(self, attr):
+        value = getattr(self._traci, attr)
+        if isinstance(value, type):
+            return value  # exception classes
+        if callable(value):
+            wrapped = self._recorded(attr, value)
+        elif hasattr(value, '__dict__') or hasattr(value, '__slots__'):
+            wrapped = _RecordingDomain(self, value, attr + '.')
+        else:
+            return value
+        setattr(self, attr, wrapped)  # cache, so the lookup happens once per attribute
+        return wrapped
+
+
+    def _recorded(self, name, function):
+        def recorded(*args):
+            log = self._log
+            if log is None:
+                return function(*args)  # outside the episodes, like the shutdown of a persistent session
+            try:
+                result = function(*args)
+            except Exception as error:
+                log.error(name, args, error)
+                raise
+            log.call(name, args, result)
+            return result
+        return recorded
+
+
+    def start(self, cmd, **kwargs):
+        self._open()
+        return self._recorded('start', lambda cmd: self._traci.start(cmd, **kwargs))(list(cmd))
+
+
+    def load(self, args):
+        self._open()
+        return self._recorded('load', self._traci.load)(list(args))
+
+
+    def close(self, wait=True):
+        try:
+            return self._recorded('close', self._traci.close)(wait)
+        finally:
+            if self._log is not None:
+                self._log.close()
+                self._last_file = self._log.file_path
+                self._log = None
+
+
+    def _open(self):
+        if self._log is not None:
+            self._log.close()  # an episode that did not reach the close, after a crash
+        self._n_logs += 1
+        self._log = _EpisodeLog(os.path.join(self._folder, 'episode_%i.traci' % self._n_logs), self._settings)
+
+
+    def wrap_agent(self, Agent):
+        return _RecordingAgent(self, Agent)
+
+
+    def save_stats(self, episode, **stats):
+        """
+        Append the stats of the last episode closed to index.jsonl, which the replay checks
+        """
+        with open(os.path.join(self._folder, 'index.jsonl'), 'a') as index:
+            index.write(json.dumps(dict(file=os.path.basename(self._last_file), episode=episode, **stats)) + '\n')
+
+
+    @property
+    def log(self):
+        return self._log
+
+
+class _RecordingDomain:
+    def __init__(self, recorder, target, prefix):
+        self._recorder = recorder
+        self._target = target
+        self._prefix = prefix
+
+    def __getattr__(self, attr):
+        value = getattr(self._target, attr)
+        if isinstance(value, type):
+            return value
+        if callable(value):
+            wrapped = self._recorder._recorded(self._prefix + attr, value)
+        elif hasattr(value, '__dict__') or hasattr(value, '__slots__'):
+            wrapped = _RecordingDomain(self._recorder, value, self._prefix + attr + '.')
+        else:
+            return value
+        setattr(self, attr, wrapped)
+        return wrapped
+
+
+class _RecordingAgent:
+    """
+    The agent, with its decisions and the rewards it gets written in the log of the episode
+    """
+    def __init__(self, recorder, Agent):
+        self._recorder = recorder
+        self._Agent = Agent
+
+    def __getattr__(self, attr):
+        return getattr(self._Agent, attr)
+
+    def select_action(self, state, epsilon):
+        action, param = self._Agent.select_action(state, epsilon)
+        if self._recorder.log is not None:
+            self._recorder.log.decision(state, action, param)
+        return action, param
+
+    def add_experience(self, state, action, reward, next_state, done, param):
+        self._Agent.add_experience(state, action, reward, next_state, done, param)
+        if self._recorder.log is not None:
+            self._recorder.log.experience(reward, done)
+
+
+class TraciReplay:
+    """
+    traci backend serving the responses of a log of TraciRecorder from memory. In strict mode the calls must come
+    in the recorded order with the recorded arguments; otherwise every call is looked up among the calls recorded
+    in the same simulation step, so the code may reorder, repeat or drop calls. A call that cannot be served raises
+    ReplayMismatch
+    """
+    FatalTraCIError = FatalTraCIError
+    TraCIException = TraCIException
+    constants = constants
+
+    def __init__(self, file_path, strict=True):
+        self._settings, records = read_log(file_path)
+        self._calls = [record for record in records if record[0] in ('C', 'X')]
+        self._decisions = [record[1:] for record in records if record[0] == 'D']
+        self._experiences = [record[1:] for record in records if record[0] == 'E']
+        self._strict = strict
+        self._position = 0
+        self._step = 0
+        self._steps = [{}]
+        for record in self._calls:
+            self._steps[-1].setdefault((record[1], _key(record[1], record[2])), []).append(record)
+            if record[1] == 'simulationStep':
+                self._steps.append({})
+
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        name = _ReplayName(self, attr)
+        setattr(self, attr, name)
+        return name
+
+
+    def call(self, name, args):
+        if self._strict:
+            if self._position >= len(self._calls):
+                raise ReplayMismatch("call %i %s%r: the log ends after %i calls" % (self._position, name, args, len(self._calls)))
+            record = self._calls[self._position]
+            if record[1] != name or _key(name, record[2]) != _key(name, args):
+                raise ReplayMismatch("call %i is %s%r, the log has %s%r" % (self._position, name, args, record[1], record[2]))
+            self._position += 1
+        else:
+            if name in ('start', 'load'):
+                self._step = 0
+            recorded = self._steps[self._step].get((name, _key(name, args))) if self._step < len(self._steps) else None
+            if not recorded:
+                raise ReplayMismatch("%s%r was not recorded at step %i" % (name, args, self._step))
+            record = recorded.pop(0) if len(recorded) > 1 else recorded[0]  # the last response serves the repeated calls
+            if name == 'simulationStep':
+                self._step += 1
+        if record[0] == 'X':
+            exception, message = record[3]
+            raise (FatalTraCIError if exception == 'FatalTraCIError' else TraCIException)(message)
+        return record[3]
+
+
+    def agent(self, check=True):
+        """
+        Agent taking the recorded decisions. With check, the states it gets and the rewards must be the recorded ones
+        """
+        return _ReplayAgent(self._decisions, self._experiences, check)
+
+
+    @property
+    def settings(self):
+        return self._settings
+
+
+    @property
+    def n_calls(self):
+        return len(self._calls)
+
+
+def _key(name, args):
+    return () if name in UNCHECKED_ARGUMENTS else args
+
+
+class _ReplayName:
+    """
+    A function or a domain of the traci API: traci.vehicle.getIDList is the call 'vehicle.getIDList'
+    """
+    def __init__(self, replay, name):
+        self._replay = replay
+        self._name = name
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        name = _ReplayName(self._replay, self._name + '.' + attr)
+        setattr(self, attr, name)
+        return name
+
+    def __call__(self, *args, **kwargs):
+        return self._replay.call(self._name, args)
+
+
+class _ReplayAgent:
+    def __init__(self, decisions, experiences, check):
+        self._decisions = decisions
+        self._experiences = experiences
+        self._check = check
+        self._n_decisions = 0
+        self._n_experiences = 0
+
+    def select_action(self, state, epsilon):
+        if self._n_decisions >= len(self._decisions):
+            raise ReplayMismatch("decision %i: the log has %i decisions" % (self._n_decisions, len(self._decisions)))
+        action, param, digest = self._decisions[self._n_decisions]
+        if self._check and state_digest(state) != digest:
+            raise ReplayMismatch("the state of decision %i differs from the recorded one" % self._n_decisions)
+        self._n_decisions += 1
+        return action, np.asarray(param)
+
+    def add_experience(self, state, action, reward, next_state, done, param):
+        if self._check:
+            if self._n_experiences >= len(self._experiences):
+                raise ReplayMismatch("experience %i: the log has %i experiences" % (self._n_experiences, len(self._experiences)))
+            if (reward, done) != tuple(self._experiences[self._n_experiences]):
+                raise ReplayMismatch("the reward of experience %i is %r, the recorded one %r" % (self._n_experiences, reward, self._experiences[self._n_experiences][0]))
+        self._n_experiences += 1
+
+    def train(self):
+        pass
+
+
+class _RecordedDemand:
+    """
+    The demand of a replayed episode is in its log, no route file is generated
+    """
+    def generate_routefile_normal(self, seed):
+        pass
+
+
+def replay_episode(file_path, strict=True, check=True):
+    """
+    Run the recorded episode through Simulation with the replay backend, returns the simulation, its run time
+    and the number of calls replayed
+    """
+    from detectors import DetectorObserver
+    from topology import load_topology
+    from training_simulation import Simulation
+
+    Replay = TraciReplay(file_path, strict)
+    settings = Replay.settings
+    Topology = load_topology(os.path.join('intersection', settings['net_file_name']))
+    Observer = DetectorObserver(Topology, Replay, settings['num_states']) if settings['observation'] == 'detectors' else None
+    Replayed = Simulation(
+        Replay.agent(check),
+        _RecordedDemand(),
+        [],
+        settings['max_steps'],
+        settings['green_duration'],
+        settings['yellow_duration'],
+        settings['num_states'],
+        0,  # no training
+        Replay,
+        settings['green_durations'],
+        Topology,
+        Observer
+    )
+    start_time = timeit.default_timer()
+    Replayed.run(0, 0.0)
+    return Replayed, timeit.default_timer() - start_time, Replay.n_calls
+
+
+if __name__ == "__main__":
+    # replay the recordings of a training session and check them: python recording.py models/model_N/recordings [--lookup]
+    folder = sys.argv[1]
+    strict = '--lookup' not in sys.argv[2:]
+    index_file = os.path.join(folder, 'index.jsonl')
+    entries = [json.loads(line) for line in open(index_file)] if os.path.exists(index_file) \
+        else [{'file': os.path.basename(file_path)} for file_path in sorted(glob.glob(os.path.join(folder, '*.traci')))]
+    failures = 0
+    for entry in entries:
+        try:
+            Replayed, run_time, n_calls = replay_episode(os.path.join(folder, entry['file']), strict)
+        except ReplayMismatch as error:
+            print(entry['file'], '- MISMATCH:', error)
+            failures += 1
+            continue
+        stats = {
+            'reward': Replayed.reward_store[-1],
+            'delay': Replayed.cumulative_wait_store[-1],
+            'queue': Replayed.avg_queue_length_store[-1],
+            'travel_time': Replayed.avg_travel_time_store[-1],
+        }
+        different = [name for name, value in stats.items() if name in entry and entry[name] != value]
+        if different:
+            failures += 1
+        print(entry['file'], '- %i calls replayed in %.3f s (%.0f calls/s)' % (n_calls, run_time, n_calls / run_time),
+              '- stats:', 'MISMATCH in ' + ', '.join(different) if different else 'OK' if 'reward' in entry else 'not recorded')
+    sys.exit(1 if failures > 0 else 0)
@@ -0,0 +1,600 @@
+import io
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from collections import deque
+
+import numpy as np
+
+from transport import TransitionRing
+
+HEARTBEAT_INTERVAL = 2.0  # seconds between two heartbeats of a worker
+HEARTBEAT_TIMEOUT = 10.0  # a worker silent for longer is dropped and its episode is handed out again
+MAX_STALENESS = 8  # versions of the weights an episode may lag behind the learner, older episodes are discarded
+CHUNK_TRANSITIONS = 200  # transitions streamed to the learner in one message
+RECONNECT_DELAY = 1.0  # seconds a worker waits before connecting again to the learner
+NODE_SETTINGS = ('backend', 'sumo_cores', 'agent_cores', 'intra_op_threads', 'inter_op_threads')  # settings of every node, not taken from the learner
+
+
+def send_message(sock, header, payload=b''):
+    """
+    One frame: the sizes of the header and of the payload, the header in JSON, then the binary payload
+    """
+    data = json.dumps(header).encode()
+    sock.sendall(struct.pack('<II', len(data), len(payload)) + data + payload)
+
+
+def recv_message(sock):
+    header_size, payload_size = struct.unpack('<II', _recv_exactly(sock, 8))
+    header = json.loads(_recv_exactly(sock, header_size))
+    payload = _recv_exactly(sock, payload_size) if payload_size > 0 else b''
+    return header, payload
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def pack_arrays(**arrays):
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def unpack_arrays(payload):
+    with np.load(io.BytesIO(payload)) as arrays:
+        return {name: arrays[name] for name in arrays.files}
+
+
+def pack_weights(q_weights, actor_weights):
+    arrays = {'q_%i' % i: weights for i, weights in enumerate(q_weights)}
+    arrays.update(('actor_%i' % i, weights) for i, weights in enumerate(actor_weights))
+    return pack_arrays(**arrays)
+
+
+def unpack_weights(payload):
+    arrays = unpack_arrays(payload)
+    def weights(prefix):
+        return [arrays['%s_%i' % (prefix, i)] for i in range(len([name for name in arrays if name.startswith(prefix + '_')]))]
+    return weights('q'), weights('actor')
+
+
+class RolloutLearner:
+    """
+    Learner of a distributed training session. Rollout workers (python rollout.py <host> <port>, on this machine or
+    on others) register over TCP, run the episodes it hands out with the last weights it published and stream their
+    transitions back, through a shared memory ring for the workers on this machine. Workers that stop sending
+    heartbeats are dropped and their episode is handed out again, and the episodes run with weights more than
+    max_staleness versions old are discarded.
+    Same interface as Simulation for training_main: every run waits for the next episode completed by a worker,
+    adds its transitions to the agent, trains it and publishes the new weights
+    """
+    def __init__(self, Agent, config, host, port, max_staleness=MAX_STALENESS, heartbeat_timeout=HEARTBEAT_TIMEOUT):
+        self._Agent = Agent
+        self._config = {key: value for key, value in config.items() if key not in NODE_SETTINGS}
+        self._total_episodes = config['total_episodes']
+        self._training_epochs = config['training_epochs']
+        self._max_staleness = max_staleness
+        self._heartbeat_timeout = heartbeat_timeout
+        self._lock = threading.Lock()
+        self._workers = {}  # worker id -> {'name', 'last_seen', 'episode'}
+        self._next_worker_id = 1
+        self._next_episode = 0
+        self._retry = deque()  # episodes of failed workers and discarded episodes, handed out again first
+        self._epsilon = 1.0
+        self._finished = False
+        self._results = queue.Queue()  # (kind, worker id, episode, version, content) from the connections
+        self._pending = {}  # (worker id, episode) -> chunks of transitions of the episodes in progress
+        self._rings = {}  # worker id -> shared memory ring of a worker on this machine
+        self._reward_store = []
+        self._cumulative_wait_store = []
+        self._avg_queue_length_store = []
+        self._avg_travel_time_store = []
+        self._discarded_episodes = 0
+        self._worker_failures = 0
+        self._version = 0
+        self._publish()
+
+        self._server = _LearnerServer((host, port), _LearnerHandler)
+        self._server.learner = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._monitor, daemon=True).start()
+        print("----- Learner waiting for rollout workers on", self._server.server_address)
+
+
+    def run(self, episode, epsilon, next_episode=None):
+        """
+        Wait for the next episode completed by a worker, then train on its transitions. The episode number is the one
+        of the training loop, the workers run the episodes in the order they are handed out
+        """
+        start_time = timeit.default_timer()
+        self._epsilon = epsilon
+        while True:
+            kind, worker_id, task_episode, version, content = self._results.get()
+            key = (worker_id, task_episode)
+            if kind == 'chunk':
+                with self._lock:
+                    registered = worker_id in self._workers
+                if registered:  # the chunks of a dropped worker may still arrive after its episode failed
+                    self._pending.setdefault(key, []).append(content)
+                continue
+            chunks = self._pending.pop(key, [])
+            if kind == 'failed':
+                continue  # the episode was handed out again, its chunks are dropped
+            if self._version - version > self._max_staleness:
+                print("Episode", task_episode, "of worker", worker_id, "ran with weights version", version, "of", self._version, "- discarded")
+                self._discarded_episodes += 1
+                with self._lock:
+                    self._retry.append(task_episode)
+                continue
+            break
+
+        n_transitions = 0
+        for arrays in chunks:
+            self._Agent.add_experiences(arrays['states'].astype(np.float64), arrays['actions'], arrays['rewards'], arrays['next_states'].astype(np.float64),
+                                        arrays['dones'], arrays['params'].astype(np.float64))
+            n_transitions += len(arrays['actions'])
+        self._reward_store.append(content['reward'])
+        self._cumulative_wait_store.append(content['delay'])
+        self._avg_queue_length_store.append(content['queue'])
+        self._avg_travel_time_store.append(content['travel_time'])
+        print("Episode", task_episode, "from worker", worker_id, "-", n_transitions, "transitions - weights version", version, "of", self._version,
+              "- total reward:", content['reward'])
+        simulation_time = round(timeit.default_timer() - start_time, 1)
+
+        print("Training...")
+        start_time = timeit.default_timer()
+        for _ in range(self._training_epochs):
+            self._Agent.train()
+        training_time = round(timeit.default_timer() - start_time, 1)
+        self._version += 1
+        self._publish()
+        return simulation_time, training_time
+
+
+    def _publish(self):
+        q_weights, actor_weights = self._Agent.get_weights()
+        weights = pack_weights(q_weights, actor_weights)
+        with self._lock:
+            self._weights = (self._version, weights)
+
+
+    def _monitor(self):
+        """
+        Drop the workers that stopped sending heartbeats
+        """
+        while True:
+            time.sleep(self._heartbeat_timeout / 4)
+            now = timeit.default_timer()
+            with self._lock:
+                silent = [worker_id for worker_id, worker in self._workers.items() if now - worker['last_seen'] > self._heartbeat_timeout]
+            for worker_id in silent:
+                self._drop(worker_id, "no heartbeat for %.0f s" % self._heartbeat_timeout)
+
+
+    def _drop(self, worker_id, reason):
+        with self._lock:
+            worker = self._workers.pop(worker_id, None)
+            if worker is None:
+                return
+            self._worker_failures += 1
+            if worker['episode'] is not None:
+                self._retry.append(worker['episode'])
+        print("Worker", worker_id, "(%s)" % worker['name'], "dropped:", reason)
+        if worker['episode'] is not None:
+            self._results.put(('failed', worker_id, worker['episode'], None, None))
+
+
+    def handle(self, header, payload, connection):
+        """
+        Answer a request of a worker, from the thread of its connection
+        """
+        op = header.get('op')
+        if op == 'register':
+            with self._lock:
+                worker_id = self._next_worker_id
+                self._next_worker_id += 1
+                self._workers[worker_id] = {'name': header.get('name', ''), 'last_seen': timeit.default_timer(), 'episode': None}
+            connection['worker_id'] = worker_id
+            ring = None
+            if header.get('host') == socket.gethostname():
+                # a worker on this machine writes its transitions into shared memory, its chunk messages only announce them
+                ring = TransitionRing(CHUNK_TRANSITIONS, self._config['num_states'], self._Agent.param_dim)
+                self._rings[worker_id] = ring
+            print("Worker", worker_id, "registered:", header.get('name', '') + (" (shared memory)" if ring is not None else ""))
+            return {'worker_id': worker_id, 'config': self._config, 'heartbeat_interval': HEARTBEAT_INTERVAL,
+                    'ring': ring.spec() if ring is not None else None}, b''
+
+        worker_id = header.get('worker_id')
+        with self._lock:
+            worker = self._workers.get(worker_id)
+            if worker is None:
+                return {'error': 'unknown worker'}, b''
+            worker['last_seen'] = timeit.default_timer()
+            version, weights = self._weights
+
+        if op == 'heartbeat':
+            return {'version': version, 'stop': self._finished}, b''
+        if op == 'weights':
+            return {'version': version}, weights
+        if op == 'task':
+            with self._lock:
+                if self._finished:
+                    return {'stop': True}, b''
+                if self._retry:
+                    episode = self._retry.popleft()
+                elif self._next_episode < self._total_episodes:
+                    episode = self._next_episode
+                    self._next_episode += 1
+                else:
+                    return {'wait': True}, b''  # every episode is handed out, one may still fail
+                worker['episode'] = episode
+            return {'episode': episode, 'epsilon': self._epsilon, 'version': version}, b''
+        if op == 'transitions':
+            if header.get('ring'):
+                arrays = self._consume_ring(self._rings[worker_id])
+            else:
+                arrays = unpack_arrays(payload)
+                arrays['next_states'] = arrays['states'][1:]
+                arrays['states'] = arrays['states'][:-1]
+            if arrays is not None:
+                self._results.put(('chunk', worker_id, header['episode'], header['version'], arrays))
+            return {'version': version}, b''
+        if op == 'done':
+            with self._lock:
+                worker['episode'] = None
+            self._results.put(('done', worker_id, header['episode'], header['version'], header['stats']))
+            return {'version': version}, b''
+        if op == 'failed':
+            with self._lock:
+                worker['episode'] = None
+                self._retry.append(header['episode'])
+            self._results.put(('failed', worker_id, header['episode'], None, None))
+            return {'version': version}, b''
+        if op == 'leave':
+            with self._lock:
+                self._workers.pop(worker_id, None)
+            return {}, b''
+        return {'error': "unknown op '%s'" % op}, b''
+
+
+    @staticmethod
+    def _consume_ring(ring):
+        """
+        Copy the transitions pending in the ring of a worker into the arrays of a chunk
+        """
+        parts = []
+        ring.consume(lambda *fields: parts.append([np.array(field) for field in fields]))
+        names = ('states', 'actions', 'rewards', 'next_states', 'dones', 'params')
+        return {name: np.concatenate([part[i] for part in parts]) for i, name in enumerate(names)} if parts else None
+
+
+    def release_ring(self, worker_id):
+        """
+        Remove the ring of a worker once its connection is closed
+        """
+        ring = self._rings.pop(worker_id, None)
+        if ring is not None:
+            ring.close()
+
+
+    def close(self, timeout=2 * HEARTBEAT_INTERVAL):
+        """
+        Tell the workers that the session is over, then stop the server
+        """
+        self._finished = True
+        deadline = timeit.default_timer() + timeout
+        while self._workers and timeit.default_timer() < deadline:
+            time.sleep(0.1)
+        self._server.shutdown()
+        self._server.server_close()
+        for worker_id in list(self._rings):
+            self.release_ring(worker_id)
+        print("----- Rollout workers: %i failures, %i episodes discarded as stale" % (self._worker_failures, self._discarded_episodes))
+
+
+    @property
+    def reward_store(self):
+        return self._reward_store
+
+
+    @property
+    def cumulative_wait_store(self):
+        return self._cumulative_wait_store
+
+
+    @property
+    def avg_queue_length_store(self):
+        return self._avg_queue_length_store
+
+
+    @property
+    def avg_travel_time_store(self):
+        return self._avg_travel_time_store
+
+
+class _LearnerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _LearnerHandler(socketserver.BaseRequestHandler):
+    """
+    One connection of a worker: requests and responses in turn, until it is closed
+    """
+    def handle(self):
+        learner = self.server.learner
+        connection = {'worker_id': None}
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while True:
+                header, payload = recv_message(self.request)
+                response, response_payload = learner.handle(header, payload, connection)
+                send_message(self.request, response, response_payload)
+        except (ConnectionError, OSError, struct.error, ValueError):
+            pass
+        if connection['worker_id'] is not None:
+            if not learner._finished:
+                learner._drop(connection['worker_id'], "connection lost")
+            learner.release_ring(connection['worker_id'])
+
+
+class RolloutWorker:
+    """
+    Daemon running the episodes handed out by the learner with the weights it publishes, streaming the transitions
+    back in compressed chunks. If the learner drops it or the connection is lost, the episode in progress is abandoned
+    and the worker registers again
+    """
+    def __init__(self, host, port, name=None, backend=None, make_agent=None):
+        self._address = (host, port)
+        self._name = name if name is not None else '%s:%i' % (socket.gethostname(), os.getpid())
+        self._backend = backend
+        self._make_agent = make_agent if make_agent is not None else _make_agent
+        self._socket = None
+        self._socket_lock = threading.Lock()
+        self._worker_id = None
+        self._ring = None  # shared memory ring given by a learner on this machine
+        self._Simulation = None
+        self._version = -1  # version of the weights of the agent
+        self._abandoned = False
+        self._stop = False
+
+
+    def serve(self):
+        """
+        Run episodes until the learner ends the session
+        """
+        while not self._stop:
+            try:
+                self._connect()
+                while not self._stop and not self._abandoned:
+                    task, _ = self._request({'op': 'task'})
+                    if task.get('stop'):
+                        self._stop = True
+                    elif task.get('wait'):
+                        time.sleep(HEARTBEAT_INTERVAL / 2)
+                    else:
+                        self._run_task(task)
+            except (ConnectionError, OSError) as error:
+                print("Connection to the learner lost (%s), connecting again" % error)
+                time.sleep(RECONNECT_DELAY)
+            finally:
+                self._disconnect()
+        if self._Simulation is not None and self._config['persistent_session']:
+            self._traci_module.shutdown()
+
+
+    def _connect(self):
+        self._socket = socket.create_connection(self._address)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._abandoned = False
+        registration, _ = self._request({'op': 'register', 'name': self._name, 'host': socket.gethostname()})
+        self._worker_id = registration['worker_id']
+        if registration.get('ring') is not None:
+            self._ring = TransitionRing.attach(registration['ring'])
+        if self._Simulation is None:
+            self._setup(registration['config'])
+        self._Streaming.ring = self._ring
+        print("----- Registered as worker", self._worker_id, "of", self._address)
+        threading.Thread(target=self._heartbeat, args=(self._socket, registration['heartbeat_interval']), daemon=True).start()
+
+
+    def _setup(self, config):
+        from detectors import write_detector_file
+        from evaluator import build_simulation
+        from topology import load_topology
+
+        config = dict(config)
+        config['backend'] = self._backend if self._backend is not None else 'sumo'
+        config['sumo_cores'] = None
+        self._config = config
+        self._path = tempfile.mkdtemp(prefix='rollout_')  # route file of the worker, apart from the ones of other workers
+        detector_file = None
+        if config['observation'] == 'detectors':
+            Topology = load_topology(os.path.join('intersection', config['net_file_name']))
+            detector_file = write_detector_file(Topology, os.path.join(self._path, 'detectors.add.xml'))
+        self._Agent = self._make_agent(config)
+        self._Streaming = _StreamingAgent(self, self._Agent)
+        self._Simulation, self._traci_module = build_simulation(self._path, config, self._Streaming, 'rollout_routes.rou.xml', detector_file)
+
+
+    def _disconnect(self):
+        if self._socket is not None:
+            try:
+                if self._stop:
+                    self._request({'op': 'leave'})
+            except (ConnectionError, OSError):
+                pass
+            self._socket.close()
+            self._socket = None
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+
+
+    def _request(self, header, payload=b'', sock=None):
+        """
+        Send a request on the connection (the current one by default), returns the response and its payload
+        """
+        with self._socket_lock:
+            sock = sock if sock is not None else self._socket
+            if sock is None:
+                raise ConnectionError("not connected")
+            if header['op'] != 'register':
+                header = dict(header, worker_id=self._worker_id)
+            send_message(sock, header, payload)
+            response, response_payload = recv_message(sock)
+        if response.get('error') == 'unknown worker':
+            raise ConnectionError("dropped by the learner")
+        return response, response_payload
+
+
+    def _heartbeat(self, sock, interval):
+        while self._socket is sock and not self._stop:
+            time.sleep(interval)
+            try:
+                self._request({'op': 'heartbeat'}, sock=sock)
+            except (ConnectionError, OSError):
+                self._abandoned = True
+                return
+
+
+    def _run_task(self, task):
+        if task['version'] != self._version:
+            response, weights = self._request({'op': 'weights'})
+            self._Agent.set_weights(*unpack_weights(weights))
+            self._version = response['version']
+        self._episode = task['episode']
+        self._Streaming.reset()
+        try:
+            self._Simulation.run(task['episode'], task['epsilon'])
+        except self._traci_module.FatalTraCIError as error:
+            print("SUMO crashed during episode", task['episode'], "(%s)" % error)
+            try:
+                self._traci_module.close()
+            except Exception:
+                pass  # already closed by the crash
+            self._Streaming.flush()  # empties the ring, the learner drops the transitions of the failed episode
+            self._request({'op': 'failed', 'episode': task['episode']})
+            return
+        if self._abandoned:
+            return
+        self._Streaming.flush()
+        Simulation = self._Simulation
+        self._request({'op': 'done', 'episode': task['episode'], 'version': self._version, 'stats': {
+            'reward': Simulation.reward_store[-1],
+            'delay': Simulation.cumulative_wait_store[-1],
+            'queue': Simulation.avg_queue_length_store[-1],
+            'travel_time': Simulation.avg_travel_time_store[-1],
+        }})
+
+
+    def send_chunk(self, payload=b''):
+        """
+        Stream a chunk of transitions of the current episode, unless it was abandoned. Without payload, the chunk is
+        the transitions written into the ring
+        """
+        if self._abandoned:
+            return
+        try:
+            self._request({'op': 'transitions', 'episode': self._episode, 'version': self._version, 'ring': not payload}, payload)
+        except (ConnectionError, OSError):
+            self._abandoned = True  # the episode runs to its end without streaming, then the worker connects again
+
+
+    @property
+    def abandoned(self):
+        return self._abandoned
+
+
+class _StreamingAgent:
+    """
+    The agent of the worker, collecting the transitions of the episode into chunks. Consecutive transitions share
+    their states, so a chunk of n transitions holds n + 1 states. With a ring, the transitions are written into it
+    and a chunk message tells the learner to read them
+    """
+    def __init__(self, Worker, Agent):
+        self._Worker = Worker
+        self._Agent = Agent
+        self.ring = None
+        self.reset()
+
+    def reset(self):
+        self._in_ring = 0
+        self._states = []
+        self._actions = []
+        self._rewards = []
+        self._dones = []
+        self._params = []
+
+    def select_action(self, state, epsilon):
+        return self._Agent.select_action(state, epsilon)
+
+    def add_experience(self, state, action, reward, next_state, done, param):
+        if self.ring is not None:
+            if not self._Worker.abandoned:  # nobody reads the ring of an abandoned episode
+                self.ring.put(state, action, reward, next_state, done, param)
+                self._in_ring += 1
+                if self._in_ring >= CHUNK_TRANSITIONS:
+                    self.flush()
+            return
+        if self._states and state is not self._states[-1]:
+            self.flush()
+        if not self._states:
+            self._states.append(state)
+        self._states.append(next_state)
+        self._actions.append(action)
+        self._rewards.append(reward)
+        self._dones.append(done)
+        self._params.append(param)
+        if len(self._actions) >= CHUNK_TRANSITIONS:
+            self.flush()
+
+    def flush(self):
+        if self._in_ring:
+            self._Worker.send_chunk()
+        if self._actions:
+            self._Worker.send_chunk(pack_arrays(
+                states=np.array(self._states, dtype=np.float32),
+                actions=np.array(self._actions, dtype=np.int16),
+                rewards=np.array(self._rewards, dtype=np.float64),
+                dones=np.array(self._dones, dtype=np.bool_),
+                params=np.array(self._params, dtype=np.float32)
+            ))
+        self.reset()
+
+    def train(self):
+        pass
+
+
+def _make_agent(config):
+    from pdqnagent import PDQNAgent
+    return PDQNAgent(
+        config['num_states'],
+        config['num_actions'],
+        config['final_action'],
+        buffer_size=1,  # the experiences are streamed to the learner
+        num_layers=config['num_layers'],
+        width_layers=config['width_layers']
+    )
+
+
+if __name__ == "__main__":
+    # python rollout.py <learner host> <learner port> [backend], from the TLCS folder
+    backend = sys.argv[3] if len(sys.argv) > 3 else None
+    RolloutWorker(sys.argv[1], int(sys.argv[2]), backend=backend).serve()
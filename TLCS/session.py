@@ -0,0 +1,103 @@
+import timeit
+
+
+def load_arguments(sumo_cmd):
+    """
+    Options of a SUMO command line without the binary (and the taskset prefix), as taken by traci.load
+    """
+    if sumo_cmd[0] == 'taskset':
+        sumo_cmd = sumo_cmd[3:]  # taskset -c <cores>, whose -c is not the one of SUMO
+    return sumo_cmd[sumo_cmd.index('-c'):]
+
+
+class PersistentSession:
+    """
+    Wraps the traci module so that one SUMO process serves the whole training session: the first start launches it,
+    the next ones reset it with traci.load (reading the new route file) and close leaves it running.
+    If SUMO crashed, the next start launches it again
+    """
+    def __init__(self, traci_module):
+        self._traci = traci_module
+        self._running = False
+        self._launch_time = None  # startup time of the last launch of the SUMO process
+        self._startup_times = {}  # episode -> startup time of SUMO for it (of the last attempt, if it was repeated)
+        self._restarts = 0
+
+
+    def __getattr__(self, attr):
+        return getattr(self._traci, attr)
+
+
+    def start(self, cmd, episode=None, **kwargs):
+        """
+        Launch or reset SUMO for the episode. Without episode, the startup time is kept under the number of the start
+        """
+        start_time = timeit.default_timer()
+        if not self._running:
+            self._launch(cmd, kwargs)
+        else:
+            try:
+                self._traci.load(load_arguments(cmd))
+            except (self._traci.FatalTraCIError, OSError) as error:
+                print("SUMO could not be reset (%s), launching it again" % error)
+                self._discard()
+                self._launch(cmd, kwargs)
+                self._restarts += 1
+        startup_time = timeit.default_timer() - start_time
+        if self._launch_time is None:
+            self._launch_time = startup_time
+        self._startup_times[episode if episode is not None else len(self._startup_times)] = startup_time
+
+
+    def _launch(self, cmd, kwargs):
+        self._launch_time = None
+        self._traci.start(cmd, **kwargs)
+        self._running = True
+
+
+    def _discard(self):
+        """
+        Drop the connection to a SUMO that crashed, so that a new one can be started
+        """
+        try:
+            self._traci.close(False)
+        except Exception:
+            pass
+        self._running = False
+
+
+    def close(self, wait=True):
+        pass  # SUMO keeps running until the end of the session
+
+
+    def shutdown(self):
+        """
+        Close SUMO at the end of the session
+        """
+        if self._running:
+            self._traci.close()
+            self._running = False
+
+
+    @property
+    def startup_times(self):
+        return self._startup_times
+
+
+    @property
+    def launch_time(self):
+        return self._launch_time
+
+
+    def startup_saving(self, episode):
+        """
+        Seconds saved by the reset of the episode compared with launching SUMO
+        """
+        if episode not in self._startup_times or self._launch_time is None:
+            return 0.0
+        return self._launch_time - self._startup_times[episode]
+
+
+    @property
+    def restarts(self):
+        return self._restarts
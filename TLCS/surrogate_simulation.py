@@ -0,0 +1,343 @@
+import numpy as np
+import timeit
+import xml.etree.ElementTree as ET
+
+from topology import load_topology
+from training_simulation import CELL_LIMITS, STATE_LANE_LENGTH, param_to_green_duration
+
+JAM_SPACING = 7.5  # length + min gap of the "Car" vehicle type
+SATURATION_FLOW = 0.5  # vehicles per second and per lane
+MIN_VEHICLES = 1e-3  # smaller amounts of vehicles in a cell are dropped
+HALTING_SPEED = 0.1  # below this speed a vehicle is halting (as in SUMO)
+ADAPTED_TRAVEL_TIME = 10  # travel time set on every incoming road by Simulation.set_travel_time
+
+
+class SurrogateSimulation:
+    """
+    Cell-transmission model of the network that advances many independent environments in lockstep,
+    producing the state and reward of Simulation from the cells, to pretrain the agent before training in SUMO.
+    The speeds of a state are normalized by the min and max over the whole state, not cumulatively like Simulation does
+    """
+    def __init__(self, Agent, net_file, n_envs, max_steps, n_cars_generated, yellow_duration, num_states, training_epochs, seed=0, green_durations=(4, 7, 10, 14)):
+        self._Agent = Agent
+        self._n_envs = n_envs
+        self._max_steps = max_steps
+        self._n_cars_generated = n_cars_generated
+        self._yellow_duration = yellow_duration
+        self._num_states = num_states
+        self._training_epochs = training_epochs
+        self._seed = seed
+        self._green_durations = green_durations
+        self._reward_store = []
+        self._cumulative_wait_store = []
+        self._avg_queue_length_store = []
+        self._avg_travel_time_store = []
+        self._load_net(net_file)
+
+
+    def _load_net(self, net_file):
+        """
+        Build cell sizes, green masks, phase durations and the routing between incoming lanes from the net file
+        """
+        net = ET.parse(net_file).getroot()
+        topology = load_topology(net_file)  # same lane order as the lane groups of Simulation._get_state
+        edges = {edge.get('id'): edge for edge in net.iter('edge') if edge.get('function') != 'internal'}
+
+        lane_ids = []
+        lane_length = []
+        lane_speed = []
+        for road in topology.incoming_roads:
+            for lane in sorted(edges[road].iter('lane'), key=lambda lane: int(lane.get('index'))):
+                lane_ids.append(lane.get('id'))
+                lane_length.append(float(lane.get('length')))
+                lane_speed.append(float(lane.get('speed')))
+        lane_index = {lane_id: i for i, lane_id in enumerate(lane_ids)}
+        n_lanes = len(lane_ids)
+        n_cells = len(CELL_LIMITS) + 1
+        if n_lanes * n_cells != self._num_states:
+            raise ValueError("the net has %i incoming lanes, which do not match %i states" % (n_lanes, self._num_states))
+
+        # Simulation._get_state takes STATE_LANE_LENGTH - position as the distance from the traffic light, so on a shorter
+        # lane its cells are shifted back from the stop line by the difference, and the first ones can stay empty
+        lane_length = np.array(lane_length)[:, None]
+        limits = np.clip(np.array(CELL_LIMITS, dtype=float)[None, :] - (STATE_LANE_LENGTH - lane_length), 0, lane_length)
+        cell_length = np.diff(np.concatenate([np.zeros((n_lanes, 1)), limits, lane_length], axis=1), axis=1)
+        self._capacity = cell_length / JAM_SPACING
+        self._cell_length = np.maximum(cell_length, 1.0)  # divisor of the flows, the capacity keeps empty cells empty
+        # the vehicles of a lane leave it from its first cell with a length, the one at the stop line
+        self._lane_range = np.arange(n_lanes)
+        self._stop_cell = (cell_length > 0).argmax(axis=1)
+        self._free_speed = np.array(lane_speed)[:, None]
+        # backward wave speed of the triangular fundamental diagram
+        critical_density = SATURATION_FLOW / self._free_speed
+        self._wave_speed = SATURATION_FLOW / (1 / JAM_SPACING - critical_density)
+
+        # connections leaving every incoming lane
+        connections = {lane_id: [] for lane_id in lane_ids}
+        for connection in net.iter('connection'):
+            lane_id = connection.get('from') + '_' + connection.get('fromLane')
+            if lane_id in connections and connection.get('tl') is not None:
+                connections[lane_id].append((connection.get('to'), connection.get('tl'), int(connection.get('linkIndex'))))
+
+        # share of the vehicles entering an edge that uses each of its lanes, proportional to their connections
+        def lane_shares(road):
+            lanes = [lane_id for lane_id in lane_ids if lane_id.rsplit('_', 1)[0] == road]
+            weights = np.array([max(len(connections[lane_id]), 1) for lane_id in lanes], dtype=float)
+            return zip(lanes, weights / weights.sum())
+
+        # routing[l, m] = share of the vehicles leaving lane l that enter lane m, the rest leaves the network
+        self._routing = np.zeros((n_lanes, n_lanes))
+        for lane_id, lane_connections in connections.items():
+            for to_edge, _, _ in lane_connections:
+                if topology.is_incoming(to_edge):
+                    for to_lane, share in lane_shares(to_edge):
+                        self._routing[lane_index[lane_id], lane_index[to_lane]] += share / len(lane_connections)
+        max_destinations = max(1, int((self._routing > 0).sum(axis=1).max()))
+        self._destinations = np.full((n_lanes, max_destinations), n_lanes)  # n_lanes points to a dummy lane
+        for l in range(n_lanes):
+            destinations = np.flatnonzero(self._routing[l])
+            self._destinations[l, :len(destinations)] = destinations
+
+        # vehicles are generated uniformly on the roads entering the network
+        self._entry_share = np.zeros(n_lanes)
+        for road in topology.entry_roads:
+            for lane_id, share in lane_shares(road):
+                self._entry_share[lane_index[lane_id]] = share / len(topology.entry_roads)
+
+        # all the traffic lights receive the same phase, so the program of the first one gives the durations
+        tl_logics = {tl_logic.get('id'): [phase for phase in tl_logic.iter('phase')] for tl_logic in net.iter('tlLogic')}
+        self._green_phases = np.array([topology.green_phase(action) for action in range(topology.num_actions)])
+        self._yellow_phases = np.array([topology.yellow_phase(action) for action in range(topology.num_actions)])
+        first_program = next(iter(tl_logics.values()))
+        self._phase_duration = np.array([int(float(phase.get('duration'))) for phase in first_program])
+        self._green_mask = np.zeros((len(first_program), n_lanes))
+        for lane_id, lane_connections in connections.items():
+            for _, tl_id, link_index in lane_connections:
+                for p, phase in enumerate(tl_logics[tl_id]):
+                    if phase.get('state')[link_index] in ('G', 'g'):
+                        self._green_mask[p, lane_index[lane_id]] = 1
+
+
+    def run(self, episode, epsilon):
+        """
+        Runs an episode in every environment, then starts a training session
+        """
+        start_time = timeit.default_timer()
+        self._reset(episode)
+        print("Simulating", self._n_envs, "surrogate environments...")
+
+        # inits
+        n_envs = self._n_envs
+        old_total_wait = np.zeros(n_envs)
+        old_queue = np.zeros(n_envs)
+        max_queue = np.zeros(n_envs)
+        old_state = None
+        old_action = np.full(n_envs, -1)
+        old_param = None
+
+        while (self._step < self._max_steps).any():
+            running = self._step < self._max_steps
+
+            # same state and reward as Simulation.run, for every environment at once
+            current_state = self._get_state()
+            current_total_wait = self._collect_waiting_times()
+            current_queue = self._get_queue_length()
+            max_queue = np.maximum(current_queue, max_queue)
+            safe_max_queue = np.where(max_queue != 0, max_queue, 1)
+            reward = np.where(max_queue != 0,
+                              np.trunc(old_total_wait * (old_queue / safe_max_queue) - current_total_wait * (current_queue / safe_max_queue)),
+                              old_total_wait - current_total_wait)
+
+            if old_state is not None:
+                for i in np.flatnonzero(running):
+                    self._Agent.add_experience(old_state[i], old_action[i], reward[i], current_state[i], False, old_param[i])
+
+            action, param = self._Agent.select_actions(current_state, epsilon)
+
+            # yellow phase only when the chosen phase changes, then the green phase of the binned duration
+            yellow = np.where((old_state is not None) & (old_action != action), self._yellow_duration, 0)
+            green = param_to_green_duration(param[:, 0], self._green_durations)
+            self._simulate(old_action, action, yellow, green, running)
+
+            old_state = current_state
+            old_action = action
+            old_param = param
+            old_total_wait = current_total_wait
+            old_queue = current_queue
+            self._sum_neg_reward += np.where(running & (reward < 0), reward, 0)
+
+        self._save_episode_stats()
+        print("Mean total reward:", round(float(np.mean(self._sum_neg_reward)), 1), "- Epsilon:", round(epsilon, 2))
+        simulation_time = round(timeit.default_timer() - start_time, 1)
+
+        print("Training...")
+        start_time = timeit.default_timer()
+        for _ in range(self._training_epochs):
+            self._Agent.train()
+        training_time = round(timeit.default_timer() - start_time, 1)
+
+        return simulation_time, training_time
+
+
+    def _reset(self, episode):
+        n_lanes, n_cells = self._cell_length.shape
+        self._rng = np.random.default_rng(self._seed + episode)
+        self._vehicles = np.zeros((self._n_envs, n_lanes, n_cells))
+        self._waiting = np.zeros((self._n_envs, n_lanes, n_cells))  # accumulated waiting time of the vehicles in each cell
+        self._speed = np.broadcast_to(self._free_speed, (self._n_envs, n_lanes, n_cells)).copy()
+        self._pending = np.zeros((self._n_envs, n_lanes))  # generated vehicles not inserted yet
+        self._phase = np.zeros(self._n_envs, dtype=int)
+        self._phase_remaining = np.full(self._n_envs, self._phase_duration[0])
+        self._step = np.zeros(self._n_envs, dtype=int)
+        self._sum_neg_reward = np.zeros(self._n_envs)
+        self._sum_queue_length = np.zeros(self._n_envs)
+        self._sum_waiting_time = np.zeros(self._n_envs)
+        self._sum_travel_time = np.zeros(self._n_envs)
+
+        # departures follow the same normal distribution as TrafficGenerator.generate_routefile_normal
+        steps = np.arange(self._max_steps + 1)
+        mean, std = self._max_steps / 2, self._max_steps / 10
+        density = np.exp(-0.5 * ((steps - mean) / std) ** 2)
+        self._departure_rate = self._n_cars_generated * density / density.sum()
+
+
+    def _simulate(self, old_action, action, yellow, green, running):
+        """
+        Execute the yellow and green phases of every environment, each one for its own duration
+        """
+        steps_todo = np.where(running, np.minimum(yellow + green, self._max_steps - self._step), 0)
+        calls = 1 + (yellow > 0)  # Simulation._simulate collects the travel times once per phase
+        self._sum_travel_time += calls * ADAPTED_TRAVEL_TIME * self._vehicles.sum(axis=(1, 2)) * running
+
+        for t in range(int(steps_todo.max(initial=0))):
+            set_yellow = (t == 0) & (yellow > 0) & (steps_todo > 0)
+            self._set_phase(set_yellow, self._yellow_phases[old_action])  # old_action is -1 only without yellow
+            set_green = (t == yellow) & (steps_todo > t)
+            self._set_phase(set_green, self._green_phases[action])
+            active = t < steps_todo
+            self._simulation_step(active)
+            self._step += active
+            queue_length = self._get_queue_length() * active
+            self._sum_queue_length += queue_length
+            self._sum_waiting_time += queue_length
+
+
+    def _set_phase(self, mask, phase):
+        self._phase = np.where(mask, phase, self._phase)
+        self._phase_remaining = np.where(mask, self._phase_duration[self._phase], self._phase_remaining)
+
+
+    def _simulation_step(self, active):
+        """
+        Advance by one second the environments flagged as active
+        """
+        n = self._vehicles
+        active_cells = active[:, None, None]
+        length = self._cell_length
+        free_space = np.maximum(self._capacity - n, 0)
+
+        lanes, stop_cell = self._lane_range, self._stop_cell
+
+        # sending and receiving capacities of every cell, index 0 is the cell nearest to the traffic light
+        sending = np.minimum(np.minimum(n, SATURATION_FLOW), n * self._free_speed / length)
+        receiving = np.minimum(SATURATION_FLOW, np.minimum(free_space, self._wave_speed * free_space / length))
+        flow = np.minimum(sending[:, :, 1:], receiving[:, :, :-1]) * active_cells
+
+        # discharge at the stop line on green, held back when the downstream lanes are full
+        discharge = sending[:, lanes, stop_cell] * self._green_mask[self._phase] * active[:, None]
+        demand = discharge @ self._routing
+        room = receiving[:, :, -1]
+        ratio = np.where(demand > room, room / np.maximum(demand, 1e-9), 1.0)
+        ratio = np.concatenate([ratio, np.ones((self._n_envs, 1))], axis=1)
+        discharge = discharge * ratio[:, self._destinations].min(axis=2)
+
+        # speed and halting vehicles of the step, from the outflow of each cell
+        outflow = np.concatenate([np.zeros((self._n_envs, len(lanes), 1)), flow], axis=2)
+        outflow[:, lanes, stop_cell] += discharge
+        occupied = n > 0
+        self._speed = np.where(occupied, np.minimum(self._free_speed, outflow * length / np.where(occupied, n, 1)), self._free_speed)
+        halting = np.where(self._speed < HALTING_SPEED, n, 0) * active_cells
+
+        # move vehicles and their accumulated waiting time together
+        inverse = np.where(occupied, 1 / np.where(occupied, n, 1), 0)
+        waiting_flow = self._waiting[:, :, 1:] * flow * inverse[:, :, 1:]
+        waiting_discharge = self._waiting[:, lanes, stop_cell] * discharge * inverse[:, lanes, stop_cell]
+        self._vehicles[:, :, 1:] -= flow
+        self._vehicles[:, :, :-1] += flow
+        self._vehicles[:, lanes, stop_cell] -= discharge
+        self._vehicles[:, :, -1] += discharge @ self._routing
+        self._waiting[:, :, 1:] -= waiting_flow
+        self._waiting[:, :, :-1] += waiting_flow
+        self._waiting[:, lanes, stop_cell] -= waiting_discharge
+        self._waiting[:, :, -1] += waiting_discharge @ self._routing
+        self._waiting += halting
+
+        # drop the residual fractions of vehicles left behind by the geometric outflow of the cells
+        residual = self._vehicles < MIN_VEHICLES
+        self._vehicles[residual] = 0
+        self._waiting[residual] = 0
+
+        # new vehicles wait outside the network until the first cell has room
+        rate = self._departure_rate[np.minimum(self._step, self._max_steps)]
+        self._pending += self._rng.poisson(rate[:, None] * self._entry_share[None, :]) * active[:, None]
+        inserted = np.minimum(self._pending, np.maximum(self._capacity[:, -1] - self._vehicles[:, :, -1], 0))
+        self._pending -= inserted
+        self._vehicles[:, :, -1] += inserted
+
+        # traffic light programs
+        self._phase_remaining -= active
+        expired = active & (self._phase_remaining <= 0)
+        self._set_phase(expired, (self._phase + 1) % len(self._phase_duration))
+
+
+    def _get_state(self):
+        """
+        Cell occupancy plus the speed min/max normalized over the occupied cells of the environment, as in
+        Simulation._get_state (0 when all the speeds are equal). Simulation normalizes every vehicle by the min and max
+        of the vehicles read before it, so its states differ slightly from these
+        """
+        occupied = (self._vehicles >= 0.5).reshape(self._n_envs, self._num_states)
+        speed = self._speed.reshape(self._n_envs, self._num_states)
+        min_speed = np.where(occupied, speed, np.inf).min(axis=1, keepdims=True)
+        max_speed = np.where(occupied, speed, -np.inf).max(axis=1, keepdims=True)
+        spread = max_speed - min_speed
+        normalized = np.where(spread > 0, (speed - min_speed) / np.where(spread > 0, spread, 1), 0)
+        return np.where(occupied, 1 + normalized, 0)
+
+
+    def _collect_waiting_times(self):
+        return self._waiting.sum(axis=(1, 2))
+
+
+    def _get_queue_length(self):
+        return np.where(self._speed < HALTING_SPEED, self._vehicles, 0).sum(axis=(1, 2))
+
+
+    def _save_episode_stats(self):
+        """
+        Save the stats of the episode, averaged over the environments
+        """
+        self._reward_store.append(np.mean(self._sum_neg_reward))
+        self._cumulative_wait_store.append(np.mean(self._sum_waiting_time))
+        self._avg_queue_length_store.append(np.mean(self._sum_queue_length) / self._max_steps)
+        self._avg_travel_time_store.append(np.mean(self._sum_travel_time) / 200)
+
+
+    @property
+    def reward_store(self):
+        return self._reward_store
+
+
+    @property
+    def cumulative_wait_store(self):
+        return self._cumulative_wait_store
+
+
+    @property
+    def avg_queue_length_store(self):
+        return self._avg_queue_length_store
+
+
+    @property
+    def avg_travel_time_store(self):
+        return self._avg_travel_time_store
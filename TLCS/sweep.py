@@ -0,0 +1,142 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import configparser
+import csv
+import itertools
+import os
+import random
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import read_metrics
+from utils import allocate_path
+
+THREAD_VARIABLES = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS']
+
+
+def import_sweep_configuration(config_file):
+    """
+    Read the config file of the sweep: the [sweep] options and the candidate values of every swept key
+    """
+    content = configparser.ConfigParser()
+    content.optionxform = str  # keep the case of the swept keys
+    content.read(config_file)
+    config = {}
+    config['base_config'] = content['sweep']['base_config']
+    config['sweeps_path_name'] = content['sweep']['sweeps_path_name']
+    config['search'] = content['sweep']['search']
+    config['n_runs'] = content['sweep'].getint('n_runs')
+    config['seed'] = content['sweep'].getint('seed')
+    config['n_workers'] = content['sweep'].getint('n_workers')
+    config['threads_per_run'] = content['sweep'].getint('threads_per_run')
+    # section.key = value | value | ...
+    config['parameters'] = {key: [value.strip() for value in values.split('|')] for key, values in content['parameters'].items()}
+    return config
+
+
+def expand_runs(parameters, search, n_runs, seed):
+    """
+    List the settings of every run: all the combinations (grid) or n_runs random ones (random)
+    """
+    keys = list(parameters)
+    if search == 'grid':
+        return [dict(zip(keys, values)) for values in itertools.product(*(parameters[key] for key in keys))]
+    elif search == 'random':
+        rng = random.Random(seed)
+        return [{key: rng.choice(parameters[key]) for key in keys} for _ in range(n_runs)]
+    else:
+        sys.exit("unknown search '%s', use 'grid' or 'random'" % search)
+
+
+def write_run_config(base_config, settings, run_path, config_file, threads_per_run):
+    """
+    Write the training config of a run: the base config with the swept keys replaced
+    """
+    content = configparser.ConfigParser()
+    content.read(base_config)
+    for key, value in settings.items():
+        section, option = key.split('.', 1)
+        content[section][option] = value
+    content['dir']['models_path_name'] = run_path  # the run trains in run_path/model_1
+    content['visualization'] = {'background_plots': 'False'}
+    if not content.has_section('cpu'):
+        content.add_section('cpu')
+    content['cpu']['intra_op_threads'] = str(threads_per_run)
+    content['cpu']['inter_op_threads'] = '1'
+    with open(config_file, 'w') as file:
+        content.write(file)
+
+
+def train(run_name, config_file, log_file, threads_per_run):
+    """
+    Run training_main.py on the config of the run, with a limited number of threads
+    """
+    env = dict(os.environ)
+    for variable in THREAD_VARIABLES:
+        env[variable] = str(threads_per_run)
+    print("Starting", run_name)
+    with open(log_file, 'w') as log:
+        result = subprocess.run([sys.executable, 'training_main.py', config_file], stdout=log, stderr=subprocess.STDOUT, env=env)
+    print("Finished", run_name, "- exit code:", result.returncode)
+    return result.returncode
+
+
+def collect_results(runs, sweep_path):
+    """
+    Gather the final metrics of every run into one table, best final reward first
+    """
+    table = []
+    for run_name, settings, returncode in runs:
+        row = {'run': run_name, 'exit_code': returncode}
+        row.update(settings)
+        metrics_file = os.path.join(sweep_path, run_name, 'model_1', 'metrics.csv')
+        if os.path.exists(metrics_file):
+            metrics = read_metrics(metrics_file)
+            if metrics['episode']:
+                row['episodes'] = len(metrics['episode'])
+                row['final_reward'] = metrics['reward'][-1]
+                row['best_reward'] = max(metrics['reward'])
+                row['final_delay'] = metrics['delay'][-1]
+                row['final_queue'] = metrics['queue'][-1]
+                row['final_travel_time'] = metrics['travel_time'][-1]
+        table.append(row)
+    table.sort(key=lambda row: row.get('final_reward', float('-inf')), reverse=True)
+    return table
+
+
+def save_table(table, file_path):
+    columns = []
+    for row in table:
+        columns += [column for column in row if column not in columns]
+    with open(file_path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(table)
+    return columns
+
+
+if __name__ == "__main__":
+
+    config = import_sweep_configuration(config_file=sys.argv[1] if len(sys.argv) > 1 else 'sweep_settings.ini')
+    sweep_path = allocate_path(os.path.join(os.getcwd(), config['sweeps_path_name'], ''), 'sweep_')
+    run_settings = expand_runs(config['parameters'], config['search'], config['n_runs'], config['seed'])
+    print("----- Sweep of", len(run_settings), "runs on", config['n_workers'], "workers, saved at:", sweep_path)
+
+    jobs = []
+    with ThreadPoolExecutor(max_workers=config['n_workers']) as pool:
+        for i, settings in enumerate(run_settings):
+            run_name = 'run_' + str(i + 1)
+            config_file = os.path.join(sweep_path, run_name + '.ini')
+            write_run_config(config['base_config'], settings, os.path.join(sweep_path, run_name), config_file, config['threads_per_run'])
+            log_file = os.path.join(sweep_path, run_name + '.log')
+            jobs.append((run_name, settings, pool.submit(train, run_name, config_file, log_file, config['threads_per_run'])))
+        runs = [(run_name, settings, job.result()) for run_name, settings, job in jobs]
+
+    table = collect_results(runs, sweep_path)
+    columns = save_table(table, os.path.join(sweep_path, 'results.csv'))
+    print("\n----- Results (also saved in results.csv)")
+    print('\t'.join(columns))
+    for row in table:
+        print('\t'.join(str(row.get(column, '')) for column in columns))
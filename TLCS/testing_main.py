@@ -6,52 +6,90 @@ from shutil import copyfile
 
 from testing_simulation import Simulation
 from generator import TrafficGenerator
-from model import TestModel
 from visualization import Visualization
-from utils import import_test_configuration, set_sumo, set_test_path
+from utils import import_test_configuration, set_sumo, set_traci, set_test_path
+from topology import load_topology
+from cache import EvaluationCache, episode_result, scenario_parameters, weights_digest
 
 
 if __name__ == "__main__":
 
     config = import_test_configuration(config_file='testing_settings.ini')
-    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'])
+    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'], config['backend'], fidelity=config['fidelity'])
+    traci_module = set_traci(config['backend'])
+    Topology = load_topology(os.path.join('intersection', config['net_file_name']))
     model_path, plot_path = set_test_path(config['models_path_name'], config['model_to_test'])
 
-    Model = TestModel(
-        input_dim=config['num_states'],
-        output_dim=config['num_actions'],
-        model_path=model_path
-    )
+    # the results of the episodes already run on the same weights, scenario and code are read from the cache
+    Cache = EvaluationCache(config['cache_folder'], config['cache_max_mb']) if config['cache_enabled'] else None
+    weights = weights_digest(model_path) if Cache is not None else None
+    results = {}
+    keys = {}
+    for seed in config['episode_seeds']:
+        if weights is not None:
+            keys[seed] = Cache.key(weights, scenario_parameters(config, seed))
+            results[seed] = Cache.get(keys[seed][0])
+    missing = [seed for seed in config['episode_seeds'] if results.get(seed) is None]
 
-    TrafficGen = TrafficGenerator(
-        config['max_steps'], 
-        config['n_cars_generated']
-    )
+    if missing:
+        from model import TestModel  # tensorflow is only loaded when an episode has to be simulated
+
+        Model = TestModel(
+            input_dim=config['num_states'],
+            output_dim=config['num_actions'],
+            model_path=model_path
+        )
+
+        TrafficGen = TrafficGenerator(
+            config['max_steps'], 
+            config['n_cars_generated'],
+            Topology=Topology,
+            streaming=config['streaming_demand'],
+            turning_routes=config['turning_routes']
+        )
+
+        Simulation = Simulation(
+            Model,
+            TrafficGen,
+            sumo_cmd,
+            config['max_steps'],
+            config['green_duration'],
+            config['delta'],
+            config['yellow_duration'],
+            config['num_states'],
+            config['num_actions'],
+            traci_module,
+            Topology
+        )
+
+        for seed in missing:
+            print('\n----- Test episode, seed', seed)
+            simulation_time = Simulation.run(seed)  # run the simulation
+            print('Simulation time:', simulation_time, 's')
+            results[seed] = episode_result(Simulation, simulation_time)
+            if seed in keys:
+                Cache.put(keys[seed][0], keys[seed][1], results[seed])
 
     Visualization = Visualization(
         plot_path, 
         dpi=96
     )
-        
-    Simulation = Simulation(
-        Model,
-        TrafficGen,
-        sumo_cmd,
-        config['max_steps'],
-        config['green_duration'],
-        config['delta'],
-        config['yellow_duration'],
-        config['num_states'],
-        config['num_actions']
-    )
 
-    print('\n----- Test episode')
-    simulation_time = Simulation.run(config['episode_seed'])  # run the simulation
-    print('Simulation time:', simulation_time, 's')
+    for seed in config['episode_seeds']:
+        result = results[seed]
+        print('Seed', seed, '- total reward:', result['reward'], '- Average queue length:', round(result['queue_mean'], 2), '- Max queue length:', result['queue_max'],
+              '(cached)' if seed not in missing else '')
 
+        # on long horizons every point of the plots is the mean of a bucket of steps, the plots of the first seed keep their names
+        suffix = '' if seed == config['episode_seed'] else '_seed_%i' % seed
+        reward_bucket = result['reward_bucket']
+        queue_bucket = result['queue_bucket']
+        Visualization.save_data_and_plot(data=result['reward_points'], filename='reward' + suffix, xlabel='Action step' + (' (means of %i)' % reward_bucket if reward_bucket > 1 else ''), ylabel='Reward')
+        Visualization.save_data_and_plot(data=result['queue_points'], filename='queue' + suffix, xlabel='Step' + (' (means of %i)' % queue_bucket if queue_bucket > 1 else ''), ylabel='Queue lenght (vehicles)')
+
+    if Cache is not None:
+        entries, size = Cache.size
+        print("----- Evaluation cache: %i hits, %i misses - %i entries, %.1f MB" % (Cache.hits, Cache.misses, entries, size / 1024 / 1024))
     print("----- Testing info saved at:", plot_path)
 
     copyfile(src='testing_settings.ini', dst=os.path.join(plot_path, 'testing_settings.ini'))
-
-    Visualization.save_data_and_plot(data=Simulation.reward_episode, filename='reward', xlabel='Action step', ylabel='Reward')
-    Visualization.save_data_and_plot(data=Simulation.queue_length_episode, filename='queue', xlabel='Step', ylabel='Queue lenght (vehicles)')
@@ -1,9 +1,11 @@
-import traci
 import numpy as np
 import random
 import timeit
 import os
 
+from metrics import StreamingSeries
+from topology import load_topology
+
 # phase codes based on environment.net.xml
 PHASE_NS_GREEN = 0  # action 0 code 00
 PHASE_NS_YELLOW = 1
@@ -16,7 +18,13 @@ PHASE_EWL_YELLOW = 7
 
 
 class Simulation:
-    def __init__(self, Model, TrafficGen, sumo_cmd, max_steps, green_duration, delta, yellow_duration, num_states, num_actions):
+    def __init__(self, Model, TrafficGen, sumo_cmd, max_steps, green_duration, delta, yellow_duration, num_states, num_actions, traci_module=None, Topology=None):
+        if traci_module is None:
+            import traci as traci_module
+        if Topology is None:
+            Topology = load_topology(os.path.join('intersection', 'environment.net.xml'))
+        self._traci = traci_module
+        self._Topology = Topology
         self._Model = Model
         self._TrafficGen = TrafficGen
         self._step = 0
@@ -27,8 +35,9 @@ class Simulation:
         self._delta=delta
         self._num_states = num_states
         self._num_actions = num_actions
-        self._reward_episode = []
-        self._queue_length_episode = []
+        # the per-step series are aggregated in constant memory, for horizons of days
+        self._reward_episode = StreamingSeries()
+        self._queue_length_episode = StreamingSeries()
 
 
     def run(self, episode):
@@ -39,12 +48,14 @@ class Simulation:
 
         # first, generate the route file for this simulation and set up sumo
         self._TrafficGen.generate_routefile(seed=episode)
-        traci.start(self._sumo_cmd)
+        self._traci.start(self._sumo_cmd)
         print("Simulating...")
 
         # inits
         self._step = 0
         self._waiting_times = {}
+        self._reward_episode.reset()
+        self._queue_length_episode.reset()
         old_action = -1 # dummy init
         old_action_arr=np.zeros(self._num_actions)
 
@@ -80,7 +91,7 @@ class Simulation:
             self._reward_episode.append(reward)
 
         #print("Total reward:", np.sum(self._reward_episode))
-        traci.close()
+        self._traci.close()
         simulation_time = round(timeit.default_timer() - start_time, 1)
 
         return simulation_time
@@ -94,7 +105,7 @@ class Simulation:
             steps_todo = self._max_steps - self._step
 
         while steps_todo > 0:
-            traci.simulationStep()  # simulate 1 step in sumo
+            self._traci.simulationStep()  # simulate 1 step in sumo
             self._step += 1 # update the step counter
             steps_todo -= 1
             queue_length = self._get_queue_length() 
@@ -105,12 +116,11 @@ class Simulation:
         """
         Retrieve the waiting time of every car in the incoming roads
         """
-        incoming_roads = ["-h11", "-v11", "h12", "v12", "-h21", "-v12", "h22", "v13", "-h12", "-v21", "h13", "v22", "-h22", "-v22", "h23", "v23"]
-        car_list = traci.vehicle.getIDList()
+        car_list = self._traci.vehicle.getIDList()
         for car_id in car_list:
-            wait_time = traci.vehicle.getAccumulatedWaitingTime(car_id)
-            road_id = traci.vehicle.getRoadID(car_id)  # get the road id where the car is located
-            if road_id in incoming_roads:  # consider only the waiting times of cars in incoming roads
+            wait_time = self._traci.vehicle.getAccumulatedWaitingTime(car_id)
+            road_id = self._traci.vehicle.getRoadID(car_id)  # get the road id where the car is located
+            if self._Topology.is_incoming(road_id):  # consider only the waiting times of cars in incoming roads
                 self._waiting_times[car_id] = wait_time
             else:
                 if car_id in self._waiting_times: # a car that was tracked has cleared the intersection
@@ -130,78 +140,25 @@ class Simulation:
         """
         Activate the correct yellow light combination in sumo
         """
-        yellow_phase_code = old_action * 2 + 1 # obtain the yellow phase code, based on the old action (ref on environment.net.xml)
-        traci.trafficlight.setPhase("1", yellow_phase_code)
-        traci.trafficlight.setPhase("2", yellow_phase_code)
-        traci.trafficlight.setPhase("5", yellow_phase_code)
-        traci.trafficlight.setPhase("6", yellow_phase_code)
+        yellow_phase_code = self._Topology.yellow_phase(old_action)  # obtain the yellow phase code, based on the old action (ref on environment.net.xml)
+        for tl_id in self._Topology.tl_ids:
+            self._traci.trafficlight.setPhase(tl_id, yellow_phase_code)
 
 
     def _set_green_phase(self, action_number):
         """
         Activate the correct green light combination in sumo
         """
-
-
-        if action_number == 0:
-            traci.trafficlight.setPhase("1", PHASE_NS_GREEN)
-            traci.trafficlight.setPhase("2", PHASE_NS_GREEN)
-            traci.trafficlight.setPhase("5", PHASE_NS_GREEN)
-            traci.trafficlight.setPhase("6", PHASE_NS_GREEN)
-        elif action_number == 1:
-            traci.trafficlight.setPhase("1", PHASE_NSL_GREEN)
-            traci.trafficlight.setPhase("2", PHASE_NSL_GREEN)
-            traci.trafficlight.setPhase("5", PHASE_NSL_GREEN)
-            traci.trafficlight.setPhase("6", PHASE_NSL_GREEN)
-        elif action_number == 2:
-            traci.trafficlight.setPhase("1", PHASE_EW_GREEN)
-            traci.trafficlight.setPhase("2", PHASE_EW_GREEN)
-            traci.trafficlight.setPhase("5", PHASE_EW_GREEN)
-            traci.trafficlight.setPhase("6", PHASE_EW_GREEN)
-        elif action_number == 3:
-            traci.trafficlight.setPhase("1", PHASE_EWL_GREEN)
-            traci.trafficlight.setPhase("2", PHASE_EWL_GREEN)
-            traci.trafficlight.setPhase("5", PHASE_EWL_GREEN)
-            traci.trafficlight.setPhase("6", PHASE_EWL_GREEN)
+        green_phase_code = self._Topology.green_phase(action_number)
+        for tl_id in self._Topology.tl_ids:
+            self._traci.trafficlight.setPhase(tl_id, green_phase_code)
     
     def _traffic(self, action_number):
-        if action_number==0:
-            halt_1 = traci.lane.getLastStepHaltingNumber("-v11_0")
-            halt_2 = traci.lane.getLastStepHaltingNumber("-v12_0")
-            halt_3 = traci.lane.getLastStepHaltingNumber("v13_0")
-            halt_4 = traci.lane.getLastStepHaltingNumber("v12_0")
-            halt_5 = traci.lane.getLastStepHaltingNumber("-v21_0")
-            halt_6 = traci.lane.getLastStepHaltingNumber("-v22_0")
-            halt_7 = traci.lane.getLastStepHaltingNumber("v23_0")
-            halt_8 = traci.lane.getLastStepHaltingNumber("v22_0")
-        elif action_number==1:
-            halt_1 = traci.lane.getLastStepHaltingNumber("-v11_1")
-            halt_2 = traci.lane.getLastStepHaltingNumber("-v12_1")
-            halt_3 = traci.lane.getLastStepHaltingNumber("v13_1")
-            halt_4 = traci.lane.getLastStepHaltingNumber("v12_1")
-            halt_5 = traci.lane.getLastStepHaltingNumber("-v21_1")
-            halt_6 = traci.lane.getLastStepHaltingNumber("-v22_1")
-            halt_7 = traci.lane.getLastStepHaltingNumber("v23_1")
-            halt_8 = traci.lane.getLastStepHaltingNumber("v22_1")
-        elif action_number==2:
-            halt_1 = traci.lane.getLastStepHaltingNumber("-h11_0")
-            halt_2 = traci.lane.getLastStepHaltingNumber("-h12_0")
-            halt_3 = traci.lane.getLastStepHaltingNumber("h13_0")
-            halt_4 = traci.lane.getLastStepHaltingNumber("h12_0")
-            halt_5 = traci.lane.getLastStepHaltingNumber("-h21_0")
-            halt_6 = traci.lane.getLastStepHaltingNumber("-h22_0")
-            halt_7 = traci.lane.getLastStepHaltingNumber("h23_0")
-            halt_8 = traci.lane.getLastStepHaltingNumber("h22_0")
-        elif action_number==3:
-            halt_1 = traci.lane.getLastStepHaltingNumber("-h11_1")
-            halt_2 = traci.lane.getLastStepHaltingNumber("-h12_1")
-            halt_3 = traci.lane.getLastStepHaltingNumber("h13_1")
-            halt_4 = traci.lane.getLastStepHaltingNumber("h12_1")
-            halt_5 = traci.lane.getLastStepHaltingNumber("-h21_1")
-            halt_6 = traci.lane.getLastStepHaltingNumber("-h22_1")
-            halt_7 = traci.lane.getLastStepHaltingNumber("h23_1")
-            halt_8 = traci.lane.getLastStepHaltingNumber("h22_1")
-        length=(halt_1+halt_2+halt_3+halt_4+halt_5+halt_6+halt_7+halt_8)//8
+        green_lanes = self._Topology.green_lanes[action_number]
+        halt = 0
+        for lane_id in green_lanes:
+            halt += self._traci.lane.getLastStepHaltingNumber(lane_id)
+        length=halt//len(green_lanes)
         return length
 
 
@@ -209,54 +166,35 @@ class Simulation:
         """
         Retrieve the number of cars with speed = 0 in every incoming lane
         """
-        halt_1 = traci.edge.getLastStepHaltingNumber("-h11")
-        halt_2 = traci.edge.getLastStepHaltingNumber("-v11")
-        halt_3 = traci.edge.getLastStepHaltingNumber("h12")
-        halt_4 = traci.edge.getLastStepHaltingNumber("v12")
-        halt_5 = traci.edge.getLastStepHaltingNumber("-h21")
-        halt_6 = traci.edge.getLastStepHaltingNumber("-v12")
-        halt_7 = traci.edge.getLastStepHaltingNumber("h22")
-        halt_8 = traci.edge.getLastStepHaltingNumber("v13")
-        halt_9 = traci.edge.getLastStepHaltingNumber("-h12")
-        halt_10 = traci.edge.getLastStepHaltingNumber("-v21")
-        halt_11 = traci.edge.getLastStepHaltingNumber("h13")
-        halt_12 = traci.edge.getLastStepHaltingNumber("v22")
-        halt_13 = traci.edge.getLastStepHaltingNumber("-h22")
-        halt_14 = traci.edge.getLastStepHaltingNumber("-v22")
-        halt_15 = traci.edge.getLastStepHaltingNumber("h23")
-        halt_16 = traci.edge.getLastStepHaltingNumber("v23")
-        
-        queue_length = halt_1 + halt_2 + halt_3 + halt_4 + halt_5 + halt_6 + halt_7 + halt_8 + halt_9 + halt_10 + halt_11 + halt_12 + halt_13 + halt_14+ halt_15 + halt_16
+        queue_length = 0
+        for road_id in self._Topology.incoming_roads:
+            queue_length += self._traci.edge.getLastStepHaltingNumber(road_id)
         return queue_length
 
     def _get_state(self):
         state=np.zeros(self._num_states)
-        state[0] = traci.edge.getLastStepHaltingNumber("-h11")
-        state[1] = traci.edge.getLastStepHaltingNumber("-v11")
-        state[2] = traci.edge.getLastStepHaltingNumber("h12")
-        state[3] = traci.edge.getLastStepHaltingNumber("v12")
-        state[4] = traci.edge.getLastStepHaltingNumber("-h21")
-        state[5] = traci.edge.getLastStepHaltingNumber("-v12")
-        state[6] = traci.edge.getLastStepHaltingNumber("h22")
-        state[7] = traci.edge.getLastStepHaltingNumber("v13")
-        state[8] = traci.edge.getLastStepHaltingNumber("-h12")
-        state[9] = traci.edge.getLastStepHaltingNumber("-v21")
-        state[10] = traci.edge.getLastStepHaltingNumber("h13")
-        state[11] = traci.edge.getLastStepHaltingNumber("v22")
-        state[12] = traci.edge.getLastStepHaltingNumber("-h22")
-        state[13] = traci.edge.getLastStepHaltingNumber("-v22")
-        state[14] = traci.edge.getLastStepHaltingNumber("h23")
-        state[15] = traci.edge.getLastStepHaltingNumber("v23")
+        for i, road_id in enumerate(self._Topology.incoming_roads):
+            state[i] = self._traci.edge.getLastStepHaltingNumber(road_id)
         return state
 
 
     @property
     def queue_length_episode(self):
-        return self._queue_length_episode
+        return self._queue_length_episode.points
 
 
     @property
     def reward_episode(self):
+        return self._reward_episode.points
+
+
+    @property
+    def queue_length_series(self):
+        return self._queue_length_episode
+
+
+    @property
+    def reward_series(self):
         return self._reward_episode
 
 
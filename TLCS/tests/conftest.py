@@ -0,0 +1,79 @@
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+# the agents are written against the Keras 2 API of tf.keras
+os.environ.setdefault('TF_USE_LEGACY_KERAS', '1')
+
+TLCS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TLCS_DIR)
+
+from generator import TrafficGenerator
+from topology import load_topology
+from utils import set_sumo, set_traci
+
+MAX_STEPS = 600
+N_CARS = 300
+NUM_STATES = 320
+
+
+@pytest.fixture(autouse=True)
+def tlcs_cwd(monkeypatch):
+    """
+    The modules open the files of the intersection with paths relative to the TLCS folder
+    """
+    monkeypatch.chdir(TLCS_DIR)
+
+
+@pytest.fixture
+def topology():
+    return load_topology(os.path.join(TLCS_DIR, 'intersection', 'environment.net.xml'))
+
+
+@pytest.fixture
+def fake_scenario(tmp_path, topology):
+    """
+    Build the sumo command, traci module and traffic generator of a fake-backend episode
+    """
+    def build(max_steps=MAX_STEPS, n_cars=N_CARS, **kwargs):
+        route_file = str(tmp_path / 'episode_routes.rou.xml')
+        sumo_cmd = set_sumo(False, 'sumo_config.sumocfg', max_steps, 'fake', route_file, **kwargs)
+        return sumo_cmd, set_traci('fake'), TrafficGenerator(max_steps, n_cars, route_file, topology)
+    return build
+
+
+class RecordingAgent:
+    """
+    Agent picking seeded random actions and recording the transitions it is given
+    """
+    def __init__(self, seed=0, action_dim=4):
+        self._rng = random.Random(seed)
+        self._action_dim = action_dim
+        self.transitions = []
+        self.trainings = 0
+
+    def select_action(self, state, epsilon):
+        return self._rng.randrange(self._action_dim), np.array([self._rng.uniform(-1, 1)])
+
+    def add_experience(self, state, action, reward, next_state, done, param):
+        self.transitions.append((state, action, reward, next_state, done, param))
+
+    def train(self):
+        self.trainings += 1
+
+
+class SeededModel:
+    """
+    Model of the testing simulation returning seeded random q-values
+    """
+    def __init__(self, seed=0, action_dim=4):
+        self._rng = np.random.RandomState(seed)
+        self._action_dim = action_dim
+        self.states = []
+
+    def predict_one(self, state):
+        self.states.append(state)
+        return self._rng.rand(self._action_dim)
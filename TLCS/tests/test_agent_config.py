@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+from utils import import_train_configuration, parse_cores, set_sumo
+
+
+def test_parse_cores():
+    assert parse_cores('') == []
+    assert parse_cores('0-2, 6,4') == [0, 1, 2, 4, 6]
+    assert parse_cores('3') == [3]
+
+
+@pytest.mark.skipif('SUMO_HOME' not in os.environ, reason="needs a SUMO installation")
+def test_sumo_is_pinned_to_its_cores():
+    sumo_cmd = set_sumo(False, 'sumo_config.sumocfg', 600, 'sumo', sumo_cores=[3, 4])
+    assert sumo_cmd[:3] == ['taskset', '-c', '3,4']
+
+
+def test_agent_follows_the_model_and_memory_sections():
+    pytest.importorskip('tensorflow')
+    from pdqnagent import PDQNAgent
+
+    config = import_train_configuration('training_settings.ini')
+    Agent = PDQNAgent(config['num_states'], config['num_actions'], config['final_action'], gamma=config['gamma'],
+                      buffer_size=config['memory_size_max'], batch_size=config['batch_size'], num_layers=3, width_layers=24,
+                      learning_rate=0.005, memory_size_min=config['memory_size_min'])
+    Agent._build()
+    q_weights, actor_weights = Agent.get_weights()
+
+    kernels = [weight.shape for weight in q_weights if weight.ndim == 2]
+    assert kernels[:3] == [(config['num_states'], 24), (24, 24), (24, 24)]
+    assert [weight.shape for weight in actor_weights if weight.ndim == 2][:3] == kernels[:3]
+    assert Agent.batch_size == config['batch_size']
+    assert Agent.replay_buffer.buffer.maxlen == config['memory_size_max']
+    assert float(Agent.q_optimizer.learning_rate.numpy()) == pytest.approx(0.005)
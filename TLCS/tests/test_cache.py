@@ -0,0 +1,73 @@
+import json
+import os
+
+from cache import EvaluationCache, episode_result, scenario_parameters, weights_digest
+from conftest import SeededModel
+from test_fake_backend import run_testing
+from utils import import_test_configuration
+
+
+def make_model(folder, weights=b'weights'):
+    os.makedirs(os.path.join(folder, 'trained_model'), exist_ok=True)
+    with open(os.path.join(folder, 'trained_model', 'variables.data'), 'wb') as file:
+        file.write(weights)
+    return str(folder)
+
+
+def test_key_follows_the_weights_and_the_scenario(tmp_path):
+    Cache = EvaluationCache(str(tmp_path / 'cache'))
+    config = import_test_configuration('testing_settings.ini')
+    first, second = make_model(tmp_path / 'model_1'), make_model(tmp_path / 'model_2')
+
+    # the same weights in another model folder give the same key
+    assert weights_digest(first) == weights_digest(second)
+    assert Cache.key(weights_digest(first), scenario_parameters(config, 1)) == Cache.key(weights_digest(second), scenario_parameters(config, 1))
+    key = Cache.key(weights_digest(first), scenario_parameters(config, 1))[0]
+    assert key != Cache.key(weights_digest(first), scenario_parameters(config, 2))[0]
+    assert key != Cache.key(weights_digest(first), scenario_parameters(dict(config, max_steps=config['max_steps'] + 1), 1))[0]
+    make_model(second, b'trained further')
+    assert key != Cache.key(weights_digest(second), scenario_parameters(config, 1))[0]
+    assert weights_digest(str(tmp_path / 'cache')) is None
+
+
+def test_episode_result_round_trip(tmp_path, fake_scenario, topology):
+    Cache = EvaluationCache(str(tmp_path / 'cache'))
+    Simulation = run_testing(fake_scenario, topology, SeededModel())
+    result = episode_result(Simulation, 1.5)
+    key, parts = Cache.key('weights', {'seed': 0})
+
+    assert Cache.get(key) is None
+    Cache.put(key, parts, result)
+    assert Cache.get(key) == json.loads(json.dumps(result))
+    assert result['reward'] == sum(Simulation.reward_episode)
+    assert result['queue_max'] == max(Simulation.queue_length_episode)
+    assert (Cache.hits, Cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    Cache = EvaluationCache(str(tmp_path / 'cache'))
+    keys = []
+    for seed in range(3):
+        key, parts = Cache.key('weights', {'seed': seed})
+        Cache.put(key, parts, {'reward': -seed})
+        os.utime(os.path.join(str(tmp_path / 'cache'), key + '.json'), (seed, seed))
+        keys.append(key)
+    Cache.get(keys[0])  # used last
+
+    entries, size = Cache.size
+    assert Cache.evict(size * 2 // entries) == 1
+    assert Cache.get(keys[1]) is None
+    assert Cache.get(keys[0]) == {'reward': 0} and Cache.get(keys[2]) == {'reward': -2}
+
+
+def test_invalidate_and_prune(tmp_path):
+    Cache = EvaluationCache(str(tmp_path / 'cache'))
+    for weights in ('first', 'second'):
+        for seed in range(2):
+            Cache.put(*Cache.key(weights, {'seed': seed}), {'reward': 0})
+
+    assert Cache.invalidate(weights='first') == 2
+    assert Cache.invalidate(seed=1) == 1
+    assert Cache.size[0] == 1
+    Cache._code = 'another version'
+    assert Cache.prune() == 1 and Cache.size[0] == 0
@@ -0,0 +1,104 @@
+import asyncio
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from controller import ControllerClient, ControllerServer
+from training_simulation import param_to_green_duration
+
+NUM_STATES = 320
+GREEN_DURATIONS = (4, 7, 10, 14)
+
+
+class EchoPolicy:
+    """
+    Policy double reading the action and the parameter from the first two values of every state
+    """
+    loads = 0
+
+    def __init__(self, model_path):
+        EchoPolicy.loads += 1
+        self.batch_sizes = []
+
+    def __call__(self, states):
+        self.batch_sizes.append(len(states))
+        return states[:, 0].astype(int), states[:, 1:2]
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def state(action, param):
+    values = np.zeros(NUM_STATES)
+    values[:2] = action, param
+    return values
+
+
+def serve_while(server, port, client_calls):
+    """
+    Run the server, then client_calls(port) in a thread, and return what the calls returned
+    """
+    async def main():
+        serving = asyncio.create_task(server.serve('127.0.0.1', port))
+        await asyncio.sleep(0.2)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, client_calls, port)
+        finally:
+            serving.cancel()
+    return asyncio.run(main())
+
+
+def test_concurrent_clients_get_their_own_decisions(tmp_path, topology):
+    server = ControllerServer(str(tmp_path), NUM_STATES, GREEN_DURATIONS, topology, load_policy=EchoPolicy, max_wait=0.05)
+
+    def decide(port, client):
+        Client = ControllerClient('127.0.0.1', port)
+        try:
+            states = [state(client % 4, -1 + client / 4), state((client + 1) % 4, 0.9)]
+            return client, Client.decide(states)
+        finally:
+            Client.close()
+
+    def clients(port):
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lambda client: decide(port, client), range(8)))
+        Client = ControllerClient('127.0.0.1', port)
+        try:
+            with pytest.raises(ValueError):
+                Client.decide([np.zeros(3)])
+            return results, Client.metrics()
+        finally:
+            Client.close()
+
+    results, metrics = serve_while(server, free_port(), clients)
+
+    for client, decisions in results:
+        expected = [(client % 4, -1 + client / 4), ((client + 1) % 4, 0.9)]
+        for (action, phase, green_duration), (expected_action, param) in zip(decisions, expected):
+            assert action == expected_action and phase == topology.green_phase(expected_action)
+            assert green_duration == param_to_green_duration(np.array([param]), GREEN_DURATIONS)[0]
+    assert metrics['requests'] == 8 and metrics['batches'] < 8
+    assert server._policy.batch_sizes and max(server._policy.batch_sizes) > 2
+    assert metrics['latency_p50_ms'] <= metrics['latency_p99_ms']
+
+
+def test_reload_swaps_the_policy(tmp_path, topology):
+    server = ControllerServer(str(tmp_path), NUM_STATES, GREEN_DURATIONS, topology, load_policy=EchoPolicy)
+    loads = EchoPolicy.loads
+
+    def reload(port):
+        Client = ControllerClient('127.0.0.1', port)
+        try:
+            return Client.reload(), Client.decide([state(2, 0.0)])
+        finally:
+            Client.close()
+
+    response, decisions = serve_while(server, free_port(), reload)
+
+    assert response['reloads'] == 1 and EchoPolicy.loads == loads + 1
+    assert decisions[0][0] == 2
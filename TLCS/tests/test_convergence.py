@@ -0,0 +1,97 @@
+import json
+
+import numpy as np
+
+from convergence import ConvergenceMonitor
+from metrics import MetricsStore
+
+TOTAL_EPISODES = 100
+
+
+def weights(value):
+    return [np.full((2, 2), value)], [np.full(2, value)]
+
+
+class WeightsAgent:
+    """
+    Agent holding weights, recording the weights of the networks it saves
+    """
+    def __init__(self):
+        self.weights = weights(-1.0)
+        self.saved = []
+
+    def get_weights(self):
+        return self.weights
+
+    def set_weights(self, q_weights, actor_weights):
+        self.weights = q_weights, actor_weights
+
+    def save_model(self, path):
+        self.saved.append((path, self.weights))
+
+
+def run(Monitor, rewards, queue=10.0):
+    """
+    Feed the monitor one episode per reward until it stops, returns the episode it stopped after and the epsilons
+    """
+    epsilons = []
+    for episode, reward in enumerate(rewards):
+        epsilon = Monitor.epsilon(episode, TOTAL_EPISODES)
+        epsilons.append(epsilon)
+        if Monitor.update(episode, epsilon, reward, queue, lambda episode=episode: weights(float(episode))):
+            return episode, epsilons
+    return None, epsilons
+
+
+def test_plateau_shortens_the_exploration_then_stops(tmp_path):
+    Monitor = ConvergenceMonitor(str(tmp_path), window=3, threshold=0.01, min_episodes=3)
+    stopped, epsilons = run(Monitor, [-100.0] * 30)
+
+    # no progress from episode 2 to 4: epsilon goes from 0.96 to 0 over the next three episodes, and the plateau after that stops
+    np.testing.assert_allclose(epsilons[5:10], [0.95, 0.64, 0.32, 0, 0])
+    assert epsilons[:5] == [1.0 - episode / TOTAL_EPISODES for episode in range(5)]
+    assert stopped == 10
+
+
+def test_improving_reward_never_stops(tmp_path):
+    Monitor = ConvergenceMonitor(str(tmp_path), window=3, threshold=0.01, min_episodes=3)
+    stopped, epsilons = run(Monitor, [-100.0 + 5 * episode for episode in range(30)])
+
+    assert stopped is None
+    assert epsilons[-1] == 1.0 - 29 / TOTAL_EPISODES
+    assert Monitor.best_episode == 29
+
+
+def test_best_rolling_reward_weights_are_saved(tmp_path):
+    Monitor = ConvergenceMonitor(str(tmp_path), window=2, min_episodes=100)
+    run(Monitor, [-50.0, -10.0, -12.0, -40.0, -40.0])
+    Agent = WeightsAgent()
+    Monitor.save_best_model(Agent)
+
+    # the best rolling mean is the one of episodes 1 and 2
+    assert Monitor.best_episode == 2
+    with np.load(str(tmp_path / 'best_weights.npz')) as best:
+        assert best['q_0'][0, 0] == 2.0 and best['actor_0'][0] == 2.0
+    [(path, saved)] = Agent.saved
+    assert path == str(tmp_path / 'best_model') and saved[0][0][0, 0] == 2.0
+    assert Agent.weights[0][0][0, 0] == -1.0  # the final weights are restored
+    summary = json.loads((tmp_path / 'convergence.json').read_text())
+    assert summary['best_episode'] == 2 and summary['score'] == 'rolling_reward' and summary['stopped_at'] is None
+
+
+def test_best_weights_follow_the_greedy_evaluation(tmp_path):
+    Evaluations = MetricsStore(str(tmp_path / 'evaluation.csv'), columns=['episode', 'reward'])
+    Monitor = ConvergenceMonitor(str(tmp_path), window=2, min_episodes=100, evaluation_file=Evaluations.file_path)
+    for episode in range(4):
+        Monitor.keep_snapshot(episode, weights(float(episode)))
+    # the evaluation of episode 0 is skipped, its snapshot is dropped once a later one completes
+    Evaluations.append(episode=1, reward=-20.0)
+    Evaluations.append(episode=2, reward=-30.0)
+    Monitor.update(0, 1.0, -100.0, 10.0, lambda: weights(-1.0))
+    Evaluations.append(episode=3, reward=-25.0)
+    Agent = WeightsAgent()
+    Monitor.save_best_model(Agent)
+
+    assert Monitor.best_episode == 1 and not Monitor._snapshots
+    assert Agent.saved[0][1][0][0][0, 0] == 1.0
+    assert json.loads((tmp_path / 'convergence.json').read_text())['score'] == 'evaluation_reward'
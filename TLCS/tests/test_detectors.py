@@ -0,0 +1,54 @@
+import bisect
+
+import numpy as np
+
+from conftest import MAX_STEPS, NUM_STATES, RecordingAgent
+from detectors import DetectorObserver, cell_spans, write_detector_file
+from training_simulation import CELL_LIMITS, STATE_LANE_LENGTH, Simulation
+
+
+class BothModesAgent(RecordingAgent):
+    """
+    Agent reading the detector state of every step next to the vehicle state it is given
+    """
+    def __init__(self, Observer):
+        super().__init__()
+        self._Observer = Observer
+        self._subscribed = False
+        self.occupancies = []
+
+    def select_action(self, state, epsilon):
+        if not self._subscribed:
+            self._Observer.subscribe()
+            self._subscribed = True
+        self.occupancies.append((state > 0, self._Observer.get_state() > 0))
+        return super().select_action(state, epsilon)
+
+
+def test_cell_spans_follow_the_state():
+    for lane_length in (100.0, 141.95, 200.0):
+        spans = cell_spans(lane_length)
+        for position in np.linspace(0.5, lane_length - 0.5, 100):
+            cell = bisect.bisect_right(CELL_LIMITS, STATE_LANE_LENGTH - position)
+            assert [span_cell for span_cell, start, end in spans if start < position <= end] == [cell]
+
+
+def test_vehicle_and_detector_modes_give_the_same_cells(tmp_path, fake_scenario, topology):
+    detector_file = write_detector_file(topology, str(tmp_path / 'detectors.add.xml'))
+    sumo_cmd, traci_module, TrafficGen = fake_scenario(additional_file=detector_file)
+    Agent = BothModesAgent(DetectorObserver(topology, traci_module, NUM_STATES))
+    Simulation(Agent, TrafficGen, sumo_cmd, MAX_STEPS, 10, 4, NUM_STATES, 0, traci_module, (4, 7, 10, 14), topology).run(0, 1.0)
+
+    vehicles = np.array([vehicle for vehicle, _ in Agent.occupancies])
+    detectors = np.array([detector for _, detector in Agent.occupancies])
+    assert vehicles.any()
+    # the lanes are shorter than STATE_LANE_LENGTH - CELL_LIMITS[0], the first cell is empty in both modes
+    assert not vehicles[:, ::10].any() and not detectors[:, ::10].any()
+    # a detector also sees the rear of a car whose front is in the cell before
+    front_before = np.zeros_like(vehicles)
+    front_before[:, 1:] = vehicles[:, :-1]
+    front_before[:, ::10] = False
+    assert not (detectors & ~vehicles & ~front_before).any()
+    # and it misses only the cars just entered at the start of the lane, with no length on it yet
+    missed_cells = np.nonzero(vehicles & ~detectors)[1] % 10
+    assert set(missed_cells) <= {len(CELL_LIMITS)}
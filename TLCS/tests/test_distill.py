@@ -0,0 +1,54 @@
+import json
+
+import numpy as np
+import pytest
+
+from distill import StudentPolicy, distill, quantize, save_student
+from utils import import_train_configuration
+
+NUM_STATES = 320
+
+
+class LinearTeacher:
+    def __init__(self, seed=0):
+        self.kernel = np.random.default_rng(seed).normal(0, 0.3, (NUM_STATES, 5)).astype(np.float32)
+
+    def __call__(self, states):
+        output = np.asarray(states, dtype=np.float32) @ self.kernel
+        return np.argmax(output[:, :4], axis=1), np.tanh(output[:, 4:])
+
+
+def test_quantization_error_is_within_half_a_step():
+    kernel = np.random.default_rng(1).normal(0, 1, (64, 8))
+    quantized, scale = quantize(kernel)
+
+    assert quantized.dtype == np.int8 and np.abs(quantized).max() == 127
+    assert np.all(np.abs(quantized * scale - kernel) <= scale / 2 + 1e-6)
+
+
+def test_student_decides_one_state_like_a_batch(tmp_path):
+    rng = np.random.default_rng(2)
+    layers = [(rng.normal(0, 0.2, (NUM_STATES, 16)), rng.normal(0, 0.1, 16)), (rng.normal(0, 0.2, (16, 5)), np.zeros(5))]
+    Student = StudentPolicy(save_student(str(tmp_path / 'student.npz'), layers, 4))
+    states = rng.uniform(0, 2, (20, NUM_STATES))
+    actions, params = Student(states)
+
+    assert Student.hidden_widths == [16]
+    for state, action, param in zip(states, actions, params):
+        single_action, single_param = Student.decide(state)
+        assert single_action == action and np.allclose(single_param, param)
+
+
+def test_distillation_on_the_fake_backend(tmp_path):
+    config = import_train_configuration('training_settings.ini')
+    config.update(backend='fake', max_steps=300, n_cars_generated=100, persistent_session=False, streaming_demand=False,
+                  observation='vehicles', sumo_cores=[], evaluation_seeds=[10000])
+    Teacher = LinearTeacher()
+    report = distill(str(tmp_path), config, Teacher, rollout_episodes=1, fit=lambda states, actions, params, num_actions: [(Teacher.kernel, np.zeros(5))])
+
+    with open(tmp_path / 'distillation.json') as file:
+        assert json.load(file) == report
+    assert report['rollout_states'] > 0 and report['hidden_widths'] == []
+    # the student is the teacher with int8 kernels
+    assert report['fidelity']['action_agreement'] >= 0.9
+    assert report['student']['reward'] == pytest.approx(report['teacher']['reward'], rel=0.2)
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from ensemble import EnsembleAgent
+from pdqnagent import PDQNAgent
+
+MEMBERS = 3
+STATE_DIM = 320
+BATCH_SIZE = 16
+
+
+class FixedBuffer:
+    """
+    Replay buffer returning the same batch at every sample
+    """
+    def __init__(self, batch):
+        self._batch = batch
+
+    def size(self):
+        return BATCH_SIZE
+
+    def sample_arrays(self, batch_size):
+        return self._batch
+
+
+def test_members_start_from_different_weights():
+    Ensemble = EnsembleAgent(MEMBERS, STATE_DIM, 4, 1, batch_size=BATCH_SIZE, seed=7)
+    kernels = [Ensemble.get_weights(k)[0][0] for k in range(MEMBERS)]
+
+    assert not np.allclose(kernels[0], kernels[1]) and not np.allclose(kernels[1], kernels[2])
+
+
+def test_same_seed_gives_the_same_weights():
+    first = EnsembleAgent(MEMBERS, STATE_DIM, 4, 1, batch_size=BATCH_SIZE, seed=7)
+    second = EnsembleAgent(MEMBERS, STATE_DIM, 4, 1, batch_size=BATCH_SIZE, seed=7)
+
+    for a, b in zip(first.q_network.get_weights() + first.actor_network.get_weights(),
+                    second.q_network.get_weights() + second.actor_network.get_weights()):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_training_step_matches_separate_agents():
+    Ensemble = EnsembleAgent(MEMBERS, STATE_DIM, 4, 1, batch_size=BATCH_SIZE, seed=7)
+    rng = np.random.default_rng(0)
+    Agents = []
+    for k in range(MEMBERS):
+        batch = (rng.random((BATCH_SIZE, STATE_DIM)), rng.integers(0, 4, BATCH_SIZE), rng.random(BATCH_SIZE),
+                 rng.random((BATCH_SIZE, STATE_DIM)), np.zeros(BATCH_SIZE), rng.uniform(-1, 1, (BATCH_SIZE, 1)))
+        Agent = PDQNAgent(STATE_DIM, 4, 1, batch_size=BATCH_SIZE)
+        Agent._build()
+        Agent.target_q_network(np.zeros((1, STATE_DIM)))
+        Agent.target_actor_network(np.zeros((1, STATE_DIM)))
+        Agent.set_weights(*Ensemble.get_weights(k))
+        Agent.target_q_network.set_weights([w[k] for w in Ensemble.target_q_network.get_weights()])
+        Agent.target_actor_network.set_weights([w[k] for w in Ensemble.target_actor_network.get_weights()])
+        Agent.replay_buffer = FixedBuffer(batch)
+        Ensemble.replay_buffers[k] = FixedBuffer(batch)
+        Agents.append(Agent)
+    initial = [Ensemble.get_weights(k) for k in range(MEMBERS)]
+
+    for Agent in Agents:
+        Agent.train()
+    Ensemble.train()
+
+    for k, Agent in enumerate(Agents):
+        q_weights, actor_weights = Ensemble.get_weights(k)
+        assert not all(np.array_equal(a, b) for a, b in zip(q_weights, initial[k][0]))
+        for a, b in zip(q_weights + actor_weights, Agent.q_network.get_weights() + Agent.actor_network.get_weights()):
+            np.testing.assert_allclose(a, b, atol=1e-5)
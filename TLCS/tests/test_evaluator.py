@@ -0,0 +1,43 @@
+import pytest
+
+from conftest import RecordingAgent
+from evaluator import build_simulation
+from metrics import read_metrics
+from utils import import_train_configuration
+
+
+@pytest.fixture
+def config():
+    config = import_train_configuration('training_settings.ini')
+    config.update(backend='fake', max_steps=300, n_cars_generated=100, persistent_session=False, streaming_demand=False,
+                  sumo_cores=[], num_layers=1, width_layers=8)
+    return config
+
+
+def test_greedy_episodes_do_not_train(tmp_path, config):
+    Agent = RecordingAgent()
+    Greedy, _ = build_simulation(str(tmp_path), config, Agent, 'evaluation_routes.rou.xml')
+    Greedy.run(10000, 0.0)
+    Greedy.run(10000, 0.0)
+
+    assert Agent.trainings == 0
+    assert (tmp_path / 'evaluation_routes.rou.xml').exists()
+    assert len(Greedy.reward_store) == 2 and Greedy.avg_queue_length_store[0] >= 0
+
+
+def test_background_evaluator_writes_one_row_per_snapshot(tmp_path, config):
+    pytest.importorskip('tensorflow')
+    from evaluator import BackgroundEvaluator
+    from pdqnagent import PDQNAgent
+
+    Agent = PDQNAgent(config['num_states'], config['num_actions'], config['final_action'], num_layers=1, width_layers=8)
+    Agent._build()
+    Evaluator = BackgroundEvaluator(str(tmp_path), config, [10000, 10001])
+    Evaluator.submit(0, Agent)
+    Evaluator.submit(4, Agent)
+    Evaluator.close()
+
+    metrics = read_metrics(Evaluator.file_path)
+    assert metrics['episode'] == [0, 4]
+    # the same weights on the same seeds give the same greedy episodes
+    assert metrics['reward'][0] == metrics['reward'][1] and metrics['queue'][0] >= 0
@@ -0,0 +1,96 @@
+"""
+End to end training and testing episodes on the pure-python backend
+"""
+import numpy as np
+import pytest
+
+from conftest import MAX_STEPS, NUM_STATES, RecordingAgent, SeededModel
+import testing_simulation
+import training_simulation
+
+
+def run_training(fake_scenario, topology, Agent, episodes=(0,), epsilon=1.0):
+    sumo_cmd, traci_module, TrafficGen = fake_scenario()
+    Simulation = training_simulation.Simulation(Agent, TrafficGen, sumo_cmd, MAX_STEPS, 10, 4, NUM_STATES, 2,
+                                                traci_module, (4, 7, 10, 14), topology)
+    for episode in episodes:
+        Simulation.run(episode, epsilon)
+    return Simulation
+
+
+def run_testing(fake_scenario, topology, Model, episode=0, num_states=16, num_actions=4):
+    sumo_cmd, traci_module, TrafficGen = fake_scenario()
+    Simulation = testing_simulation.Simulation(Model, TrafficGen, sumo_cmd, MAX_STEPS, 10, 0, 4, num_states, num_actions,
+                                               traci_module, topology)
+    Simulation.run(episode)
+    return Simulation
+
+
+def test_training_episode_states_and_actions(fake_scenario, topology):
+    Agent = RecordingAgent()
+    Simulation = run_training(fake_scenario, topology, Agent)
+
+    assert Agent.transitions and Agent.trainings == 2
+    for state, action, reward, next_state, done, param in Agent.transitions:
+        assert state.shape == (NUM_STATES,) and next_state.shape == (NUM_STATES,)
+        assert action in range(4)
+        assert -1 <= param[0] <= 1
+        # 1 for an occupied cell, plus the normalized speed of its vehicle
+        assert np.all((state == 0) | ((state >= 1) & (state <= 2)))
+    assert any(state.any() for state, *_ in Agent.transitions)
+    assert len(Simulation.reward_store) == 1
+
+
+def test_training_episode_is_deterministic(fake_scenario, topology):
+    first = run_training(fake_scenario, topology, RecordingAgent(seed=3), episodes=(0, 1))
+    second = run_training(fake_scenario, topology, RecordingAgent(seed=3), episodes=(0, 1))
+
+    assert first.reward_store == second.reward_store
+    assert first.avg_queue_length_store == second.avg_queue_length_store
+    assert first.cumulative_wait_store == second.cumulative_wait_store
+
+
+def test_training_queue_counts_are_non_negative(fake_scenario, topology):
+    Simulation = run_training(fake_scenario, topology, RecordingAgent(), episodes=(0, 1))
+
+    assert all(queue >= 0 for queue in Simulation.avg_queue_length_store)
+    assert all(wait >= 0 for wait in Simulation.cumulative_wait_store)
+    assert all(reward <= 0 for reward in Simulation.reward_store)
+    assert max(Simulation.avg_queue_length_store) > 0
+
+
+def test_training_episode_with_pdqn_agent(fake_scenario, topology):
+    pytest.importorskip('tensorflow')
+    from pdqnagent import PDQNAgent
+
+    Agent = PDQNAgent(NUM_STATES, 4, 1, gamma=0.75, tau=0.001, buffer_size=1000, batch_size=16, num_layers=1,
+                      width_layers=16, learning_rate=0.001, memory_size_min=16)
+    Simulation = run_training(fake_scenario, topology, Agent, episodes=(0, 1), epsilon=0.5)
+
+    assert Agent.replay_buffer.size() > 16
+    states, actions, rewards, next_states, dones, params = Agent.replay_buffer.sample_arrays(16)
+    assert states.shape == (16, NUM_STATES) and next_states.shape == (16, NUM_STATES)
+    assert np.all((actions >= 0) & (actions < 4))
+    assert len(Simulation.reward_store) == 2
+
+
+def test_testing_episode_states_and_queues(fake_scenario, topology):
+    Model = SeededModel()
+    Simulation = run_testing(fake_scenario, topology, Model)
+
+    # the halting counts of the incoming roads, then the one-hot code of the last action
+    for state in Model.states:
+        assert state.shape == (16 + 4,)
+        assert np.all(state >= 0)
+        assert state[16:].sum() in (0, 1)
+    assert len(Simulation.queue_length_episode) == MAX_STEPS
+    assert min(Simulation.queue_length_episode) >= 0
+    assert all(reward <= 0 for reward in Simulation.reward_episode)
+
+
+def test_testing_episode_is_deterministic(fake_scenario, topology):
+    first = run_testing(fake_scenario, topology, SeededModel(seed=5), episode=2)
+    second = run_testing(fake_scenario, topology, SeededModel(seed=5), episode=2)
+
+    assert first.queue_length_episode == second.queue_length_episode
+    assert first.reward_episode == second.reward_episode
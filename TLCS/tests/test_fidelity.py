@@ -0,0 +1,86 @@
+import numpy as np
+
+import fidelity
+from conftest import MAX_STEPS, NUM_STATES, RecordingAgent
+from training_simulation import Simulation
+from utils import MESO_OPTIONS, import_train_configuration, set_sumo
+
+
+class MesoTraci:
+    """
+    The fake backend seen as the mesoscopic model: the vehicles have no lane, only an edge and the index of the lane
+    of their queue. Records the commands of the episodes
+    """
+    def __init__(self, traci_module):
+        self._traci = traci_module
+        self.vehicle = _MesoVehicles(traci_module.vehicle)
+        self.commands = []
+
+    def start(self, cmd, **kwargs):
+        self.commands.append(cmd)
+        return self._traci.start(cmd, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._traci, name)
+
+
+class _MesoVehicles:
+    def __init__(self, vehicle):
+        self._vehicle = vehicle
+
+    def getLaneID(self, vehID):
+        return ''
+
+    def getLaneIndex(self, vehID):
+        lane_id = self._vehicle.getLaneID(vehID)
+        return int(lane_id.rsplit('_', 1)[1]) if lane_id else -1
+
+    def __getattr__(self, name):
+        return getattr(self._vehicle, name)
+
+
+def run_episodes(fake_scenario, topology, traci_module, episodes, meso_episodes=0):
+    sumo_cmd, _, TrafficGen = fake_scenario()
+    meso_cmd, _, _ = fake_scenario(fidelity='meso')
+    Agent = RecordingAgent()
+    Episodes = Simulation(Agent, TrafficGen, sumo_cmd, MAX_STEPS, 10, 4, NUM_STATES, 0, traci_module, (4, 7, 10, 14), topology,
+                          meso_cmd=meso_cmd, meso_episodes=meso_episodes)
+    for episode in range(episodes):
+        Episodes.run(episode, 1.0)
+    return Agent, Episodes
+
+
+def test_meso_options_are_added_to_the_command(fake_scenario):
+    micro_cmd, _, _ = fake_scenario()
+    meso_cmd, _, _ = fake_scenario(fidelity='meso')
+
+    assert meso_cmd == micro_cmd + MESO_OPTIONS
+    assert '--mesosim' not in set_sumo(False, 'sumo_config.sumocfg', MAX_STEPS, 'fake')
+
+
+def test_first_episodes_run_the_meso_command(fake_scenario, topology):
+    traci_module = MesoTraci(fake_scenario()[1])
+    run_episodes(fake_scenario, topology, traci_module, 3, meso_episodes=2)
+
+    assert ['--mesosim' in cmd for cmd in traci_module.commands] == [True, True, False]
+
+
+def test_state_of_meso_vehicles_matches_their_lanes(fake_scenario, topology):
+    micro, _ = run_episodes(fake_scenario, topology, fake_scenario()[1], 1)
+    meso, _ = run_episodes(fake_scenario, topology, MesoTraci(fake_scenario()[1]), 1)
+
+    assert len(micro.transitions) == len(meso.transitions)
+    assert any(state.any() for state, *_ in meso.transitions)
+    for (micro_state, *_), (meso_state, *_) in zip(micro.transitions, meso.transitions):
+        np.testing.assert_array_equal(micro_state, meso_state)
+
+
+def test_benchmark_runs_both_fidelities():
+    config = import_train_configuration('training_settings.ini')
+    config.update(backend='fake', max_steps=300, n_cars_generated=100, persistent_session=False)
+    results = fidelity.benchmark(config, episodes=1)
+
+    assert set(results) == {'micro', 'meso'}
+    # the stand-in has one model of the traffic, the same random episode gives the same stats in both
+    assert results['micro']['reward'] == results['meso']['reward']
+    assert results['micro']['queue'] >= 0
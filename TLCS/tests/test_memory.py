@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from conftest import NUM_STATES, RecordingAgent
+from memory import CompactReplayBuffer
+from test_fake_backend import run_training
+
+TOLERANCE = {'uint8': 1 / 254, 'float16': 1e-3}
+
+
+@pytest.fixture
+def transitions(fake_scenario, topology):
+    Agent = RecordingAgent()
+    run_training(fake_scenario, topology, Agent)
+    return Agent.transitions
+
+
+def stored(Buffer):
+    """
+    Every transition of the buffer, by its reward
+    """
+    states, actions, rewards, next_states, dones, params = Buffer.sample_arrays(Buffer.size())
+    order = np.argsort(rewards)
+    return states[order], actions[order], rewards[order], next_states[order], dones[order], params[order]
+
+
+@pytest.mark.parametrize('storage', ['uint8', 'float16'])
+def test_episode_decodes_within_the_tolerance(transitions, storage):
+    Buffer = CompactReplayBuffer(len(transitions), NUM_STATES, 1, storage)
+    for i, (state, action, reward, next_state, done, param) in enumerate(transitions):
+        Buffer.add((state, action, i, next_state, done, param))
+
+    states, actions, rewards, next_states, dones, params = stored(Buffer)
+    expected_states = np.array([state for state, *_ in transitions])
+    expected_next_states = np.array([transition[3] for transition in transitions])
+    np.testing.assert_allclose(states, expected_states, atol=TOLERANCE[storage])
+    np.testing.assert_allclose(next_states, expected_next_states, atol=TOLERANCE[storage])
+    # empty and occupied cells without speed decode exactly
+    exact = np.isin(expected_states, (0, 1, 2))
+    np.testing.assert_array_equal(states[exact], expected_states[exact])
+    np.testing.assert_array_equal(actions, [transition[1] for transition in transitions])
+    # consecutive transitions share their frame: one per state plus the last next state
+    assert Buffer._frames_written == len(transitions) + 1
+
+
+def test_batches_and_single_additions_wrap_around_alike():
+    rng = np.random.RandomState(0)
+    chain = rng.randint(0, 3, (41, NUM_STATES)).astype(float)
+    unrelated = rng.randint(0, 3, (10, NUM_STATES)).astype(float)
+    batch, single = CompactReplayBuffer(16, NUM_STATES, 1), CompactReplayBuffer(16, NUM_STATES, 1)
+    experiences = [(chain[i], i % 4, float(i), chain[i + 1], False, [0.0]) for i in range(40)]
+    # transitions not following the one before them, in between
+    experiences[10:10] = [(unrelated[i], 0, 100.0 + i, unrelated[i] + 1, True, [0.0]) for i in range(0, 10, 2)]
+
+    for start in range(0, len(experiences), 7):
+        batch.add_batch(*zip(*experiences[start:start + 7]))
+    for experience in experiences:
+        single.add(experience)
+
+    assert batch.size() == single.size() == 16
+    for first, second in zip(stored(batch), stored(single)):
+        np.testing.assert_array_equal(first, second)
+    states, actions, rewards, next_states, dones, params = stored(batch)
+    kept = sorted(experiences[-16:], key=lambda experience: experience[2])
+    np.testing.assert_array_equal(rewards, [reward for _, _, reward, *_ in kept])
+    np.testing.assert_array_equal(states, [state for state, *_ in kept])
+    np.testing.assert_array_equal(next_states, [experience[3] for experience in kept])
+
+
+def test_uint8_storage_is_eight_times_smaller():
+    Buffer = CompactReplayBuffer(1000, NUM_STATES, 1)
+    full_bytes = 1000 * (2 * NUM_STATES + 1 + 1 + 1 + 1) * 8  # float64 states, next states, action, reward, done and param
+
+    assert full_bytes / Buffer.nbytes > 7
@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+
+from conftest import NUM_STATES, RecordingAgent
+from memory import CompactReplayBuffer, ReplayBuffer
+from memprofile import MemoryProfiler, structure_size
+from training_simulation import Simulation
+
+
+def experience(i):
+    return np.full(NUM_STATES, i, dtype=float), 0, -1.0, np.full(NUM_STATES, i + 1, dtype=float), False, np.zeros(1)
+
+
+def test_structure_sizes():
+    Buffer = ReplayBuffer(100)
+    for i in range(10):
+        Buffer.add(experience(i))
+    items, size = structure_size(Buffer)
+    assert items == 10 and size > 10 * 2 * NUM_STATES * 8
+
+    Compact = CompactReplayBuffer(100, NUM_STATES, 1)
+    Compact.add(experience(0))
+    assert structure_size(Compact) == (1, Compact.nbytes)
+    assert structure_size({'car': 1.0})[0] == 1 and structure_size([1.0, 2.0])[0] == 2
+
+
+def test_disabled_profiler_writes_nothing(tmp_path):
+    Profiler = MemoryProfiler(str(tmp_path))
+    Profiler.track('list', lambda: [])
+
+    assert Profiler.save_episode(0) is None
+    assert not (tmp_path / 'memory.jsonl').exists()
+
+
+def test_episodes_flag_the_growing_stores(tmp_path, fake_scenario, topology):
+    sumo_cmd, traci_module, TrafficGen = fake_scenario(max_steps=200, n_cars=50)
+    Episodes = Simulation(RecordingAgent(), TrafficGen, sumo_cmd, 200, 10, 4, NUM_STATES, 0, traci_module, (4, 7, 10, 14), topology)
+    Profiler = MemoryProfiler(str(tmp_path), enabled=True, window=2)
+    Profiler.track('reward_store', lambda: Episodes.reward_store)
+    Profiler.track('waiting_times', lambda: Episodes.waiting_times)
+    try:
+        records = []
+        for episode in range(4):
+            Episodes.run(episode, 1.0)
+            records.append(Profiler.save_episode(episode))
+    finally:
+        Profiler.close()
+
+    lines = [json.loads(line) for line in (tmp_path / 'memory.jsonl').read_text().splitlines()]
+    assert lines == records
+    assert [record['structures']['reward_store']['items'] for record in records] == [1, 2, 3, 4]
+    assert all(record['rss_mb'] > 0 and record['top_allocations'] for record in records)
+    assert 'top_growth' not in records[0] and 'top_growth' in records[1]
+    assert records[1]['growing'] == [] and 'reward_store' in records[2]['growing']
+    # the waiting times are emptied at every episode, they do not grow
+    assert 'waiting_times' not in records[3]['growing']
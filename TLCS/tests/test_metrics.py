@@ -0,0 +1,34 @@
+import pytest
+
+from metrics import MetricsStore, read_metrics
+
+COLUMNS = ['reward', 'delay', 'queue', 'travel_time']
+
+
+def test_metrics_store_keeps_the_completed_episodes(tmp_path):
+    file_path = str(tmp_path / 'metrics.csv')
+    Store = MetricsStore(file_path, COLUMNS)
+    Store.append(reward=-120, delay=340, queue=1.5, travel_time=12.25)
+    Store.append(reward=-80, delay=300, queue=1.25, travel_time=11.5)
+    # a crash in the middle of a row, then the session is resumed on the same file
+    with open(file_path, 'a') as file:
+        file.write('-70,29')
+    MetricsStore(file_path, COLUMNS)
+
+    assert read_metrics(file_path) == {'reward': [-120, -80], 'delay': [340, 300], 'queue': [1.5, 1.25], 'travel_time': [12.25, 11.5]}
+
+
+def test_background_plotter_draws_the_store(tmp_path):
+    pytest.importorskip('matplotlib')
+    from visualization import BackgroundPlotter
+
+    Store = MetricsStore(str(tmp_path / 'metrics.csv'), COLUMNS)
+    Plotter = BackgroundPlotter(str(tmp_path), 20, Store.file_path)
+    for episode in range(3):
+        Store.append(reward=-episode, delay=episode, queue=episode / 2, travel_time=episode + 1)
+        Plotter.request()
+    Plotter.close()
+
+    with open(tmp_path / 'plot_reward_data.txt') as file:
+        assert file.read().split() == ['0', '-1', '-2']
+    assert (tmp_path / 'plot_average travel time.png').exists()
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from memory import BatchPrefetcher, ReplayBuffer
+
+
+def filled_buffer(n, first=0):
+    replay_buffer = ReplayBuffer(1000)
+    for i in range(first, first + n):
+        replay_buffer.add((np.full(4, i, dtype=float), i % 4, -1.0, np.full(4, i + 1, dtype=float), False, np.zeros(1)))
+    return replay_buffer
+
+
+class FailingBuffer:
+    added = 0
+
+    def sample_arrays(self, batch_size):
+        raise ValueError("Sample larger than population")
+
+
+def test_prefetched_batches_are_arrays_of_the_buffer():
+    Prefetcher = BatchPrefetcher(filled_buffer(50), 8, 2)
+    try:
+        states, actions, rewards, next_states, dones, params = Prefetcher.get()
+    finally:
+        Prefetcher.stop()
+
+    assert states.shape == (8, 4) and next_states.shape == (8, 4) and params.shape == (8, 1)
+    assert np.array_equal(next_states, states + 1)
+    assert np.array_equal(actions, states[:, 0].astype(int) % 4)
+
+
+def test_batches_sampled_before_new_experiences_are_dropped():
+    replay_buffer = filled_buffer(20)
+    Prefetcher = BatchPrefetcher(replay_buffer, 20, 2)
+    try:
+        Prefetcher.get()  # the queue is full of batches of the first 20 experiences
+        for i in range(20, 1000):
+            replay_buffer.add((np.full(4, i, dtype=float), 0, -1.0, np.full(4, i + 1, dtype=float), False, np.zeros(1)))
+        states = Prefetcher.get()[0]
+    finally:
+        Prefetcher.stop()
+
+    assert states[:, 0].max() >= 20
+
+
+def test_sampling_error_is_raised_in_the_training_thread():
+    Prefetcher = BatchPrefetcher(FailingBuffer(), 8, 2)
+    try:
+        with pytest.raises(ValueError):
+            Prefetcher.get()
+    finally:
+        Prefetcher.stop()
@@ -0,0 +1,38 @@
+import json
+
+from conftest import MAX_STEPS, NUM_STATES, RecordingAgent
+from profiler import Profiler
+from training_simulation import Simulation
+
+
+def test_profiled_episode(tmp_path, fake_scenario, topology):
+    sumo_cmd, traci_module, TrafficGen = fake_scenario()
+    Profiling = Profiler(str(tmp_path), enabled=True, trace=True)
+    Agent = Profiling.instrument(RecordingAgent(), ['select_action', 'train'])
+    Instrumented = Profiling.instrument(
+        Simulation(Agent, TrafficGen, sumo_cmd, MAX_STEPS, 10, 4, NUM_STATES, 2, Profiling.instrument_traci(traci_module), (4, 7, 10, 14), topology),
+        ['run', '_get_state'])
+    Instrumented.run(0, 1.0)
+    record = Profiling.save_episode(0)
+    Profiling.close()
+
+    assert record['stages']['run']['calls'] == 1
+    assert record['stages']['train']['calls'] == 2
+    assert record['stages']['_get_state']['calls'] == record['stages']['select_action']['calls'] > 0
+    assert record['traci_calls']['simulationStep'] == MAX_STEPS
+    with open(tmp_path / 'profile.jsonl') as file:
+        assert [json.loads(line) for line in file] == [record]
+    with open(tmp_path / 'trace.json') as file:
+        assert len(json.load(file)) == sum(stage['calls'] for stage in record['stages'].values())
+
+
+def test_disabled_profiler_changes_nothing(tmp_path, fake_scenario):
+    _, traci_module, _ = fake_scenario()
+    Profiling = Profiler(str(tmp_path))
+    Agent = RecordingAgent()
+    select_action = Agent.select_action
+
+    assert Profiling.instrument(Agent, ['select_action']) is Agent and Agent.select_action == select_action
+    assert Profiling.instrument_traci(traci_module) is traci_module
+    assert Profiling.save_episode(0) is None
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,41 @@
+import pytest
+
+from conftest import MAX_STEPS, NUM_STATES, RecordingAgent
+from recording import ReplayMismatch, TraciRecorder, TraciReplay, replay_episode
+from training_simulation import Simulation
+
+SETTINGS = {'net_file_name': 'environment.net.xml', 'observation': 'vehicles', 'num_states': NUM_STATES, 'max_steps': MAX_STEPS,
+            'green_duration': 10, 'yellow_duration': 4, 'green_durations': [4, 7, 10, 14]}
+
+
+@pytest.fixture
+def recorded(tmp_path, fake_scenario, topology):
+    """
+    Record one fake episode, returns its log and the simulation that ran it
+    """
+    sumo_cmd, traci_module, TrafficGen = fake_scenario()
+    Recorder = TraciRecorder(traci_module, str(tmp_path / 'recordings'), SETTINGS)
+    Recorded = Simulation(Recorder.wrap_agent(RecordingAgent(seed=4)), TrafficGen, sumo_cmd, MAX_STEPS, 10, 4, NUM_STATES, 0,
+                          Recorder, SETTINGS['green_durations'], topology)
+    Recorded.run(0, 1.0)
+    Recorder.save_stats(0, reward=Recorded.reward_store[-1])
+    return str(tmp_path / 'recordings' / 'episode_1.traci'), Recorded
+
+
+@pytest.mark.parametrize('strict', [True, False])
+def test_replay_gives_the_recorded_episode(recorded, strict):
+    file_path, Recorded = recorded
+    Replayed, _, n_calls = replay_episode(file_path, strict)
+
+    assert n_calls > MAX_STEPS
+    assert Replayed.reward_store == Recorded.reward_store
+    assert Replayed.cumulative_wait_store == Recorded.cumulative_wait_store
+    assert Replayed.avg_queue_length_store == Recorded.avg_queue_length_store
+    assert Replayed.avg_travel_time_store == Recorded.avg_travel_time_store
+
+
+def test_replay_rejects_other_calls(recorded):
+    Replay = TraciReplay(recorded[0])
+    Replay.start([])
+    with pytest.raises(ReplayMismatch):
+        Replay.vehicle.getSpeed('v_0')
@@ -0,0 +1,144 @@
+import multiprocessing
+
+import numpy as np
+
+from rollout import RolloutLearner, RolloutWorker, pack_arrays
+from utils import import_train_configuration
+
+EPISODES = 3
+STATE_DIM = 8
+
+
+class NumpyAgent:
+    """
+    Agent of a single weight matrix, recording the batches of transitions the learner adds
+    """
+    param_dim = 1
+
+    def __init__(self, config=None):
+        self._rng = np.random.RandomState(0)
+        self.q_weights = [np.zeros((4, 4), dtype=np.float32)]
+        self.batches = []
+
+    def get_weights(self):
+        return self.q_weights, [np.ones(3, dtype=np.float32)]
+
+    def set_weights(self, q_weights, actor_weights):
+        self.q_weights = q_weights
+
+    def select_action(self, state, epsilon):
+        return self._rng.randint(4), self._rng.uniform(-1, 1, 1)
+
+    def add_experiences(self, states, actions, rewards, next_states, dones, params):
+        self.batches.append((states, actions, rewards, next_states, dones, params))
+
+    def train(self):
+        self.q_weights = [self.q_weights[0] + 1]
+
+
+def make_config(**overrides):
+    config = import_train_configuration('training_settings.ini')
+    config.update(total_episodes=EPISODES, training_epochs=1, max_steps=300, n_cars_generated=100, **overrides)
+    return config
+
+
+def make_learner(**overrides):
+    config = make_config(**overrides)
+    return RolloutLearner(NumpyAgent(), config, '127.0.0.1', 0, max_staleness=1, heartbeat_timeout=60)
+
+
+def chunk(first, n):
+    states = np.arange(first, first + n + 1, dtype=np.float32)[:, None].repeat(STATE_DIM, axis=1)
+    return pack_arrays(states=states, actions=np.zeros(n, dtype=np.int16), rewards=np.zeros(n), dones=np.zeros(n, dtype=np.bool_),
+                       params=np.zeros((n, 1), dtype=np.float32))
+
+
+def register(Learner):
+    connection = {'worker_id': None}
+    Learner.handle({'op': 'register', 'name': 'remote', 'host': 'another-host'}, b'', connection)
+    return connection['worker_id']
+
+
+def request(Learner, worker_id, op, payload=b'', **header):
+    return Learner.handle(dict(header, op=op, worker_id=worker_id), payload, {'worker_id': worker_id})[0]
+
+
+STATS = {'reward': -1.0, 'delay': 1.0, 'queue': 1.0, 'travel_time': 1.0}
+
+
+def test_failed_episode_is_handed_out_again_without_its_chunks():
+    Learner = make_learner()
+    try:
+        first, second = register(Learner), register(Learner)
+        task = request(Learner, first, 'task')
+        request(Learner, first, 'transitions', chunk(0, 5), episode=task['episode'], version=task['version'])
+        request(Learner, first, 'failed', episode=task['episode'])
+
+        retried = request(Learner, second, 'task')
+        assert retried['episode'] == task['episode']
+        request(Learner, second, 'transitions', chunk(100, 3), episode=retried['episode'], version=retried['version'])
+        request(Learner, second, 'done', episode=retried['episode'], version=retried['version'], stats=STATS)
+        Learner.run(0, 1.0)
+
+        [(states, actions, rewards, next_states, dones, params)] = Learner._Agent.batches
+        assert len(actions) == 3 and states[0, 0] == 100
+        np.testing.assert_array_equal(states[1:], next_states[:-1])
+        assert Learner.reward_store == [-1.0]
+    finally:
+        Learner.close(timeout=0)
+
+
+def test_dropped_worker_and_stale_episode_are_retried():
+    Learner = make_learner()
+    try:
+        first, second = register(Learner), register(Learner)
+        dropped = request(Learner, first, 'task')
+        Learner._drop(first, "test")
+        # the late chunks and requests of the dropped worker are ignored
+        request(Learner, first, 'transitions', chunk(0, 5), episode=dropped['episode'], version=dropped['version'])
+        assert request(Learner, first, 'task') == {'error': 'unknown worker'}
+
+        stale = request(Learner, second, 'task')
+        assert stale['episode'] == dropped['episode']
+        Learner._version = 2  # the weights moved on by more than max_staleness while it ran
+        request(Learner, second, 'done', episode=stale['episode'], version=stale['version'], stats=STATS)
+        fresh = request(Learner, second, 'task')
+        request(Learner, second, 'done', episode=fresh['episode'], version=2, stats=STATS)
+        Learner.run(0, 1.0)
+
+        assert Learner._discarded_episodes == 1 and Learner._worker_failures == 1
+        assert list(Learner._retry) == [dropped['episode']]
+        assert not Learner._pending and not Learner._Agent.batches
+    finally:
+        Learner.close(timeout=0)
+
+
+def serve(port, name):
+    RolloutWorker('127.0.0.1', port, name=name, backend='fake', make_agent=NumpyAgent).serve()
+
+
+def test_fake_workers_stream_every_episode():
+    Learner = make_learner()
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=serve, args=(Learner._server.server_address[1], 'worker %i' % i)) for i in range(2)]
+    for worker in workers:
+        worker.start()
+    try:
+        for episode in range(EPISODES):
+            Learner.run(episode, 1.0)
+    finally:
+        Learner.close()
+        for worker in workers:
+            worker.join(10)
+            if worker.is_alive():
+                worker.kill()
+
+    assert len(Learner.reward_store) == EPISODES
+    assert all(queue >= 0 for queue in Learner.avg_queue_length_store)
+    batches = Learner._Agent.batches
+    assert batches and all(states.shape[1] == 320 for states, *_ in batches)
+    for states, actions, rewards, next_states, dones, params in batches:
+        assert len(states) == len(actions) == len(next_states) == len(params)
+        np.testing.assert_array_equal(states[1:], next_states[:-1])
+        assert np.all((actions >= 0) & (actions < 4))
+    assert all(worker.exitcode == 0 for worker in workers)
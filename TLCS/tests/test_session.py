@@ -0,0 +1,91 @@
+from conftest import MAX_STEPS, NUM_STATES, RecordingAgent
+from session import PersistentSession, load_arguments
+from training_simulation import Simulation
+
+
+class CrashingTraci:
+    """
+    traci double whose SUMO crashes at the first reset
+    """
+    class FatalTraCIError(Exception):
+        pass
+
+    def __init__(self):
+        self.calls = []
+
+    def start(self, cmd, **kwargs):
+        self.calls.append('start')
+
+    def load(self, args):
+        self.calls.append('load')
+        if self.calls.count('load') == 1:
+            raise self.FatalTraCIError("connection closed by SUMO")
+
+    def close(self, wait=True):
+        self.calls.append('close')
+
+
+def run_episodes(fake_scenario, topology, traci_wrapper, episodes=3, pipelined=False):
+    sumo_cmd, traci_module, TrafficGen = fake_scenario()
+    traci_module = traci_wrapper(traci_module)
+    Episodes = Simulation(RecordingAgent(), TrafficGen, sumo_cmd, MAX_STEPS, 10, 4, NUM_STATES, 0, traci_module, (4, 7, 10, 14), topology)
+    for episode in range(episodes):
+        next_episode = episode + 1 if pipelined and episode + 1 < episodes else None
+        Episodes.run(episode, 1.0, next_episode)
+    return Episodes, traci_module
+
+
+def test_persistent_session_gives_the_same_episodes(fake_scenario, topology):
+    fresh, _ = run_episodes(fake_scenario, topology, lambda traci_module: traci_module)
+    persistent, session = run_episodes(fake_scenario, topology, PersistentSession)
+    session.shutdown()
+
+    assert persistent.reward_store == fresh.reward_store
+    assert persistent.avg_queue_length_store == fresh.avg_queue_length_store
+    assert sorted(session.startup_times) == [0, 1, 2] and session.restarts == 0
+
+
+def test_pipelined_setup_gives_the_same_episodes(fake_scenario, topology):
+    sequential, _ = run_episodes(fake_scenario, topology, lambda traci_module: traci_module)
+    pipelined, _ = run_episodes(fake_scenario, topology, lambda traci_module: traci_module, pipelined=True)
+    persistent, session = run_episodes(fake_scenario, topology, PersistentSession, pipelined=True)
+    session.shutdown()
+
+    assert pipelined.reward_store == sequential.reward_store == persistent.reward_store
+    assert pipelined.avg_queue_length_store == sequential.avg_queue_length_store
+
+
+def test_failed_background_setup_is_done_again(fake_scenario, topology):
+    sumo_cmd, traci_module, TrafficGen = fake_scenario()
+    generate = TrafficGen.generate_routefile_normal
+    failures = []
+
+    def generate_once_failing(seed):
+        if seed == 1 and not failures:
+            failures.append(seed)
+            raise OSError("disk full")
+        generate(seed)
+    TrafficGen.generate_routefile_normal = generate_once_failing
+    Episodes = Simulation(RecordingAgent(), TrafficGen, sumo_cmd, MAX_STEPS, 10, 4, NUM_STATES, 0, traci_module, (4, 7, 10, 14), topology)
+    Episodes.run(0, 1.0, 1)
+    Episodes.run(1, 1.0)
+    sequential, _ = run_episodes(fake_scenario, topology, lambda traci_module: traci_module, episodes=2)
+
+    assert failures == [1]
+    assert Episodes.reward_store == sequential.reward_store
+
+
+def test_crashed_sumo_is_launched_again():
+    traci_module = CrashingTraci()
+    session = PersistentSession(traci_module)
+    for episode in range(3):
+        session.start(['sumo', '-c', 'intersection/sumo_config.sumocfg'], episode=episode)
+        session.close()
+    session.shutdown()
+
+    assert traci_module.calls == ['start', 'load', 'close', 'start', 'load', 'close']
+    assert session.restarts == 1 and sorted(session.startup_times) == [0, 1, 2]
+
+
+def test_load_arguments_drop_the_binary_and_taskset():
+    assert load_arguments(['taskset', '-c', '3', 'sumo', '-c', 'a.sumocfg', '--no-step-log', 'true']) == ['-c', 'a.sumocfg', '--no-step-log', 'true']
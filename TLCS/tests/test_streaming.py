@@ -0,0 +1,42 @@
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+
+from generator import TrafficGenerator
+from metrics import StreamingSeries
+
+
+def departures(route_file):
+    return [float(vehicle.get('depart')) for vehicle in ET.parse(route_file).getroot().iter('vehicle')]
+
+
+def test_streaming_demand_repeats_every_period(tmp_path, topology):
+    route_file = str(tmp_path / 'routes.rou.xml')
+    TrafficGen = TrafficGenerator(3 * 2000, 150, route_file, topology, streaming=True, period_steps=2000)
+    TrafficGen.generate_routefile_streaming(seed=1, chunk_steps=300)
+    steps = departures(route_file)
+
+    assert steps == sorted(steps) and 0 <= steps[0] and steps[-1] < 3 * 2000
+    per_period = np.bincount(np.array(steps, dtype=int) // 2000)
+    assert list(per_period) == [150, 150, 150]
+    # normally distributed around the middle of every period
+    assert abs(np.mean(np.array(steps) % 2000) - 1000) < 50
+
+    TrafficGen.generate_routefile_streaming(seed=1, chunk_steps=300)
+    assert departures(route_file) == steps
+
+
+def test_streaming_series_in_constant_memory():
+    values = np.random.default_rng(0).integers(0, 50, 10001)
+    series = StreamingSeries(capacity=100)
+    for value in values:
+        series.append(int(value))
+
+    assert series.count == len(values) and series.sum == values.sum()
+    assert series.mean == pytest.approx(values.mean()) and series.std == pytest.approx(values.std())
+    assert (series.min, series.max) == (values.min(), values.max())
+    points = series.points
+    assert len(points) <= 101
+    full = len(values) // series.bucket * series.bucket
+    assert points[:-1] == pytest.approx(values[:full].reshape(-1, series.bucket).mean(axis=1))
@@ -0,0 +1,66 @@
+import bisect
+
+import numpy as np
+
+from surrogate_simulation import JAM_SPACING, SurrogateSimulation
+from training_simulation import CELL_LIMITS, STATE_LANE_LENGTH
+
+NET_FILE = 'intersection/environment.net.xml'
+
+
+class RandomAgent:
+    def __init__(self, seed=0):
+        self._rng = np.random.RandomState(seed)
+        self.states = []
+
+    def select_actions(self, states, epsilon):
+        return self._rng.randint(4, size=len(states)), self._rng.uniform(-1, 1, (len(states), 1))
+
+    def add_experience(self, state, action, reward, next_state, done, param):
+        self.states.append(state)
+
+    def train(self):
+        pass
+
+
+def make_surrogate(Agent, n_envs=2, max_steps=600, n_cars=300):
+    return SurrogateSimulation(Agent, NET_FILE, n_envs, max_steps, n_cars, 4, 320, 0)
+
+
+def test_cells_match_the_state_of_the_simulation(topology):
+    Surrogate = make_surrogate(RandomAgent())
+    bounds = np.cumsum(Surrogate._capacity * JAM_SPACING, axis=1)
+
+    for row, lane_id in enumerate(topology.incoming_lanes):
+        lane_length = topology.lane_length(lane_id)
+        assert np.isclose(bounds[row, -1], lane_length)
+        # a car at lane position p is in the cell of STATE_LANE_LENGTH - p in Simulation._get_state
+        for position in np.linspace(0, lane_length, 200, endpoint=False):
+            cell = bisect.bisect_right(CELL_LIMITS, STATE_LANE_LENGTH - position)
+            distance = lane_length - position
+            assert (bounds[row, cell - 1] if cell else 0) <= distance + 1e-9
+            assert distance <= bounds[row, cell] + 1e-9
+
+
+def test_phases_come_from_the_topology(topology):
+    Surrogate = make_surrogate(RandomAgent())
+    Surrogate._reset(0)
+    running = np.ones(2, dtype=bool)
+    Surrogate._simulate(np.array([0, 1]), np.array([2, 3]), np.array([4, 4]), np.array([1, 1]), running)
+
+    assert list(Surrogate._phase) == [topology.green_phase(2), topology.green_phase(3)]
+
+
+def test_episode_states_and_determinism():
+    first, second = RandomAgent(), RandomAgent()
+    first_run, second_run = make_surrogate(first), make_surrogate(second)
+    first_run.run(0, 1.0)
+    second_run.run(0, 1.0)
+
+    assert first_run.reward_store == second_run.reward_store
+    assert first_run.avg_queue_length_store[0] >= 0
+    states = np.array(first.states)
+    assert states.shape[1] == 320 and states.any()
+    assert np.all((states == 0) | ((states >= 1) & (states <= 2)))
+    # the lanes are shorter than STATE_LANE_LENGTH - CELL_LIMITS[0], so their first cell is never occupied
+    assert not states[:, ::10].any()
@@ -0,0 +1,46 @@
+import os
+
+from metrics import MetricsStore
+from sweep import collect_results, expand_runs, import_sweep_configuration, write_run_config
+from utils import import_train_configuration
+
+
+def test_sweep_settings_expand_into_runs():
+    config = import_sweep_configuration('sweep_settings.ini')
+    parameters = config['parameters']
+
+    assert parameters['simulation.green_durations'] == ['4, 7, 10, 14', '5, 10, 15, 20']
+    grid = expand_runs(parameters, 'grid', config['n_runs'], config['seed'])
+    assert len(grid) == 3 * 2 * 2 * 2 and len({tuple(run.items()) for run in grid}) == len(grid)
+    sample = expand_runs(parameters, 'random', 5, 1)
+    assert sample == expand_runs(parameters, 'random', 5, 1) and len(sample) == 5
+    assert all(run in grid for run in sample)
+
+
+def test_run_config_replaces_the_swept_keys(tmp_path):
+    config_file = str(tmp_path / 'run_1.ini')
+    settings = {'agent.gamma': '0.9', 'model.batch_size': '32', 'simulation.green_durations': '5, 10, 15, 20'}
+    write_run_config('training_settings.ini', settings, str(tmp_path / 'run_1'), config_file, 3)
+    config = import_train_configuration(config_file)
+
+    assert config['gamma'] == 0.9 and config['batch_size'] == 32
+    assert config['green_durations'] == [5, 10, 15, 20]
+    assert config['models_path_name'] == str(tmp_path / 'run_1')
+    assert config['intra_op_threads'] == 3 and not config['background_plots']
+    assert config['memory_size_max'] == import_train_configuration('training_settings.ini')['memory_size_max']
+
+
+def test_results_are_sorted_by_final_reward(tmp_path):
+    runs = []
+    for run_name, rewards in (('run_1', [-50, -40]), ('run_2', [-30, -20]), ('run_3', None)):
+        if rewards is not None:
+            os.makedirs(tmp_path / run_name / 'model_1')
+            Store = MetricsStore(str(tmp_path / run_name / 'model_1' / 'metrics.csv'), ['episode', 'reward', 'delay', 'queue', 'travel_time'])
+            for episode, reward in enumerate(rewards):
+                Store.append(episode=episode, reward=reward, delay=1, queue=0.5, travel_time=10)
+        runs.append((run_name, {'agent.gamma': '0.9'}, 0 if rewards is not None else 1))
+    table = collect_results(runs, str(tmp_path))
+
+    assert [row['run'] for row in table] == ['run_2', 'run_1', 'run_3']
+    assert table[0]['final_reward'] == -20 and table[0]['best_reward'] == -20 and table[0]['episodes'] == 2
+    assert 'final_reward' not in table[2] and table[2]['exit_code'] == 1
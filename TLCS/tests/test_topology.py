@@ -0,0 +1,48 @@
+import xml.etree.ElementTree as ET
+
+from generator import TrafficGenerator
+import training_simulation
+
+# the routes of the original demand, hard-coded in the generator before the topology index
+ORIGINAL_ROUTES = [
+    '-h11 -h12 -h13', '-v11 -v12 -v13', '-h21 -h22 -h23', '-v21 -v22 -v23', '-h11 v11', '-h21 v12 v11', '-h11 -v12 -v13',
+    '-h21 -v13', 'h13 h12 h11', 'v13 v12 v11', 'h23 h22 h21', 'v23 v22 v21', '-v11 -h12 -h13', 'v13 -h22 -h23', 'v13 h21',
+    'v23 -h23',
+]
+
+
+def route_file_routes(route_file):
+    return [route.get('edges') for route in ET.parse(route_file).getroot().iter('route')]
+
+
+def test_index_of_the_grid(topology):
+    assert len(topology.tl_ids) == 4
+    assert len(topology.incoming_roads) == 16 and topology.num_lanes == 32
+    assert [topology.lane_row(lane_id) for lane_id in topology.incoming_lanes] == list(range(32))
+    assert topology.lane_row(':1_0_0') == -1
+    assert topology.num_actions == 4
+    assert [topology.green_phase(action) for action in range(4)] == [
+        training_simulation.PHASE_NS_GREEN, training_simulation.PHASE_NSL_GREEN, training_simulation.PHASE_EW_GREEN, training_simulation.PHASE_EWL_GREEN]
+    assert [topology.yellow_phase(action) for action in range(4)] == [
+        training_simulation.PHASE_NS_YELLOW, training_simulation.PHASE_NSL_YELLOW, training_simulation.PHASE_EW_YELLOW, training_simulation.PHASE_EWL_YELLOW]
+    assert all(len(lanes) > 0 for lanes in topology.green_lanes)
+
+
+def test_generated_demand_keeps_the_original_routes(tmp_path, topology):
+    route_file = str(tmp_path / 'routes.rou.xml')
+    TrafficGenerator(600, 50, route_file, topology).generate_routefile_normal(seed=0)
+
+    assert route_file_routes(route_file) == ORIGINAL_ROUTES
+
+
+def test_turning_routes_follow_the_network(tmp_path, topology):
+    route_file = str(tmp_path / 'routes.rou.xml')
+    TrafficGenerator(600, 50, route_file, topology, turning_routes=True).generate_routefile_normal(seed=0)
+    routes = route_file_routes(route_file)
+
+    assert routes == [' '.join(route) for route in topology.routes]
+    assert len(routes) == 3 * len(topology.entry_roads)
+    assert set(ORIGINAL_ROUTES) <= set(routes)
+    for route in topology.routes:
+        assert route[0] in topology.entry_roads
+        assert all(topology.is_incoming(edge) for edge in route[:-1])
@@ -0,0 +1,70 @@
+import multiprocessing
+import queue
+
+import numpy as np
+import pytest
+
+from memory import ReplayBuffer
+from transport import TransitionRing
+
+STATE_DIM = 8
+
+
+def transition(i):
+    return np.full(STATE_DIM, i, dtype=float), i % 4, -float(i), np.full(STATE_DIM, i + 1, dtype=float), i % 5 == 0, np.array([i / 10])
+
+
+def produce(spec, n):
+    ring = TransitionRing.attach(spec)
+    try:
+        for i in range(n):
+            ring.put(*transition(i), timeout=10)
+    finally:
+        ring.close()
+
+
+@pytest.fixture
+def ring():
+    ring = TransitionRing(4, STATE_DIM, 1)
+    yield ring
+    ring.close()
+
+
+def test_transitions_come_out_in_order_across_the_wrap_around(ring):
+    received = []
+    collect = lambda *fields: received.extend(zip(*(np.array(field) for field in fields)))
+    for i in range(3):
+        ring.put(*transition(i))
+    assert ring.consume(collect) == 3
+    for i in range(3, 7):
+        ring.put(*transition(i))  # slots 3, 0, 1, 2
+    assert ring.pending() == 4 and ring.consume(collect) == 4
+
+    for i, (state, action, reward, next_state, done, param) in enumerate(received):
+        expected = transition(i)
+        assert np.array_equal(state, expected[0]) and np.array_equal(next_state, expected[3])
+        assert (action, reward, done, param[0]) == (expected[1], expected[2], expected[4], expected[5][0])
+
+
+def test_full_ring_holds_the_producer_back(ring):
+    for i in range(4):
+        ring.put(*transition(i))
+    with pytest.raises(queue.Full):
+        ring.put(*transition(4), timeout=0.01)
+    assert ring.consume(lambda *fields: None, max_items=1) == 1
+    ring.put(*transition(4), timeout=0.01)
+    assert ring.pending() == 4
+
+
+def test_worker_process_fills_the_replay_buffer(ring):
+    n = 50
+    producer = multiprocessing.Process(target=produce, args=(ring.spec(), n))
+    producer.start()
+    replay_buffer = ReplayBuffer(100)
+    while replay_buffer.size() < n and producer.is_alive() or ring.pending():
+        ring.consume(replay_buffer.add_batch)
+    producer.join(10)
+
+    assert producer.exitcode == 0
+    assert replay_buffer.size() == n
+    assert [int(experience[0][0]) for experience in replay_buffer.buffer] == list(range(n))
@@ -0,0 +1,199 @@
+import math
+import os
+import sys
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+
+
+class Topology:
+    """
+    Index of the network built once from the .net.xml: the traffic lights, their incoming roads and lanes,
+    the row of every incoming lane in the state, the phase tables and the routes of the generated traffic
+    """
+    def __init__(self, net_file):
+        self._net_file = net_file
+        net = ET.parse(net_file).getroot()
+
+        junctions = {junction.get('id'): junction for junction in net.iter('junction') if junction.get('type') != 'internal'}
+        edges = {edge.get('id'): edge for edge in net.iter('edge') if edge.get('function') != 'internal'}
+        self._edge_junction = {edge_id: edge.get('to') for edge_id, edge in edges.items()}
+        self._edge_from = {edge_id: edge.get('from') for edge_id, edge in edges.items()}
+
+        # traffic lights column by column, from the top left one (1, 5, 2, 6 in the 2x2 grid)
+        def position(junction_id):
+            return float(junctions[junction_id].get('x')), float(junctions[junction_id].get('y'))
+        self._tl_ids = sorted(
+            (junction_id for junction_id, junction in junctions.items() if junction.get('type') == 'traffic_light'),
+            key=lambda junction_id: (position(junction_id)[0], -position(junction_id)[1]))
+        tl_set = set(self._tl_ids)
+
+        # incoming roads of every traffic light, clockwise from the one arriving from the west
+        def approach(edge_id):
+            x, y = position(self._edge_junction[edge_id])
+            from_x, from_y = position(self._edge_from[edge_id])
+            return (math.pi - math.atan2(from_y - y, from_x - x)) % (2 * math.pi)
+        self._incoming_roads = []
+        for tl_id in self._tl_ids:
+            roads = [edge_id for edge_id in edges if self._edge_junction[edge_id] == tl_id]
+            self._incoming_roads += sorted(roads, key=approach)
+        self._incoming_road_set = frozenset(self._incoming_roads)
+
+        # one state row per incoming lane, in the order of the roads
+        self._incoming_lanes = []
+        self._lane_length = {}
+        for road in self._incoming_roads:
+            lanes = sorted(edges[road].iter('lane'), key=lambda lane: int(lane.get('index')))
+            self._incoming_lanes += [lane.get('id') for lane in lanes]
+            self._lane_length.update((lane.get('id'), float(lane.get('length'))) for lane in lanes)
+        self._lane_row = {lane_id: row for row, lane_id in enumerate(self._incoming_lanes)}
+
+        # the traffic lights are driven together, so the program of the first one gives the phase tables:
+        # action k activates its k-th green phase, followed by the yellow phase after it
+        programs = {tl_logic.get('id'): [phase.get('state') for phase in tl_logic.iter('phase')] for tl_logic in net.iter('tlLogic')}
+        phases = programs[self._tl_ids[0]] if self._tl_ids else []
+        self._green_phases = [p for p, state in enumerate(phases) if 'y' not in state and ('G' in state or 'g' in state)]
+        self._yellow_phases = [(p + 1) % len(phases) for p in self._green_phases]
+
+        # incoming lanes that get the green in the phase of every action, and the turns out of every road
+        self._green_lanes = [[] for _ in self._green_phases]
+        self._turns = {}
+        for connection in net.iter('connection'):
+            from_edge = connection.get('from')
+            if from_edge not in edges:
+                continue  # connections inside the junctions
+            self._turns.setdefault(from_edge, {}).setdefault(connection.get('dir'), connection.get('to'))
+            lane_id = from_edge + '_' + connection.get('fromLane')
+            tl_id = connection.get('tl')
+            if lane_id in self._lane_row and tl_id is not None:
+                for action, p in enumerate(self._green_phases):
+                    if programs[tl_id][p][int(connection.get('linkIndex'))] in ('G', 'g') and lane_id not in self._green_lanes[action]:
+                        self._green_lanes[action].append(lane_id)
+
+        # traffic enters the network on the roads coming from its borders: every entering road gets a straight route
+        # and a route turning right and left at the first traffic light, then going straight until the border
+        self._entry_roads = [road for road in self._incoming_roads if self._edge_from[road] not in tl_set]
+        self._tl_set = tl_set
+        self._routes = []
+        for road in self._entry_roads:
+            for first_turn in ('s', 'r', 'l'):
+                route = self.route(road, first_turn)
+                if route is not None and route not in self._routes:
+                    self._routes.append(route)
+
+
+    def route(self, road, first_turn):
+        """
+        Edges of the route entering on the road, taking the turn ('s', 'r' or 'l') at the first traffic light and
+        going straight until the border, or None if the network has no such route
+        """
+        if road not in self._edge_junction:
+            return None
+        route = [road]
+        turn = first_turn
+        while self._edge_junction[route[-1]] in self._tl_set:
+            next_edge = self._turns.get(route[-1], {}).get(turn)
+            if next_edge is None:
+                return None
+            route.append(next_edge)
+            turn = 's'
+        return route
+
+
+    def lane_row(self, lane_id):
+        """
+        Row of the lane in the state, -1 for the lanes that do not enter a traffic light
+        """
+        return self._lane_row.get(lane_id, -1)
+
+
+    def lane_length(self, lane_id):
+        return self._lane_length[lane_id]
+
+
+    def is_incoming(self, road_id):
+        return road_id in self._incoming_road_set
+
+
+    def junction_of(self, edge_id):
+        """
+        Junction at the end of the edge
+        """
+        return self._edge_junction.get(edge_id)
+
+
+    def green_phase(self, action):
+        return self._green_phases[action]
+
+
+    def yellow_phase(self, action):
+        return self._yellow_phases[action]
+
+
+    @property
+    def net_file(self):
+        return self._net_file
+
+
+    @property
+    def tl_ids(self):
+        return self._tl_ids
+
+
+    @property
+    def incoming_roads(self):
+        return self._incoming_roads
+
+
+    @property
+    def incoming_lanes(self):
+        return self._incoming_lanes
+
+
+    @property
+    def num_lanes(self):
+        return len(self._incoming_lanes)
+
+
+    @property
+    def num_actions(self):
+        return len(self._green_phases)
+
+
+    @property
+    def green_lanes(self):
+        return self._green_lanes
+
+
+    @property
+    def entry_roads(self):
+        return self._entry_roads
+
+
+    @property
+    def routes(self):
+        return self._routes
+
+
+@lru_cache(maxsize=None)
+def _load(net_file):
+    return Topology(net_file)
+
+
+def load_topology(net_file):
+    """
+    Topology of the net file, parsed once per process
+    """
+    return _load(os.path.abspath(net_file))
+
+
+if __name__ == "__main__":
+    # summary of a network: python topology.py [net file]
+    topology = load_topology(sys.argv[1] if len(sys.argv) > 1 else os.path.join('intersection', 'environment.net.xml'))
+    print("Traffic lights:", ' '.join(topology.tl_ids))
+    print("Incoming roads:", ' '.join(topology.incoming_roads))
+    print("Incoming lanes:", topology.num_lanes, "- states with 10 cells per lane:", topology.num_lanes * 10)
+    print("Green phases:", [topology.green_phase(action) for action in range(topology.num_actions)],
+          "- yellow phases:", [topology.yellow_phase(action) for action in range(topology.num_actions)])
+    print("Routes:")
+    for route in topology.routes:
+        print("  ", ' '.join(route))
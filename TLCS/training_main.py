@@ -2,64 +2,291 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import os
+import sys
 import datetime
 from shutil import copyfile
 
 from training_simulation import Simulation
+from surrogate_simulation import SurrogateSimulation
 from generator import TrafficGenerator
-from visualization import Visualization
-from utils import import_train_configuration, set_sumo, set_train_path
+from visualization import Visualization, BackgroundPlotter
+from metrics import MetricsStore
+from utils import import_train_configuration, set_sumo, set_traci, set_train_path, set_cpu_profile
 from pdqnagent import PDQNAgent
+from ensemble import EnsembleAgent, EnsembleSimulation
+from profiler import Profiler
+from memprofile import MemoryProfiler, GROWTH_EPISODES
+from topology import load_topology
+from detectors import write_detector_file, DetectorObserver
+from evaluator import BackgroundEvaluator
+from convergence import ConvergenceMonitor
+from session import PersistentSession
+from recording import TraciRecorder
+from rollout import RolloutLearner
 
 
 if __name__ == "__main__":
 
-    config = import_train_configuration(config_file='training_settings.ini')
-    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'])
+    config_file = sys.argv[1] if len(sys.argv) > 1 else 'training_settings.ini'  # a different file is given by the sweep runner
+    config = import_train_configuration(config_file=config_file)
     path = set_train_path(config['models_path_name'])
+    copyfile(src=config_file, dst=os.path.join(path, 'training_settings.ini'))
 
+    # every run generates its demand in its own folder, so that concurrent runs do not share the route file
+    route_file = os.path.join(path, 'episode_routes.rou.xml')
+    Topology = load_topology(os.path.join('intersection', config['net_file_name']))
+
+    # in the detector observation mode the state comes from lane-area detectors on the cells of the incoming lanes
+    detector_file = None
+    if config['observation'] == 'detectors':
+        detector_file = write_detector_file(Topology, os.path.join(path, 'detectors.add.xml'))
+    elif config['observation'] != 'vehicles':
+        sys.exit("unknown observation '%s', use 'vehicles' or 'detectors'" % config['observation'])
+    if config['ensemble_members'] > 1 and (config['rollout_port'] > 0 or config['pretrain_episodes'] > 0):
+        sys.exit("an ensemble is trained in sumo only, set port = 0 in [distributed] and pretrain_episodes = 0 in [surrogate]")
+    if config['ensemble_members'] > 1 and config['convergence']:
+        sys.exit("the best weights of an ensemble are not tracked, set enabled = False in [convergence] or ensemble_members = 1 in [agent]")
+    if detector_file is not None and (config['fidelity'] == 'meso' or config['meso_episodes'] > 0):
+        sys.exit("the lane-area detectors do not work in the mesoscopic model, use observation = vehicles")
+    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'], config['backend'], route_file, config['sumo_cores'], detector_file, config['fidelity'])
+    # coarse and fast episodes first: the mesoscopic model runs the first meso_episodes episodes
+    meso_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'], config['backend'], route_file, config['sumo_cores'], fidelity='meso') if config['meso_episodes'] > 0 else None
+    set_cpu_profile(config['intra_op_threads'], config['inter_op_threads'], config['agent_cores'])
+
+    Profiler = Profiler(
+        path,
+        enabled=config['profiling'],
+        trace=config['profiling_trace']
+    )
+    # sizes of the process and of the data structures after every episode, to find what grows during long sessions
+    MemoryProfiler = MemoryProfiler(
+        path,
+        enabled=config['profiling_memory'],
+        top=config['memory_top']
+    )
+    # in a persistent session one SUMO process is reset with traci.load between the episodes, instead of launched every time
+    Session = PersistentSession(set_traci(config['backend'])) if config['persistent_session'] else None
+    traci_module = Session if Session is not None else set_traci(config['backend'])
+    # the traci calls of every episode can be recorded, to replay the episodes without SUMO with recording.py
+    Recorder = None
+    if config['record_traci']:
+        Recorder = TraciRecorder(traci_module, os.path.join(path, 'recordings'), {
+            key: config[key] for key in ('net_file_name', 'observation', 'num_states', 'max_steps', 'green_duration', 'yellow_duration', 'green_durations')
+        })
+    traci_module = Profiler.instrument_traci(Recorder if Recorder is not None else traci_module)
+    Observer = DetectorObserver(Topology, traci_module, config['num_states']) if detector_file is not None else None
 
     TrafficGen = TrafficGenerator(
         config['max_steps'], 
-        config['n_cars_generated']
+        config['n_cars_generated'],
+        route_file,
+        Topology,
+        streaming=config['streaming_demand'],
+        turning_routes=config['turning_routes']
     )
 
     Visualization = Visualization(
         path, 
         dpi=96
     )
-    Agent = PDQNAgent(config['num_states'], config['num_actions'], config['final_action'])
-        
-    Simulation = Simulation(
-        Agent,
-        TrafficGen,
-        sumo_cmd,
-        config['max_steps'],
-        config['green_duration'],
-        config['yellow_duration'],
-        config['num_states'],
-        config['training_epochs']
+
+    # the stats of every episode are written as soon as it completes, and plotted in the background
+    Metrics = MetricsStore(
+        os.path.join(path, 'metrics.csv'),
+        columns=['episode', 'reward', 'delay', 'queue', 'travel_time']
     )
+    Plotter = BackgroundPlotter(path, 96, Metrics.file_path) if config['background_plots'] else None
+    if config['ensemble_members'] > 1:
+        # several seeds of the same configuration, with their networks stacked and trained in one batched step
+        Agent = EnsembleAgent(
+            config['ensemble_members'],
+            config['num_states'],
+            config['num_actions'],
+            config['final_action'],
+            gamma=config['gamma'],
+            buffer_size=config['memory_size_max'],
+            batch_size=config['batch_size'],
+            num_layers=config['num_layers'],
+            width_layers=config['width_layers'],
+            learning_rate=config['learning_rate'],
+            memory_size_min=config['memory_size_min'],
+            seed=config['ensemble_seed'],
+            memory_storage=config['memory_storage']
+        )
+        Profiler.instrument(Agent, ['train'])
+    else:
+        Agent = PDQNAgent(
+            config['num_states'],
+            config['num_actions'],
+            config['final_action'],
+            gamma=config['gamma'],
+            buffer_size=config['memory_size_max'],
+            batch_size=config['batch_size'],
+            num_layers=config['num_layers'],
+            width_layers=config['width_layers'],
+            learning_rate=config['learning_rate'],
+            memory_size_min=config['memory_size_min'],
+            prefetch_batches=config['prefetch_batches'],
+            memory_storage=config['memory_storage']
+        )
+        Profiler.instrument(Agent, ['select_action', 'train'])
+
+    # greedy episodes on fixed seeds with snapshots of the weights, in parallel with the training
+    Evaluator = BackgroundEvaluator(path, config, config['evaluation_seeds'], detector_file) if config['evaluation_interval'] > 0 else None
+    Policy = Agent.member(0) if config['ensemble_members'] > 1 else Agent  # the first member stands for an ensemble
+
+    # the exploration is shortened, then the training stopped, when the curves flatten, and the best weights are kept
+    Monitor = None
+    if config['convergence']:
+        Monitor = ConvergenceMonitor(
+            path,
+            window=config['convergence_window'],
+            threshold=config['convergence_threshold'],
+            min_episodes=config['convergence_min_episodes'],
+            evaluation_file=Evaluator.file_path if Evaluator is not None else None
+        )
+        
+    if config['rollout_port'] > 0:
+        # the episodes are run by rollout workers (python rollout.py <host> <port>) on this or other machines, this process only learns
+        Simulation = RolloutLearner(Agent, config, config['rollout_host'], config['rollout_port'], config['max_staleness'])
+    else:
+        def build_simulation(Player, training_epochs):
+            Built = Simulation(
+                Recorder.wrap_agent(Player) if Recorder is not None else Player,  # the decisions are recorded with the traci calls
+                TrafficGen,
+                sumo_cmd,
+                config['max_steps'],
+                config['green_duration'],
+                config['yellow_duration'],
+                config['num_states'],
+                training_epochs,
+                traci_module,
+                config['green_durations'],
+                Topology,
+                Observer,
+                meso_cmd,
+                config['meso_episodes']
+            )
+            return Profiler.instrument(Built, ['run', '_get_state', '_collect_waiting_times', '_get_queue_length', 'set_travel_time', 'collect_travel_time', '_simulate'])
+
+        if config['ensemble_members'] > 1:
+            # every member plays the episode in its own Simulation, then the ensemble trains all of them at once
+            Simulation = EnsembleSimulation([build_simulation(Agent.member(k), 0) for k in range(config['ensemble_members'])], Agent, config['training_epochs'])
+        else:
+            Simulation = build_simulation(Agent, config['training_epochs'])
     
+    if config['ensemble_members'] > 1:
+        for k, replay_buffer in enumerate(Agent.replay_buffers):
+            MemoryProfiler.track('replay_buffer_%i' % (k + 1), lambda replay_buffer=replay_buffer: replay_buffer)
+    else:
+        MemoryProfiler.track('replay_buffer', lambda: Agent.replay_buffer)
+    if hasattr(Simulation, 'waiting_times'):
+        MemoryProfiler.track('waiting_times', lambda: Simulation.waiting_times)
+    for store in ('reward_store', 'cumulative_wait_store', 'avg_queue_length_store', 'avg_travel_time_store'):
+        MemoryProfiler.track(store, lambda store=store: getattr(Simulation, store))
+
     episode = 0
+    crashes = 0
     timestamp_start = datetime.datetime.now()
+
+    # optional pretraining on the vectorized surrogate of the network, before training in sumo
+    if config['pretrain_episodes'] > 0:
+        Surrogate = SurrogateSimulation(
+            Agent,
+            os.path.join('intersection', config['net_file_name']),
+            config['surrogate_envs'],
+            config['max_steps'],
+            config['n_cars_generated'],
+            config['yellow_duration'],
+            config['num_states'],
+            config['training_epochs'],
+            green_durations=config['green_durations']
+        )
+        for pretrain_episode in range(config['pretrain_episodes']):
+            print('\n----- Pretraining episode', str(pretrain_episode+1), 'of', str(config['pretrain_episodes']))
+            epsilon = 1.0 - (pretrain_episode / config['pretrain_episodes'])
+            simulation_time, training_time = Surrogate.run(pretrain_episode, epsilon)
+            print('Simulation time:', simulation_time, 's - Training time:', training_time, 's - Total:', round(simulation_time+training_time, 1), 's')
     
     while episode < config['total_episodes']:
-        print('\n----- Episode', str(episode+1), 'of', str(config['total_episodes']))
+        print('\n----- Episode', str(episode+1), 'of', str(config['total_episodes']), '(mesoscopic)' if config['fidelity'] == 'meso' or episode < config['meso_episodes'] else '')
         epsilon = 1.0 - (episode / config['total_episodes'])  # set the epsilon for this episode according to epsilon-greedy policy
-        simulation_time, training_time = Simulation.run(episode, epsilon)  # run the simulation
+        if Monitor is not None:
+            epsilon = Monitor.epsilon(episode, config['total_episodes'])
+        try:
+            # with the pipelined setup the next episode is prepared while the agent trains
+            next_episode = episode + 1 if config['pipelined_setup'] and episode + 1 < config['total_episodes'] else None
+            simulation_time, training_time = Simulation.run(episode, epsilon, next_episode)  # run the simulation
+        except traci_module.FatalTraCIError as error:
+            crashes += 1
+            if Session is None or crashes > 3:
+                raise
+            print("SUMO crashed during the episode (%s), running the episode again" % error)
+            continue
+        crashes = 0
         print('Simulation time:', simulation_time, 's - Training time:', training_time, 's - Total:', round(simulation_time+training_time, 1), 's')
+        if Session is not None and episode in Session.startup_times:
+            print('SUMO startup:', round(Session.startup_times[episode], 3), 's - saved by reusing the process:', round(Session.startup_saving(episode), 3), 's')
+        Metrics.append(
+            episode=episode,
+            reward=Simulation.reward_store[-1],
+            delay=Simulation.cumulative_wait_store[-1],
+            queue=Simulation.avg_queue_length_store[-1],
+            travel_time=Simulation.avg_travel_time_store[-1]
+        )
+        if Recorder is not None:
+            Recorder.save_stats(
+                episode,
+                reward=Simulation.reward_store[-1],
+                delay=Simulation.cumulative_wait_store[-1],
+                queue=Simulation.avg_queue_length_store[-1],
+                travel_time=Simulation.avg_travel_time_store[-1]
+            )
+        if Plotter is not None:
+            Plotter.request()
+        if Evaluator is not None and (episode + 1) % config['evaluation_interval'] == 0:
+            Evaluator.submit(episode, Policy)
+            if Monitor is not None:
+                Monitor.keep_snapshot(episode, Policy.get_weights())
+        record = Profiler.save_episode(episode)
+        if record is not None:
+            print('Stage times:', ', '.join('%s %.2fs' % (name, stage['total_time']) for name, stage in record['stages'].items()))
+        record = MemoryProfiler.save_episode(episode)
+        if record is not None:
+            print('Memory: RSS', record['rss_mb'], 'MB - python', record['traced_mb'], 'MB - replay buffer',
+                  sum(structure['kb'] for name, structure in record['structures'].items() if name.startswith('replay_buffer')), 'kB')
+            if record['growing']:
+                print('Memory growing through the last', GROWTH_EPISODES, 'episodes:', ', '.join(record['growing']))
+        stop = Monitor is not None and Monitor.update(episode, epsilon, Simulation.reward_store[-1], Simulation.avg_queue_length_store[-1], Policy.get_weights)
         episode += 1
+        if stop:
+            break
 
     print("\n----- Start time:", timestamp_start)
     print("----- End time:", datetime.datetime.now())
     print("----- Session info saved at:", path)
 
+    if config['rollout_port'] > 0:
+        Simulation.close()
+    if Session is not None:
+        Session.shutdown()
+        print("----- SUMO launch:", round(Session.launch_time, 3), "s - mean startup of the episodes:", round(sum(Session.startup_times.values()) / len(Session.startup_times), 3), "s - restarts:", Session.restarts)
+    Profiler.close()
+    if MemoryProfiler.enabled:
+        growing = MemoryProfiler.growing()
+        print("----- Memory growing through the last", GROWTH_EPISODES, "episodes:", ', '.join(growing) if growing else 'nothing', "- details in memory.jsonl")
+        MemoryProfiler.close()
+    Agent.close()
     Agent.save_model(path)
 
-    copyfile(src='training_settings.ini', dst=os.path.join(path, 'training_settings.ini'))
-
-    Visualization.save_data_and_plot(data=Simulation.reward_store, filename='reward', xlabel='Episode', ylabel='Cumulative negative reward')
-    Visualization.save_data_and_plot(data=Simulation.cumulative_wait_store, filename='delay', xlabel='Episode', ylabel='Cumulative delay (s)')
-    Visualization.save_data_and_plot(data=Simulation.avg_queue_length_store, filename='queue', xlabel='Episode', ylabel='Average queue length (vehicles)')
-    Visualization.save_data_and_plot(data=Simulation.avg_travel_time_store, filename='average travel time', xlabel='Episode', ylabel='Average travel time of a vehicle')
+    if Plotter is not None:
+        Plotter.close()
+    else:
+        Visualization.plot_metrics(Metrics.file_path)
+    if Evaluator is not None:
+        print("----- Waiting for the evaluation of the last snapshots")
+        Evaluator.close()
+    if Monitor is not None:
+        Monitor.save_best_model(Policy)
+        if Monitor.best_episode is not None:
+            print("----- Best weights: after episode", Monitor.best_episode + 1, "- saved at:", os.path.join(path, 'best_model'))
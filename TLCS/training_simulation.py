@@ -1,7 +1,11 @@
-import traci
+import bisect
+import os
 import numpy as np
+import threading
 import timeit
 
+from topology import load_topology
+
 # phase codes based on environment.net.xml
 PHASE_NS_GREEN = 0  # action 0 code 00
 PHASE_NS_YELLOW = 1
@@ -12,15 +16,39 @@ PHASE_EW_YELLOW = 5
 PHASE_EWL_GREEN = 6  # action 3 code 11
 PHASE_EWL_YELLOW = 7
 
+CELL_LIMITS = [7, 14, 21, 28, 35, 49, 63, 84, 122]  # distance in meters from the traffic light where each cell of a lane ends
+STATE_LANE_LENGTH = 150  # the distance of a car from the traffic light is taken as STATE_LANE_LENGTH - lane position
+
+
+def param_to_green_duration(param, green_durations):
+    """
+    Map the continuous parameter in [-1, 1] to one of the green durations, using bins of equal width
+    """
+    bins = np.linspace(-1, 1, len(green_durations) + 1)[1:-1]
+    return np.asarray(green_durations)[np.digitize(param, bins, right=True)]
+
 
 class Simulation:
-    def __init__(self, Agent, TrafficGen, sumo_cmd, max_steps, green_duration, yellow_duration, num_states, training_epochs):
+    def __init__(self, Agent, TrafficGen, sumo_cmd, max_steps, green_duration, yellow_duration, num_states, training_epochs, traci_module=None, green_durations=(4, 7, 10, 14), Topology=None, Observer=None, meso_cmd=None, meso_episodes=0):
+        if traci_module is None:
+            import traci as traci_module
+        if Topology is None:
+            Topology = load_topology(os.path.join('intersection', 'environment.net.xml'))
+        if Topology.num_lanes * (len(CELL_LIMITS) + 1) != num_states:
+            raise ValueError("the net has %i incoming lanes, which do not match %i states" % (Topology.num_lanes, num_states))
+        self._traci = traci_module
+        self._Topology = Topology
+        self._Observer = Observer  # reads state and queue length from detectors instead of the vehicles, if given
         self._Agent = Agent
         self._TrafficGen = TrafficGen
         self._step = 0
+        self._waiting_times = {}
         self._sumo_cmd = sumo_cmd
+        self._meso_cmd = meso_cmd  # command of the mesoscopic model, run by the episodes before meso_episodes
+        self._meso_episodes = meso_episodes if meso_cmd is not None else 0
         self._max_steps = max_steps
         self._green_duration = green_duration
+        self._green_durations = green_durations
         self._yellow_duration = yellow_duration
         self._num_states = num_states
         self._reward_store = []
@@ -28,17 +56,23 @@ class Simulation:
         self._avg_queue_length_store = []
         self._avg_travel_time_store = []
         self._training_epochs = training_epochs
+        self._preparation = None  # background preparation of the scenario of the next episode
+        self._prepared_episode = None
+        self._preparation_error = None
 
 
-    def run(self, episode, epsilon):
+    def run(self, episode, epsilon, next_episode=None):
         """
-        Runs an episode of simulation, then starts a training session
+        Runs an episode of simulation, then starts a training session. If next_episode is given,
+        the scenario of that episode is prepared in the background during the training session
         """
         start_time = timeit.default_timer()
 
-        # first, generate the route file for this simulation and set up sumo
-        self._TrafficGen.generate_routefile_normal(seed=episode)
-        traci.start(self._sumo_cmd)
+        # first, generate the route file for this simulation and set up sumo (unless it was prepared during the last training)
+        self._wait_scenario(episode)
+        print("Setup time:", round(timeit.default_timer() - start_time, 2), "s")
+        if self._Observer is not None:
+            self._Observer.subscribe()
         print("Simulating...")
 
         # inits
@@ -83,14 +117,7 @@ class Simulation:
                 self._set_yellow_phase(old_action)
                 self._simulate(self._yellow_duration)
             
-            if param[0]<=-0.5:
-                self._green_duration=4
-            elif param<=0:
-                self._green_duration=7
-            elif param[0]<=0.5:
-                self._green_duration=10
-            else:
-                self._green_duration=14
+            self._green_duration = int(param_to_green_duration(param[0], self._green_durations))
             self._set_green_phase(action)
             self._simulate(self._green_duration)
 
@@ -110,9 +137,13 @@ class Simulation:
         
         self._save_episode_stats()
         print("Total reward:", self._sum_neg_reward, "- Epsilon:", round(epsilon, 2))
-        traci.close()
+        self._traci.close()
         simulation_time = round(timeit.default_timer() - start_time, 1)
 
+        # the training does not use sumo, meanwhile the routes of the next episode are generated and sumo started on them
+        if next_episode is not None:
+            self._prepare_scenario_async(next_episode)
+
         print("Training...")
         start_time = timeit.default_timer()
         for _ in range(self._training_epochs):
@@ -122,6 +153,46 @@ class Simulation:
         return simulation_time, training_time
 
 
+    def _prepare_scenario(self, episode):
+        """
+        Generate the route file of the episode and start sumo on it
+        """
+        self._TrafficGen.generate_routefile_normal(seed=episode)
+        cmd = self._meso_cmd if episode < self._meso_episodes else self._sumo_cmd
+        if hasattr(self._traci, 'startup_times'):
+            self._traci.start(cmd, episode=episode)  # a PersistentSession times the startup of every episode
+        else:
+            self._traci.start(cmd)
+
+
+    def _prepare_scenario_async(self, episode):
+        def prepare():
+            try:
+                self._prepare_scenario(episode)
+            except Exception as error:
+                self._preparation_error = error
+        self._prepared_episode = episode
+        self._preparation_error = None
+        self._preparation = threading.Thread(target=prepare, daemon=True)
+        self._preparation.start()
+
+
+    def _wait_scenario(self, episode):
+        """
+        Wait for the scenario prepared in the background, or prepare it now
+        """
+        if self._preparation is not None:
+            self._preparation.join()
+            self._preparation = None
+            if self._preparation_error is not None:
+                print("The background setup failed (%s), setting up again" % self._preparation_error)
+            elif self._prepared_episode == episode:
+                return
+            else:
+                self._traci.close()  # prepared for another episode
+        self._prepare_scenario(episode)
+
+
     def _simulate(self, steps_todo):
         """
         Execute steps in sumo while gathering statistics
@@ -132,7 +203,7 @@ class Simulation:
         tot_trav_time=self.collect_travel_time(self._step)
         self._sum_travel_time+=tot_trav_time
         while steps_todo > 0:
-            traci.simulationStep()  # simulate 1 step in sumo
+            self._traci.simulationStep()  # simulate 1 step in sumo
             self._step += 1 # update the step counter
             steps_todo -= 1
             queue_length = self._get_queue_length()
@@ -141,20 +212,18 @@ class Simulation:
 
 
     def set_travel_time(self):
-        incoming_roads = ["-h11", "-v11", "h12", "v12", "-h21", "-v12", "h22", "v13", "-h12", "-v21", "h13", "v22", "-h22", "-v22", "h23", "v23"]
-        car_list=traci.vehicle.getIDList()
+        car_list=self._traci.vehicle.getIDList()
         for car_id in car_list:
-            for edge_id in incoming_roads:
-                traci.vehicle.setAdaptedTraveltime(car_id,edge_id,10)    
+            for edge_id in self._Topology.incoming_roads:
+                self._traci.vehicle.setAdaptedTraveltime(car_id,edge_id,10)    
 
     def collect_travel_time(self, step):
-        incoming_roads = ["-h11", "-v11", "h12", "v12", "-h21", "-v12", "h22", "v13", "-h12", "-v21", "h13", "v22", "-h22", "-v22", "h23", "v23"]
-        car_list=traci.vehicle.getIDList()
+        car_list=self._traci.vehicle.getIDList()
         tot_trav_time=0
         for car_id in car_list:
-            road_id=traci.vehicle.getRoadID(car_id)
-            if road_id in incoming_roads:
-                travel_time=traci.vehicle.getAdaptedTraveltime(car_id, step, road_id)
+            road_id=self._traci.vehicle.getRoadID(car_id)
+            if self._Topology.is_incoming(road_id):
+                travel_time=self._traci.vehicle.getAdaptedTraveltime(car_id, step, road_id)
                 tot_trav_time+=travel_time
         return tot_trav_time
             
@@ -164,13 +233,12 @@ class Simulation:
         """
         Retrieve the waiting time of every car in the incoming roads
         """
-        incoming_roads = ["-h11", "-v11", "h12", "v12", "-h21", "-v12", "h22", "v13", "-h12", "-v21", "h13", "v22", "-h22", "-v22", "h23", "v23"]
-        car_list = traci.vehicle.getIDList()
+        car_list = self._traci.vehicle.getIDList()
         for car_id in car_list:
-            wait_time = traci.vehicle.getAccumulatedWaitingTime(car_id)
+            wait_time = self._traci.vehicle.getAccumulatedWaitingTime(car_id)
             #print the waiting times
-            road_id = traci.vehicle.getRoadID(car_id)  # get the road id where the car is located
-            if road_id in incoming_roads:  # consider only the waiting times of cars in incoming roads
+            road_id = self._traci.vehicle.getRoadID(car_id)  # get the road id where the car is located
+            if self._Topology.is_incoming(road_id):  # consider only the waiting times of cars in incoming roads
                 self._waiting_times[car_id] = wait_time
             else:
                 if car_id in self._waiting_times: # a car that was tracked has cleared the intersection
@@ -184,60 +252,28 @@ class Simulation:
         """
         Activate the correct yellow light combination in sumo
         """
-        yellow_phase_code = old_action * 2 + 1 # obtain the yellow phase code, based on the old action (ref on environment.net.xml)
-        traci.trafficlight.setPhase("1", yellow_phase_code)
-        traci.trafficlight.setPhase("2", yellow_phase_code)
-        traci.trafficlight.setPhase("5", yellow_phase_code)
-        traci.trafficlight.setPhase("6", yellow_phase_code)
+        yellow_phase_code = self._Topology.yellow_phase(old_action)  # obtain the yellow phase code, based on the old action (ref on environment.net.xml)
+        for tl_id in self._Topology.tl_ids:
+            self._traci.trafficlight.setPhase(tl_id, yellow_phase_code)
 
 
     def _set_green_phase(self, action_number):
         """
         Activate the correct green light combination in sumo
         """
-        if action_number == 0:
-            traci.trafficlight.setPhase("1", PHASE_NS_GREEN)
-            traci.trafficlight.setPhase("2", PHASE_NS_GREEN)
-            traci.trafficlight.setPhase("5", PHASE_NS_GREEN)
-            traci.trafficlight.setPhase("6", PHASE_NS_GREEN)
-        elif action_number == 1:
-            traci.trafficlight.setPhase("1", PHASE_NSL_GREEN)
-            traci.trafficlight.setPhase("2", PHASE_NSL_GREEN)
-            traci.trafficlight.setPhase("5", PHASE_NSL_GREEN)
-            traci.trafficlight.setPhase("6", PHASE_NSL_GREEN)
-        elif action_number == 2:
-            traci.trafficlight.setPhase("1", PHASE_EW_GREEN)
-            traci.trafficlight.setPhase("2", PHASE_EW_GREEN)
-            traci.trafficlight.setPhase("5", PHASE_EW_GREEN)
-            traci.trafficlight.setPhase("6", PHASE_EW_GREEN)
-        elif action_number == 3:
-            traci.trafficlight.setPhase("1", PHASE_EWL_GREEN)
-            traci.trafficlight.setPhase("2", PHASE_EWL_GREEN)
-            traci.trafficlight.setPhase("5", PHASE_EWL_GREEN)
-            traci.trafficlight.setPhase("6", PHASE_EWL_GREEN)
+        green_phase_code = self._Topology.green_phase(action_number)
+        for tl_id in self._Topology.tl_ids:
+            self._traci.trafficlight.setPhase(tl_id, green_phase_code)
 
     def _get_queue_length(self):
         """
         Retrieve the number of cars with speed = 0 in every incoming lane
         """
-        halt_1 = traci.edge.getLastStepHaltingNumber("-h11")
-        halt_2 = traci.edge.getLastStepHaltingNumber("-v11")
-        halt_3 = traci.edge.getLastStepHaltingNumber("h12")
-        halt_4 = traci.edge.getLastStepHaltingNumber("v12")
-        halt_5 = traci.edge.getLastStepHaltingNumber("-h21")
-        halt_6 = traci.edge.getLastStepHaltingNumber("-v12")
-        halt_7 = traci.edge.getLastStepHaltingNumber("h22")
-        halt_8 = traci.edge.getLastStepHaltingNumber("v13")
-        halt_9 = traci.edge.getLastStepHaltingNumber("-h12")
-        halt_10 = traci.edge.getLastStepHaltingNumber("-v21")
-        halt_11 = traci.edge.getLastStepHaltingNumber("h13")
-        halt_12 = traci.edge.getLastStepHaltingNumber("v22")
-        halt_13 = traci.edge.getLastStepHaltingNumber("-h22")
-        halt_14 = traci.edge.getLastStepHaltingNumber("-v22")
-        halt_15 = traci.edge.getLastStepHaltingNumber("h23")
-        halt_16 = traci.edge.getLastStepHaltingNumber("v23")
-        
-        queue_length = halt_1 + halt_2 + halt_3 + halt_4 + halt_5 + halt_6 + halt_7 + halt_8 + halt_9 + halt_10 + halt_11 + halt_12 + halt_13 + halt_14+ halt_15 + halt_16
+        if self._Observer is not None:
+            return self._Observer.get_queue_length()
+        queue_length = 0
+        for road_id in self._Topology.incoming_roads:
+            queue_length += self._traci.edge.getLastStepHaltingNumber(road_id)
         return queue_length
 
 
@@ -245,121 +281,34 @@ class Simulation:
         """
         Retrieve the state of the intersection from sumo, in the form of cell occupancy
         """
+        if self._Observer is not None:
+            return self._Observer.get_state()
         state_pos = np.zeros(self._num_states)
         state_speed=np.zeros(self._num_states)
         state=np.zeros(self._num_states)
-        car_list = traci.vehicle.getIDList()
+        car_list = self._traci.vehicle.getIDList()
         max_speed=0
         min_speed=0
 
         for car_id in car_list:
-            lane_pos = traci.vehicle.getLanePosition(car_id)
-            lane_id = traci.vehicle.getLaneID(car_id)
-            lane_pos = 150 - lane_pos  # inversion of lane pos, so if the car is close to the traffic light -> lane_pos = 0 --- 750 = max len of a road
+            lane_pos = self._traci.vehicle.getLanePosition(car_id)
+            lane_id = self._traci.vehicle.getLaneID(car_id)
+            if not lane_id:
+                # in the mesoscopic model a vehicle is on a segment of an edge, in the queue of one of its lanes
+                lane_id = '%s_%i' % (self._traci.vehicle.getRoadID(car_id), max(self._traci.vehicle.getLaneIndex(car_id), 0))
+            lane_pos = STATE_LANE_LENGTH - lane_pos  # inversion of lane pos, so if the car is close to the traffic light -> lane_pos = 0 --- 750 = max len of a road
 
             # distance in meters from the traffic light -> mapping into cells
-            if lane_pos < 7:
-                lane_cell = 0
-            elif lane_pos < 14:
-                lane_cell = 1
-            elif lane_pos < 21:
-                lane_cell = 2
-            elif lane_pos < 28:
-                lane_cell = 3
-            elif lane_pos < 35:
-                lane_cell = 4
-            elif lane_pos < 49:
-                lane_cell = 5
-            elif lane_pos < 63:
-                lane_cell = 6
-            elif lane_pos < 84:
-                lane_cell = 7
-            elif lane_pos < 122:
-                lane_cell = 8
-            elif lane_pos <=150:
-                lane_cell = 9
-
-            # finding the lane where the car is located 
-            # x2TL_3 are the "turn left only" lanes
-            if lane_id == "-h11_0":
-                lane_group = 0
-            elif lane_id == "-h11_1":
-                lane_group = 1
-            elif lane_id == "-v11_0":
-                lane_group = 2
-            elif lane_id == "-v11_1":
-                lane_group = 3
-            elif lane_id == "h12_0":
-                lane_group = 4
-            elif lane_id == "h12_1":
-                lane_group = 5
-            elif lane_id == "v12_0":
-                lane_group = 6
-            elif lane_id == "v12_1":
-                lane_group = 7
-            elif lane_id == "-h21_0":
-                lane_group = 8
-            elif lane_id == "-h21_1":
-                lane_group = 9
-            elif lane_id == "-v12_0":
-                lane_group = 10
-            elif lane_id == "-v12_1":
-                lane_group = 11
-            elif lane_id == "h22_0":
-                lane_group = 12
-            elif lane_id == "h22_1":
-                lane_group = 13
-            elif lane_id == "v13_0":
-                lane_group = 14
-            elif lane_id == "v13_1":
-                lane_group = 15
-            elif lane_id == "-h12_0":
-                lane_group = 16
-            elif lane_id == "-h12_1":
-                lane_group = 17
-            elif lane_id == "-v21_0":
-                lane_group = 18
-            elif lane_id == "-v21_1":
-                lane_group = 19
-            elif lane_id == "h13_0":
-                lane_group = 20
-            elif lane_id == "h13_1":
-                lane_group = 21
-            elif lane_id == "v22_0":
-                lane_group = 22
-            elif lane_id == "v22_1":
-                lane_group = 23
-            elif lane_id == "-h22_0":
-                lane_group = 24
-            elif lane_id == "-h22_1":
-                lane_group = 25
-            elif lane_id == "-v22_0":
-                lane_group = 26
-            elif lane_id == "-v22_1":
-                lane_group = 27
-            elif lane_id == "h23_0":
-                lane_group = 28
-            elif lane_id == "h23_1":
-                lane_group = 29
-            elif lane_id == "v23_0":
-                lane_group = 30
-            elif lane_id == "v23_1":
-                lane_group = 31
-            else:
-                lane_group = -1
-
-            if lane_group >= 1 and lane_group <= 31:
-                car_position = int(str(lane_group) + str(lane_cell))  # composition of the two postion ID to create a number in interval 0-79
-                valid_car = True
-            elif lane_group == 0:
-                car_position = lane_cell
-                valid_car = True
-            else:
-                valid_car = False  # flag for not detecting cars crossing the intersection or driving away from it
+            lane_cell = bisect.bisect_right(CELL_LIMITS, lane_pos)
+
+            # finding the lane where the car is located, -1 for cars crossing the intersection or driving away from it
+            lane_group = self._Topology.lane_row(lane_id)
+            valid_car = lane_group >= 0
+            car_position = lane_group * 10 + lane_cell  # composition of the two postion ID to create a number in interval 0-319
 
             if valid_car:
                 state_pos[car_position]=1
-                speed=traci.vehicle.getSpeed(car_id)
+                speed=self._traci.vehicle.getSpeed(car_id)
                 max_speed=max(max_speed,speed)
                 if min_speed==0:
                     min_speed=speed
@@ -387,6 +336,11 @@ class Simulation:
         self._avg_travel_time_store.append(self._sum_travel_time/ 200)
 
 
+    @property
+    def waiting_times(self):
+        return self._waiting_times
+
+
     @property
     def reward_store(self):
         return self._reward_store
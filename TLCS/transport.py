@@ -0,0 +1,220 @@
+import multiprocessing
+import queue
+import sys
+import time
+import timeit
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from memory import ReplayBuffer
+
+BACKOFF = 0.0005  # seconds a producer sleeps while its ring is full
+
+
+class TransitionRing:
+    """
+    Single-producer single-consumer ring of transitions in shared memory. A rollout worker writes
+    (state, action, reward, next_state, done, param) straight into the segment and the learner
+    ingests all the pending transitions at once, without pickling or per-transition messages
+    """
+    def __init__(self, capacity, state_dim, param_dim, name=None, create=True):
+        self._capacity = capacity
+        self._state_dim = state_dim
+        self._param_dim = param_dim
+        self._owner = create
+
+        fields = [
+            ('counters', np.int64, (2,)),  # transitions written by the producer, transitions read by the consumer
+            ('states', np.float64, (capacity, state_dim)),
+            ('next_states', np.float64, (capacity, state_dim)),
+            ('params', np.float64, (capacity, param_dim)),
+            ('rewards', np.float64, (capacity,)),
+            ('actions', np.int64, (capacity,)),
+            ('dones', np.bool_, (capacity,)),
+        ]
+        size = sum(int(np.prod(shape)) * np.dtype(dtype).itemsize for _, dtype, shape in fields)
+        if create:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+
+        # every field is a numpy view on the segment, 8-byte fields first so that all of them stay aligned
+        offset = 0
+        self._fields = {}
+        for field, dtype, shape in fields:
+            self._fields[field] = np.ndarray(shape, dtype=dtype, buffer=self._shm.buf, offset=offset)
+            offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        self._counters = self._fields['counters']
+        if create:
+            self._counters[:] = 0
+
+
+    @classmethod
+    def attach(cls, spec):
+        """
+        Open in another process the ring described by spec()
+        """
+        name, capacity, state_dim, param_dim = spec
+        return cls(capacity, state_dim, param_dim, name=name, create=False)
+
+
+    def spec(self):
+        """
+        Picklable description of the ring, to attach to it from a worker process
+        """
+        return self._shm.name, self._capacity, self._state_dim, self._param_dim
+
+
+    def put(self, state, action, reward, next_state, done, param, timeout=None):
+        """
+        Write one transition, waiting while the ring is full (backpressure on the producer).
+        Raises queue.Full if the learner did not make room within timeout seconds
+        """
+        written = int(self._counters[0])
+        deadline = None if timeout is None else timeit.default_timer() + timeout
+        while written - int(self._counters[1]) >= self._capacity:
+            if deadline is not None and timeit.default_timer() > deadline:
+                raise queue.Full
+            time.sleep(BACKOFF)
+        i = written % self._capacity
+        fields = self._fields
+        fields['states'][i] = state
+        fields['actions'][i] = action
+        fields['rewards'][i] = reward
+        fields['next_states'][i] = next_state
+        fields['dones'][i] = done
+        fields['params'][i] = param
+        self._counters[0] = written + 1  # publish the transition only once it is complete
+
+    add_experience = put  # same signature as PDQNAgent.add_experience
+
+
+    def consume(self, ingest, max_items=None):
+        """
+        Pass the pending transitions to ingest(states, actions, rewards, next_states, dones, params) as views
+        on the segment (two calls when they wrap around the end of the ring), then free their slots.
+        Returns the number of transitions consumed
+        """
+        read = int(self._counters[1])
+        available = int(self._counters[0]) - read
+        if max_items is not None:
+            available = min(available, max_items)
+        fields = self._fields
+        consumed = 0
+        while consumed < available:
+            start = (read + consumed) % self._capacity
+            n = min(available - consumed, self._capacity - start)
+            end = start + n
+            ingest(fields['states'][start:end], fields['actions'][start:end], fields['rewards'][start:end],
+                   fields['next_states'][start:end], fields['dones'][start:end], fields['params'][start:end])
+            consumed += n
+        self._counters[1] = read + available
+        return available
+
+
+    def pending(self):
+        return int(self._counters[0]) - int(self._counters[1])
+
+
+    def close(self):
+        """
+        Release the views and the segment, the process that created the ring also removes it
+        """
+        self._fields = {}
+        self._counters = None
+        self._shm.close()
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass  # removed at the exit of a worker process that attached to it
+
+
+def _ring_worker(spec, stop, states):
+    ring = TransitionRing.attach(spec)
+    i = 0
+    try:
+        while not stop.is_set():
+            try:
+                ring.put(states[i % len(states)], i % 4, -1.0, states[(i + 1) % len(states)], False, np.zeros(1), timeout=0.1)
+                i += 1
+            except queue.Full:
+                continue
+    finally:
+        ring.close()
+
+
+def _queue_worker(transitions, stop, states):
+    i = 0
+    while not stop.is_set():
+        try:
+            transitions.put((states[i % len(states)], i % 4, -1.0, states[(i + 1) % len(states)], False, np.zeros(1)), timeout=0.1)
+            i += 1
+        except queue.Full:
+            continue
+
+
+def benchmark(n_workers, seconds, state_dim=320, param_dim=1, capacity=4096):
+    """
+    Transitions per second delivered into a ReplayBuffer by n_workers processes, through
+    shared memory rings and, for comparison, through a multiprocessing.Queue of pickled tuples
+    """
+    states = np.random.uniform(0, 2, (64, state_dim))
+    results = {}
+
+    # shared memory rings, one per worker
+    replay_buffer = ReplayBuffer(20000)
+    rings = [TransitionRing(capacity, state_dim, param_dim) for _ in range(n_workers)]
+    stop = multiprocessing.Event()
+    workers = [multiprocessing.Process(target=_ring_worker, args=(ring.spec(), stop, states)) for ring in rings]
+    for worker in workers:
+        worker.start()
+    received = 0
+    start_time = timeit.default_timer()
+    while timeit.default_timer() - start_time < seconds:
+        for ring in rings:
+            received += ring.consume(replay_buffer.add_batch)
+    results['shared_memory'] = received / (timeit.default_timer() - start_time)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    for ring in rings:
+        ring.close()
+
+    # pickled tuples through a queue
+    replay_buffer = ReplayBuffer(20000)
+    transitions = multiprocessing.Queue(capacity)
+    stop = multiprocessing.Event()
+    workers = [multiprocessing.Process(target=_queue_worker, args=(transitions, stop, states)) for _ in range(n_workers)]
+    for worker in workers:
+        worker.start()
+    received = 0
+    start_time = timeit.default_timer()
+    while timeit.default_timer() - start_time < seconds:
+        try:
+            replay_buffer.add(transitions.get(timeout=0.1))
+            received += 1
+        except queue.Empty:
+            continue
+    results['queue'] = received / (timeit.default_timer() - start_time)
+    stop.set()
+    while any(worker.is_alive() for worker in workers):
+        try:
+            transitions.get(timeout=0.1)  # unblock the workers waiting on a full queue
+        except queue.Empty:
+            pass
+    for worker in workers:
+        worker.join()
+
+    return results
+
+
+if __name__ == "__main__":
+    # python transport.py [n_workers] [seconds]
+    n_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    results = benchmark(n_workers, seconds)
+    print("----- Transitions/sec with", n_workers, "workers")
+    for transport, rate in results.items():
+        print("%s: %.0f" % (transport, rate))
@@ -1,8 +1,11 @@
 import configparser
-from sumolib import checkBinary
 import os
 import sys
 
+# options of the mesoscopic model: the traffic lights control the junction as in the microscopic model, the vehicles
+# queue by the edge they turn into, and the segments are short enough to place the queued vehicles within a few cells
+MESO_OPTIONS = ["--mesosim", "true", "--meso-junction-control", "true", "--meso-multi-queue", "true", "--meso-edgelength", "30"]
+
 
 def import_train_configuration(config_file):
     """
@@ -12,11 +15,20 @@ def import_train_configuration(config_file):
     content.read(config_file)
     config = {}
     config['gui'] = content['simulation'].getboolean('gui')
+    config['backend'] = content['simulation'].get('backend', fallback='sumo')
     config['total_episodes'] = content['simulation'].getint('total_episodes')
     config['max_steps'] = content['simulation'].getint('max_steps')
     config['n_cars_generated'] = content['simulation'].getint('n_cars_generated')
     config['green_duration'] = content['simulation'].getint('green_duration')
     config['yellow_duration'] = content['simulation'].getint('yellow_duration')
+    config['green_durations'] = [int(value) for value in content['simulation'].get('green_durations', fallback='4, 7, 10, 14').split(',')]
+    config['observation'] = content['simulation'].get('observation', fallback='vehicles')
+    config['persistent_session'] = content['simulation'].getboolean('persistent_session', fallback=False)
+    config['pipelined_setup'] = content['simulation'].getboolean('pipelined_setup', fallback=False)
+    config['streaming_demand'] = content['simulation'].getboolean('streaming_demand', fallback=False)
+    config['turning_routes'] = content['simulation'].getboolean('turning_routes', fallback=False)  # all the turns, instead of the routes r1-r16
+    config['fidelity'] = content['simulation'].get('fidelity', fallback='micro')
+    config['meso_episodes'] = content['simulation'].getint('meso_episodes', fallback=0)  # first episodes in the mesoscopic model, then the fidelity above
     config['delta'] = content['simulation'].getint('delta')
     config['num_layers'] = content['model'].getint('num_layers')
     config['width_layers'] = content['model'].getint('width_layers')
@@ -25,12 +37,38 @@ def import_train_configuration(config_file):
     config['training_epochs'] = content['model'].getint('training_epochs')
     config['memory_size_min'] = content['memory'].getint('memory_size_min')
     config['memory_size_max'] = content['memory'].getint('memory_size_max')
+    config['prefetch_batches'] = content['memory'].getint('prefetch_batches', fallback=0)
+    config['memory_storage'] = content['memory'].get('storage', fallback='full')
     config['num_states'] = content['agent'].getint('num_states')
     config['num_actions'] = content['agent'].getint('num_actions')
     config['final_action'] = content['agent'].getint('final_action')
     config['gamma'] = content['agent'].getfloat('gamma')
+    config['ensemble_members'] = content['agent'].getint('ensemble_members', fallback=1)
+    config['ensemble_seed'] = content['agent'].getint('ensemble_seed', fallback=0)
+    config['pretrain_episodes'] = content.getint('surrogate', 'pretrain_episodes', fallback=0)  # the surrogate states normalize the speeds over the whole state, see SurrogateSimulation
+    config['surrogate_envs'] = content.getint('surrogate', 'n_envs', fallback=256)
+    config['profiling'] = content.getboolean('profiling', 'enabled', fallback=False)
+    config['profiling_trace'] = content.getboolean('profiling', 'trace', fallback=False)
+    config['record_traci'] = content.getboolean('profiling', 'record_traci', fallback=False)
+    config['profiling_memory'] = content.getboolean('profiling', 'memory', fallback=False)
+    config['memory_top'] = content.getint('profiling', 'memory_top', fallback=10)
+    config['background_plots'] = content.getboolean('visualization', 'background_plots', fallback=False)
+    config['rollout_host'] = content.get('distributed', 'host', fallback='127.0.0.1')
+    config['rollout_port'] = content.getint('distributed', 'port', fallback=0)
+    config['max_staleness'] = content.getint('distributed', 'max_staleness', fallback=8)
+    config['evaluation_interval'] = content.getint('evaluation', 'interval', fallback=0)
+    config['evaluation_seeds'] = [int(seed) for seed in content.get('evaluation', 'seeds', fallback='10000, 10001, 10002').split(',')]
+    config['convergence'] = content.getboolean('convergence', 'enabled', fallback=False)
+    config['convergence_window'] = content.getint('convergence', 'window', fallback=10)
+    config['convergence_threshold'] = content.getfloat('convergence', 'threshold', fallback=0.01)
+    config['convergence_min_episodes'] = content.getint('convergence', 'min_episodes', fallback=20)
+    config['intra_op_threads'] = content.getint('cpu', 'intra_op_threads', fallback=0)
+    config['inter_op_threads'] = content.getint('cpu', 'inter_op_threads', fallback=0)
+    config['agent_cores'] = parse_cores(content.get('cpu', 'agent_cores', fallback=''))
+    config['sumo_cores'] = parse_cores(content.get('cpu', 'sumo_cores', fallback=''))
     config['models_path_name'] = content['dir']['models_path_name']
     config['sumocfg_file_name'] = content['dir']['sumocfg_file_name']
+    config['net_file_name'] = content['dir'].get('net_file_name', fallback='environment.net.xml')
     return config
 
 
@@ -42,9 +80,14 @@ def import_test_configuration(config_file):
     content.read(config_file)
     config = {}
     config['gui'] = content['simulation'].getboolean('gui')
+    config['backend'] = content['simulation'].get('backend', fallback='sumo')
     config['max_steps'] = content['simulation'].getint('max_steps')
     config['n_cars_generated'] = content['simulation'].getint('n_cars_generated')
-    config['episode_seed'] = content['simulation'].getint('episode_seed')
+    config['streaming_demand'] = content['simulation'].getboolean('streaming_demand', fallback=False)
+    config['turning_routes'] = content['simulation'].getboolean('turning_routes', fallback=False)  # all the turns, instead of the routes r1-r16
+    config['fidelity'] = content['simulation'].get('fidelity', fallback='micro')
+    config['episode_seeds'] = [int(seed) for seed in content['simulation'].get('episode_seed').split(',')]  # one seed or a list of them
+    config['episode_seed'] = config['episode_seeds'][0]
     config['green_duration'] = content['simulation'].getint('green_duration')
     config['delta'] = content['simulation'].getint('delta')
     config['yellow_duration'] = content['simulation'].getint('yellow_duration')
@@ -53,19 +96,35 @@ def import_test_configuration(config_file):
     config['sumocfg_file_name'] = content['dir']['sumocfg_file_name']
     config['models_path_name'] = content['dir']['models_path_name']
     config['model_to_test'] = content['dir'].getint('model_to_test') 
+    config['net_file_name'] = content['dir'].get('net_file_name', fallback='environment.net.xml')
+    config['cache_enabled'] = content.getboolean('cache', 'enabled', fallback=False)
+    config['cache_folder'] = content.get('cache', 'folder', fallback=os.path.join(config['models_path_name'], 'evaluation_cache'))
+    config['cache_max_mb'] = content.getfloat('cache', 'max_mb', fallback=200)
     return config
 
 
-def set_sumo(gui, sumocfg_file_name, max_steps):
+def set_sumo(gui, sumocfg_file_name, max_steps, backend='sumo', route_file=None, sumo_cores=None, additional_file=None, fidelity='micro'):
     """
     Configure various parameters of SUMO
     """
+    # the pure-python stand-in only needs the sumocfg file, no SUMO installation
+    if backend == 'fake':
+        sumo_cmd = ['fake_sumo', "-c", os.path.join('intersection', sumocfg_file_name), "--no-step-log", "true", "--waiting-time-memory", str(max_steps)]
+        if route_file is not None:
+            sumo_cmd += ["--route-files", route_file]
+        if additional_file is not None:
+            sumo_cmd += ["--additional-files", additional_file]
+        if fidelity == 'meso':
+            sumo_cmd += MESO_OPTIONS  # ignored by the stand-in, which has one model of the traffic
+        return sumo_cmd
+
     # sumo things - we need to import python modules from the $SUMO_HOME/tools directory
     if 'SUMO_HOME' in os.environ:
         tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
         sys.path.append(tools)
     else:
         sys.exit("please declare environment variable 'SUMO_HOME'")
+    from sumolib import checkBinary
 
     # setting the cmd mode or the visual mode    
     if gui == False:
@@ -76,26 +135,96 @@ def set_sumo(gui, sumocfg_file_name, max_steps):
     # setting the cmd command to run sumo at simulation time
     sumo_cmd = [sumoBinary, "-c", os.path.join('intersection', sumocfg_file_name), "--no-step-log", "true", "--waiting-time-memory", str(max_steps)]
 
+    # a route file outside the intersection folder lets concurrent runs generate their own demand
+    if route_file is not None:
+        sumo_cmd += ["--route-files", route_file]
+
+    # the detectors of the detector observation mode are added to the ones of the sumocfg
+    if additional_file is not None:
+        sumo_cmd += ["--additional-files", additional_file]
+
+    # the mesoscopic model moves queues of vehicles between segments of the edges instead of every vehicle
+    if fidelity == 'meso':
+        sumo_cmd += MESO_OPTIONS
+    elif fidelity != 'micro':
+        sys.exit("unknown fidelity '%s', use 'micro' or 'meso'" % fidelity)
+
+    # pin sumo to its own cores, away from the ones used by tensorflow
+    if sumo_cores:
+        sumo_cmd = ["taskset", "-c", ",".join(str(core) for core in sumo_cores)] + sumo_cmd
+
     return sumo_cmd
 
 
+def parse_cores(cores):
+    """
+    Parse a list of cpu cores like "0-3,6" into a sorted list of integers, an empty string means no list
+    """
+    parsed = set()
+    for part in cores.split(','):
+        part = part.strip()
+        if '-' in part:
+            first, last = part.split('-')
+            parsed.update(range(int(first), int(last) + 1))
+        elif part:
+            parsed.add(int(part))
+    return sorted(parsed)
+
+
+def set_cpu_profile(intra_op_threads, inter_op_threads, agent_cores):
+    """
+    Configure the tensorflow thread pools (0 keeps the tensorflow default) and pin the training process to
+    agent_cores, so that the remaining cores are left to sumo. Must be called before tensorflow runs any operation
+    """
+    import tensorflow as tf
+    if intra_op_threads > 0:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    if inter_op_threads > 0:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    if agent_cores:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, agent_cores)
+        else:
+            print("cpu affinity is not supported on this platform, agent_cores is ignored")
+
+
+def set_traci(backend):
+    """
+    Return the module implementing the traci API for the chosen simulation backend
+    """
+    if backend == 'fake':
+        import fake_traci
+        return fake_traci
+    elif backend == 'sumo':
+        import traci
+        return traci
+    else:
+        sys.exit("unknown simulation backend '%s', use 'sumo' or 'fake'" % backend)
+
+
 def set_train_path(models_path_name):
     """
     Create a new model path with an incremental integer, also considering previously created model paths
     """
     models_path = os.path.join(os.getcwd(), models_path_name, '')
-    os.makedirs(os.path.dirname(models_path), exist_ok=True)
+    return allocate_path(models_path, 'model_')
 
-    dir_content = os.listdir(models_path)
-    if dir_content:
-        previous_versions = [int(name.split("_")[1]) for name in dir_content]
-        new_version = str(max(previous_versions) + 1)
-    else:
-        new_version = '1'
 
-    data_path = os.path.join(models_path, 'model_'+new_version, '')
-    os.makedirs(os.path.dirname(data_path), exist_ok=True)
-    return data_path 
+def allocate_path(parent_path, prefix):
+    """
+    Create the folder prefix+N in parent_path with the next free integer N. Creating the folder is what
+    allocates it, so concurrent runs that pick the same N retry with the next one instead of sharing it
+    """
+    os.makedirs(parent_path, exist_ok=True)
+    while True:
+        previous_versions = [int(name[len(prefix):]) for name in os.listdir(parent_path) if name.startswith(prefix) and name[len(prefix):].isdigit()]
+        new_version = str(max(previous_versions, default=0) + 1)
+        data_path = os.path.join(parent_path, prefix+new_version, '')
+        try:
+            os.mkdir(data_path)
+            return data_path
+        except FileExistsError:
+            continue
 
 
 def set_test_path(models_path_name, model_n):
@@ -1,5 +1,20 @@
+import matplotlib
+matplotlib.use('Agg')  # plots are only saved to file, also from the background plotting process
 import matplotlib.pyplot as plt
+import multiprocessing
 import os
+import sys
+
+from metrics import read_metrics
+
+# metrics of the training session: (column of the metrics store, plot file name, x label, y label)
+TRAINING_PLOTS = [
+    ('reward', 'reward', 'Episode', 'Cumulative negative reward'),
+    ('delay', 'delay', 'Episode', 'Cumulative delay (s)'),
+    ('queue', 'queue', 'Episode', 'Average queue length (vehicles)'),
+    ('travel_time', 'average travel time', 'Episode', 'Average travel time of a vehicle'),
+]
+
 
 class Visualization:
     def __init__(self, path, dpi):
@@ -29,4 +44,55 @@ class Visualization:
         with open(os.path.join(self._path, 'plot_'+filename + '_data.txt'), "w") as file:
             for value in data:
                     file.write("%s\n" % value)
-    
\ No newline at end of file
+
+
+    def plot_metrics(self, metrics_file, plots=TRAINING_PLOTS):
+        """
+        Produce the plots of the session from the metrics store
+        """
+        data = read_metrics(metrics_file)
+        for column, filename, xlabel, ylabel in plots:
+            if data[column]:
+                self.save_data_and_plot(data=data[column], filename=filename, xlabel=xlabel, ylabel=ylabel)
+
+
+class BackgroundPlotter:
+    """
+    Renders the plots of the metrics store in a separate process, so that plotting does not add to the session time
+    """
+    def __init__(self, path, dpi, metrics_file, plots=TRAINING_PLOTS):
+        self._requests = multiprocessing.Queue()
+        self._process = multiprocessing.Process(target=_plot_worker, args=(path, dpi, metrics_file, plots, self._requests), daemon=True)
+        self._process.start()
+
+
+    def request(self):
+        """
+        Ask for the plots to be refreshed, requests made while a refresh is running are merged
+        """
+        self._requests.put(True)
+
+
+    def close(self):
+        """
+        Render the final plots and wait for the plotting process to finish
+        """
+        self._requests.put(None)
+        self._process.join()
+
+
+def _plot_worker(path, dpi, metrics_file, plots, requests):
+    visualization = Visualization(path, dpi)
+    running = True
+    while running:
+        request = requests.get()
+        while request is not None and not requests.empty():
+            request = requests.get()
+        running = request is not None
+        visualization.plot_metrics(metrics_file, plots)
+
+
+if __name__ == "__main__":
+    # on demand plotting: python visualization.py <model folder>
+    model_path = sys.argv[1]
+    Visualization(model_path, dpi=96).plot_metrics(os.path.join(model_path, 'metrics.csv'))